@@ -0,0 +1,12 @@
+"""
+Headless benchmarks of the game hot paths.
+
+Run from the src directory with `python -m benchmarks`. pyglet is switched
+to headless (offscreen EGL) mode with the silent audio driver here, before
+anything imports pyglet.window, so the suite runs on machines without a
+display or sound card.
+"""
+import pyglet
+
+pyglet.options['headless'] = True
+pyglet.options['audio'] = ('silent',)
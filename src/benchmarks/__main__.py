@@ -0,0 +1,58 @@
+"""
+Usage, from the src directory:
+
+    python -m benchmarks                        # run everything
+    python -m benchmarks -k gameplay            # only names containing it
+    python -m benchmarks --save baseline.json   # store a baseline
+    python -m benchmarks --compare baseline.json --fail-on-regression
+"""
+from argparse import ArgumentParser
+from sys import exit
+
+from . import hot_paths  # noqa: F401 (registers the benchmarks)
+from .runner import (
+    BENCHMARKS,
+    compare_results,
+    load_results,
+    run_suite,
+    save_results,
+)
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('-n', '--ticks', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument(
+        '-k', '--filter', default='', help='Only run names containing this'
+    )
+    parser.add_argument('--save', metavar='JSON', help='Store the results')
+    parser.add_argument(
+        '--compare', metavar='JSON', help='Compare with stored results'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.10,
+        help='Slowdown of the mean counted as a regression (0.10 = 10%%)',
+    )
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run_suite(names=names, ticks=args.ticks, warmup=args.warmup)
+    if args.save:
+        save_results(results=results, path=args.save)
+    if args.compare:
+        regressions = compare_results(
+            baseline=load_results(path=args.compare),
+            current=results,
+            threshold=args.threshold,
+        )
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,177 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pyglet.gl import glFinish
+from pyglet.graphics import Batch
+
+from game_modules.ai import AIController
+from game_modules.batch import BatchAI, BatchSimulation
+from game_modules.consts import TICK_RATE
+from game_modules.game_states import MainMenuState, OptionMenuState
+from game_modules.gameplay_states import GameplayState
+from game_modules.multiball import MultiBallSimulation
+from game_modules.particles import ParticleSystem
+from game_modules.telemetry import PADDLE_HIT, Telemetry
+
+from .runner import benchmark
+
+
+def enter_state(game, state_class):
+    """Makes a fresh stack with state_class on top and returns the state"""
+    while game.states:
+        game.pop_state()
+    game.push_state(state=game.get_state(state_class))
+    return game.state
+
+
+def draw_tick(game, state):
+    def tick():
+        game.clear()
+        state.interpolate(alpha=game.interpolation_alpha)
+        state.draw()
+        # Wait for the GPU, so the time covers the whole draw
+        glFinish()
+
+    return tick
+
+
+@benchmark('main_menu.update')
+def main_menu_update(context):
+    state = enter_state(context.game, MainMenuState)
+    dt = context.game.tick_interval
+    return lambda: state.update(dt=dt)
+
+
+@benchmark('gameplay.update')
+def gameplay_update(context):
+    context.game.seed = 1
+    state = enter_state(context.game, GameplayState)
+    context.game.seed = None
+    # Hard CPUs on both sides keep the rally going: once a match is won,
+    # update only animates the sparks left
+    state.controllers[:] = [
+        AIController(side=side, difficulty='hard', seed=side)
+        for side in (1, 2)
+    ]
+    dt = context.game.tick_interval
+
+    def tick():
+        state.update(dt=dt)
+        if state.winner is not None:
+            raise RuntimeError('The match ended while being measured')
+
+    return tick
+
+
+def gameplay_system(name: str, step: str):
+    def setup(context):
+        state = enter_state(context.game, GameplayState)
+        system = state.world.get_system(name)
+        if step == 'render':
+            alpha = context.game.interpolation_alpha
+            return lambda: system.render(state.world, alpha)
+        dt = context.game.tick_interval
+        return lambda: system.update(state.world, dt)
+
+    return setup
+
+
+# Each system of a match on its own, as the profiler overlay shows them
+for name, step in (
+    ('input', 'update'),
+    ('physics', 'update'),
+    ('audio', 'update'),
+    ('effects', 'update'),
+    ('effects', 'render'),
+    ('shapes', 'render'),
+):
+    benchmark(f'gameplay.{name}.{step}')(gameplay_system(name, step))
+
+
+@benchmark('main_menu.draw')
+def main_menu_draw(context):
+    state = enter_state(context.game, MainMenuState)
+    return draw_tick(context.game, state)
+
+
+@benchmark('option_menu.draw')
+def option_menu_draw(context):
+    enter_state(context.game, MainMenuState)
+    context.game.push_state(context.game.get_state(OptionMenuState))
+    return draw_tick(context.game, context.game.state)
+
+
+@benchmark('gameplay.draw')
+def gameplay_draw(context):
+    state = enter_state(context.game, GameplayState)
+    return draw_tick(context.game, state)
+
+
+@benchmark('batch.step')
+def batch_step(context):
+    batch = BatchSimulation(1000, seed=1)
+    players = [BatchAI(batch, side, seed=side) for side in (1, 2)]
+    dt = 1 / TICK_RATE
+
+    def tick():
+        batch.step(players[0].read(dt) | players[1].read(dt), dt)
+
+    return tick
+
+
+def multiball(count: int, collisions_only: bool = False):
+    def setup(context):
+        simulation = MultiBallSimulation(count, seed=1)
+        if collisions_only:
+            return simulation.collide_balls
+        dt = 1 / TICK_RATE
+        return lambda: simulation.step(inputs=0, dt=dt)
+
+    return setup
+
+
+# Several sizes, to compare the cost per ball as the count grows
+for count in (100, 1000, 10_000):
+    benchmark(f'multiball.step[{count}]')(multiball(count))
+    benchmark(f'multiball.collide[{count}]')(
+        multiball(count, collisions_only=True)
+    )
+
+
+def particles(active: int):
+    def setup(context):
+        system = ParticleSystem(batch=Batch())
+        # Lifetimes long enough for all of them to stay alive while timed
+        system.emit(
+            x=range(active),
+            y=300.0,
+            vx=10.0,
+            vy=10.0,
+            lifetime=1e9,
+            color=(255, 255, 255, 255),
+        )
+        dt = 1 / TICK_RATE
+
+        def frame():
+            system.update(dt)
+            system.sync()
+
+        return frame
+
+    return setup
+
+
+# The same capacity with none, half or all particles alive: the cost of a
+# frame should not change
+for active in (0, 1024, 2048):
+    benchmark(f'particles.frame[{active}]')(particles(active))
+
+
+@benchmark('telemetry.emit')
+def telemetry_emit(context):
+    # Flushed by its thread meanwhile, like in the game
+    directory = TemporaryDirectory()
+    telemetry = Telemetry(Path(directory.name) / 'benchmark.jsonl')
+    context.teardown(telemetry.close)
+    context.teardown(directory.cleanup)
+    return lambda: telemetry.emit(PADDLE_HIT, 30.0, 300.0, 282.8)
@@ -0,0 +1,186 @@
+import json
+import subprocess
+import sys
+import tracemalloc
+from platform import python_version
+from time import perf_counter_ns
+from typing import Callable, Optional
+
+# Benchmark name => setup function. A setup function receives the context,
+# prepares whatever it measures and returns the function run on every tick.
+BENCHMARKS: dict[str, Callable] = {}
+
+
+def benchmark(name: str) -> Callable:
+    def register(setup: Callable) -> Callable:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+class BenchmarkContext:
+    """Shared by every benchmark, builds the headless game on first use"""
+
+    def __init__(self) -> None:
+        self._game = None
+        self._teardowns = []
+
+    def teardown(self, callback: Callable) -> None:
+        """Calls callback once the benchmark being set up has run"""
+        self._teardowns.append(callback)
+
+    def finish(self) -> None:
+        """Runs the teardowns of the last benchmark, in the order added"""
+        teardowns, self._teardowns = self._teardowns, []
+        for callback in teardowns:
+            callback()
+
+    @property
+    def game(self):
+        if self._game is None:
+            # Imported here so benchmarks that only need the simulation
+            # never open a GL context
+            from game import Game
+            from game_modules.audio import NullAudioBackend, SoundEffects
+
+            self._game = Game(
+                sound_effects=SoundEffects(backend=NullAudioBackend())
+            )
+        return self._game
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_benchmark(
+    setup: Callable, context: BenchmarkContext, ticks: int, warmup: int
+) -> dict:
+    try:
+        return _measure(setup(context), ticks, warmup)
+    finally:
+        context.finish()
+
+
+def _measure(tick: Callable, ticks: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        tick()
+
+    # Timing pass
+    durations = [0] * ticks
+    for index in range(ticks):
+        start = perf_counter_ns()
+        tick()
+        durations[index] = perf_counter_ns() - start
+    durations.sort()
+
+    # Allocation pass, apart from the timing one as tracing slows it down
+    tracemalloc.start()
+    peak_total = 0
+    start_current, _ = tracemalloc.get_traced_memory()
+    for _ in range(ticks):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        tick()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += max(peak - before, 0)
+    end_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ticks': ticks,
+        'mean_us': sum(durations) / ticks / 1000,
+        'p50_us': percentile(durations, 0.50) / 1000,
+        'p99_us': percentile(durations, 0.99) / 1000,
+        'alloc_peak_bytes': peak_total / ticks,
+        'alloc_retained_bytes': (end_current - start_current) / ticks,
+    }
+
+
+def run_suite(
+    names: list[str], ticks: int, warmup: int, output=sys.stdout
+) -> dict:
+    context = BenchmarkContext()
+    results = {}
+    for name in names:
+        results[name] = run_benchmark(
+            setup=BENCHMARKS[name],
+            context=context,
+            ticks=ticks,
+            warmup=warmup,
+        )
+        print(format_result(name, results[name]), file=output)
+    return {'meta': _meta(), 'results': results}
+
+
+def format_result(name: str, result: dict) -> str:
+    return (
+        f'{name:<28} mean {result["mean_us"]:9.2f} us  '
+        f'p50 {result["p50_us"]:9.2f} us  p99 {result["p99_us"]:9.2f} us  '
+        f'alloc {result["alloc_peak_bytes"]:9.0f} B/tick'
+    )
+
+
+def save_results(results: dict, path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_results(
+    baseline: dict, current: dict, threshold: float, output=sys.stdout
+) -> list[str]:
+    """
+    Prints how each benchmark moved against the baseline and returns the
+    names that got slower (mean) by more than threshold, as a fraction
+    """
+    regressions = []
+    print(
+        f'Against {baseline["meta"].get("commit") or "baseline"}:',
+        file=output,
+    )
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:<28} new', file=output)
+            continue
+        change = result['mean_us'] / before['mean_us'] - 1
+        mark = ''
+        if change > threshold:
+            mark = '  REGRESSION'
+            regressions.append(name)
+        print(
+            f'{name:<28} mean {before["mean_us"]:9.2f} -> '
+            f'{result["mean_us"]:9.2f} us ({change:+.1%})  p99 '
+            f'{before["p99_us"]:9.2f} -> {result["p99_us"]:9.2f} us{mark}',
+            file=output,
+        )
+    return regressions
+
+
+def _meta() -> dict:
+    import pyglet
+
+    return {
+        'commit': _git_commit(),
+        'python': python_version(),
+        'pyglet': pyglet.version,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -1,44 +1,468 @@
-from sys import exit
+from time import perf_counter
 
-from pyglet.app import run
-from pyglet.clock import schedule_interval
+# Taken before the other imports, so the startup timeline covers them
+STARTED = perf_counter()
+
+from argparse import ArgumentParser
+from pathlib import Path
+from sys import exit, stderr
+from time import sleep
+from typing import TYPE_CHECKING
+
+from pyglet import app
+from pyglet.clock import schedule, schedule_interval, schedule_once, unschedule
+from pyglet.text import Label
 from pyglet.window import FPSDisplay, Window
 
-from game_modules.consts import WINDOW_HEIGHT, WINDOW_WIDTH
+from game_modules.assets import assets, font_press_start_2p, prewarm_glyphs
+from game_modules.audio import PygletAudioBackend, SoundEffects
+from game_modules.consts import (
+    AI_DEFAULT_DIFFICULTY,
+    AI_DIFFICULTIES,
+    CAPTURE_FPS,
+    FONT_SIZES,
+    MAX_CATCH_UP_STEPS,
+    NETPLAY_PORT,
+    PROFILER_HITCH_THRESHOLD,
+    RENDER_FILTER,
+    RENDER_SCALE,
+    TICK_RATE,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
 from game_modules.game_states import GameState, MainMenuState
+from game_modules.latency import LatencyTracker
+from game_modules.netplay import UdpTransport
+from game_modules.presenter import FILTERS, Presenter
+from game_modules.profiler import (
+    CsvSampleWriter,
+    FrameProfiler,
+    ProfilerOverlay,
+)
+from game_modules.startup import StartupTimeline
+from game_modules.telemetry import HITCH, STATE_ENTER, STATE_EXIT, Telemetry
+from game_modules.utils import count_draw_calls
+
+if TYPE_CHECKING:
+    from game_modules.capture import FrameWriter
 
 
 class Game(Window):
-    def __init__(self):
+    def __init__(
+        self,
+        fixed_timestep: bool = True,
+        tick_rate: int = TICK_RATE,
+        max_catch_up_steps: int = MAX_CATCH_UP_STEPS,
+        sound_effects: SoundEffects = None,
+        profiler_csv_path: str = None,
+        record_dir: str = None,
+        telemetry_path: str = None,
+        telemetry_format: str = 'jsonl',
+        pacing: str = 'idle',
+        vsync: bool = True,
+        fullscreen: bool = False,
+        presenter: Presenter = None,
+        startup: StartupTimeline = None,
+    ):
+        # Phases until the first frame, timed from here by default
+        self.startup = startup or StartupTimeline()
+        self.show_startup_timeline = False
+        # Times key events up to the frame showing them, when set. Set
+        # first, the window dispatches events while it is created.
+        self.latency: LatencyTracker = None
         super().__init__(
-            width=WINDOW_WIDTH, height=WINDOW_HEIGHT, caption='PyPong'
+            width=WINDOW_WIDTH,
+            height=WINDOW_HEIGHT,
+            caption='PyPong',
+            vsync=vsync,
+            fullscreen=fullscreen,
+            resizable=True,
         )
+        # States draw at the logical resolution, scaled to the window
+        self.presenter = presenter or Presenter()
         self._set_window_configs()
-        self.state = None
+        self.startup.mark('window')
+
+        # Labels need the font registered before they are laid out, the
+        # sounds load after the first frame. Its glyphs are rasterized now
+        # rather than on the first frame that shows each new text, which
+        # would hitch state transitions.
+        assets.get('press_start_2p')
+        self.fonts = prewarm_glyphs(font_press_start_2p, FONT_SIZES)
+        self.startup.mark('assets')
+        self.sound_effects = sound_effects or SoundEffects(
+            backend=PygletAudioBackend(assets=assets)
+        )
+
+        # Fixed timestep: physics always advances in ticks of tick_interval,
+        # whatever the render rate, and frames interpolate between ticks
+        self.fixed_timestep = fixed_timestep
+        self.tick_interval = 1 / tick_rate
+        self.max_catch_up_steps = max_catch_up_steps
+        self.accumulator = 0.0
+        self.interpolation_alpha = 1.0
+
+        # Frame pacing once run() starts: frames run back to back while the
+        # state is animated, or always with 'continuous' pacing; otherwise
+        # ('idle') a frame only runs when the state is marked dirty, and the
+        # event loop sleeps until the next input or window event
+        self.pacing = pacing
+        self._running = False
+        self._frames_scheduled = False
+        self._frame_requested = False
+
         self.show_fps = False
-        self.set_state(state=MainMenuState())
+
+        # Difficulty of the CPU playing the right paddle, None for a player
+        self.cpu_difficulty = None
+
+        # Balls in play, more than one starts the multi ball mode
+        self.ball_count = 1
+
+        # Seed of every match, or None for a random one per match. Fixed,
+        # matches play out the same given the same inputs.
+        self.seed = None
+
+        # Matches are recorded here for replays, when set
+        self.record_dir = Path(record_dir) if record_dir else None
+        if self.record_dir:
+            self.record_dir.mkdir(parents=True, exist_ok=True)
+
+        # Gameplay events, state transitions and hitches are logged here
+        self.telemetry = None
+        if telemetry_path:
+            self.telemetry = Telemetry(telemetry_path, format=telemetry_format)
+
+        # Captures every frame while set, see start_capture
+        self.capture = None
+
+        # Late input: None leaves key events to the event loop, which runs
+        # them before the frame starts. Seconds instead make the frame wait
+        # that long, then dispatch the events queued meanwhile right before
+        # the physics steps, so they reach this frame's ticks. Waiting
+        # nearer the next vsync trades frame time for lower latency.
+        self.input_delay = None
+
+        # Frame phase profiler, it only times frames while shown
+        self.show_profiler = False
+        self.profiler = FrameProfiler()
+        if profiler_csv_path:
+            self.profiler.sample_writer = CsvSampleWriter(
+                path=profiler_csv_path
+            )
+        self.profiler_overlay = ProfilerOverlay(
+            profiler=self.profiler,
+            x=WINDOW_WIDTH - 250,
+            y=WINDOW_HEIGHT - 70,
+            width=240,
+            height=60,
+        )
+
+        # Stack of active states, the top one runs; cacheable states are
+        # kept alive between transitions
+        self.states: list[GameState] = []
+        self._cached_states: dict[type[GameState], GameState] = {}
+        self.push_state(state=self.get_state(MainMenuState))
+        self.startup.mark('main menu')
+        self._first_frame_shown = False
 
     def _set_window_configs(self):
         self.set_mouse_visible(visible=False)
         self.fps_display = FPSDisplay(self)
+        self.draw_calls = None
+        self.handler_count = None
+        self.debug_label = Label(
+            '',
+            x=10,
+            y=50,
+            font_size=12,
+            bold=True,
+            color=self.fps_display.label.color,
+        )
+
+    @property
+    def state(self) -> GameState:
+        return self.states[-1]
+
+    def get_state(self, state_class: type[GameState]) -> GameState:
+        """Returns the cached instance of cacheable states, else a new one"""
+        if not state_class.cacheable:
+            return state_class(game=self)
+        state = self._cached_states.get(state_class)
+        if state is None:
+            state = state_class(game=self)
+            self._cached_states[state_class] = state
+        return state
 
-    def set_state(self, state: GameState) -> None:
-        if self.state:
-            self.state.exit()
-        self.state = state
-        self.state.game = self
-        self.state.enter()
+    def push_state(self, state: GameState) -> None:
+        if self.states:
+            self._deactivate_state(self.states[-1])
+        self.states.append(state)
+        self._activate_state(state)
+
+    def pop_state(self) -> GameState:
+        state = self.states.pop()
+        self._deactivate_state(state)
+        if self.states:
+            self._activate_state(self.states[-1])
+        return state
+
+    def replace_state(self, state: GameState) -> None:
+        if self.states:
+            self._deactivate_state(self.states.pop())
+        self.states.append(state)
+        self._activate_state(state)
+
+    def _activate_state(self, state: GameState) -> None:
+        if self.latency is not None:
+            self.latency.reset()
+        if state.handlers:
+            self.push_handlers(*state.handlers)
+        state.enter()
+        if self.telemetry is not None:
+            self.telemetry.emit(STATE_ENTER, type(state).__name__)
+        state.dirty = True
+        self._schedule_frames()
+        self.request_frame()
+
+    def _deactivate_state(self, state: GameState) -> None:
+        state.exit()
+        if self.telemetry is not None:
+            self.telemetry.emit(STATE_EXIT, type(state).__name__)
+        if state.handlers:
+            self.remove_handlers(*state.handlers)
+
+    def _count_handlers(self) -> int:
+        return sum(len(frame) for frame in self._event_stack)
+
+    @property
+    def animated(self) -> bool:
+        """Whether frames run back to back instead of on demand"""
+        return (
+            self.pacing == 'continuous'
+            or self.state.animated
+            or self.show_fps
+            or self.show_profiler
+            or self.capture is not None
+        )
+
+    def start_capture(
+        self,
+        writer: 'FrameWriter',
+        fps: int = CAPTURE_FPS,
+        max_frames: int = None,
+    ) -> None:
+        """
+        Captures every frame to writer from now on, each frame advancing
+        the game by 1 / fps. Quits after max_frames frames, when given.
+        """
+        # Imported here: capture needs NumPy, which the first frame does not
+        from game_modules.capture import FrameCapture
+
+        self.switch_to()
+        width, height = self.get_framebuffer_size()
+        self.capture = FrameCapture(
+            width, height, writer=writer, fps=fps, max_frames=max_frames
+        )
+        self._schedule_frames()
+
+    def stop_capture(self) -> None:
+        """Waits for the captured frames to be written"""
+        if self.capture is not None:
+            self.switch_to()
+            self.capture.close()
+            self.capture = None
+
+    def run(self) -> None:
+        """Runs the pyglet event loop, with frames paced by the game"""
+        self._running = True
+        self._schedule_frames()
+        self.request_frame()
+        app.run(interval=None)
+
+    def request_frame(self) -> None:
+        """Runs a frame soon, unless frames already run back to back"""
+        if (
+            self._running
+            and not self._frames_scheduled
+            and not self._frame_requested
+        ):
+            self._frame_requested = True
+            schedule_once(self._run_frame, 0)
+
+    def _schedule_frames(self) -> None:
+        if not self._running or self.animated == self._frames_scheduled:
+            return
+        self._frames_scheduled = self.animated
+        unschedule(self._run_frame)
+        self._frame_requested = False
+        if not self._frames_scheduled:
+            self.request_frame()
+            return
+        # Time spent idle is not physics time to catch up on
+        self.accumulator = 0.0
+        if self.fixed_timestep:
+            # Paced by vsync when enabled
+            schedule(self._run_frame)
+        else:
+            schedule_interval(self._run_frame, 1 / 120.0)
+
+    def _run_frame(self, dt) -> None:
+        self._frame_requested = False
+        if (
+            self.telemetry is not None
+            and self._frames_scheduled
+            and dt > PROFILER_HITCH_THRESHOLD
+        ):
+            # Only frames run back to back, the others follow idle time
+            self.telemetry.emit(HITCH, dt)
+        if self.capture is not None:
+            # Game time of recordings does not depend on how long frames
+            # took to draw and write
+            dt = 1 / self.capture.fps
+        if self.input_delay is not None:
+            if self.input_delay:
+                sleep(self.input_delay)
+            self.dispatch_events()
+        self.update(dt=dt)
+        if self._frames_scheduled or self.state.dirty:
+            self.state.dirty = False
+            self.switch_to()
+            self.dispatch_event('on_draw')
+            if self.capture is not None:
+                self.capture.capture()
+            self.flip()
+            if not self._first_frame_shown:
+                self._finish_startup()
+            if self.capture is not None and self.capture.done:
+                self.quit()
+        # Overlays toggled or a state changed during the frame
+        self._schedule_frames()
+
+    def _finish_startup(self) -> None:
+        """Once the first frame is up, starts what it could do without"""
+        self._first_frame_shown = True
+        self.startup.mark('first frame')
+        if self.show_startup_timeline:
+            print(self.startup.report(), file=stderr)
+        # Sounds decode in the background, the audio driver starts here
+        assets.preload()
+        self.sound_effects.prepare()
 
     def update(self, dt) -> None:
-        self.state.update(dt=dt)
+        world = self.state.world
+        if world is not None:
+            # Systems are only timed while the profiler shows them
+            world.timed = self.show_profiler
+        if self.show_profiler:
+            start = perf_counter()
+        if self.fixed_timestep:
+            self._run_fixed_steps(dt=dt)
+        else:
+            self._update_state(dt=dt)
+        self.sound_effects.flush()
         if self.show_fps:
             self.fps_display.update()
+        if self.show_profiler:
+            self.profiler.add('update', perf_counter() - start)
+
+    def _update_state(self, dt) -> None:
+        if self.latency is not None:
+            self.latency.tick(perf_counter())
+        if self.show_profiler:
+            start = perf_counter()
+            self.state.update(dt=dt)
+            self.profiler.add('state.update', perf_counter() - start)
+        else:
+            self.state.update(dt=dt)
+
+    def _run_fixed_steps(self, dt) -> None:
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= self.tick_interval:
+            if steps == self.max_catch_up_steps:
+                # After a long stall, drop the backlog instead of spiralling
+                # into ever longer updates
+                self.accumulator %= self.tick_interval
+                break
+            self._update_state(dt=self.tick_interval)
+            self.accumulator -= self.tick_interval
+            steps += 1
+        self.interpolation_alpha = self.accumulator / self.tick_interval
 
     def on_draw(self) -> None:
+        self.presenter.begin(self)
         self.clear()
-        self.state.draw()
+        if self.show_profiler:
+            start = perf_counter()
+            self._draw_state()
+            self.profiler.add('state.draw', perf_counter() - start)
+            world = self.state.world
+            self.profiler_overlay.draw(
+                systems=world.timings if world is not None else None
+            )
+        else:
+            self._draw_state()
         if self.show_fps:
             self.fps_display.draw()
+            self._draw_debug_label()
+        self.presenter.end(self)
+
+    def _draw_state(self) -> None:
+        self.state.interpolate(alpha=self.interpolation_alpha)
+        self.state.draw()
+
+    def flip(self) -> None:
+        if not self.show_profiler:
+            super().flip()
+        else:
+            start = perf_counter()
+            super().flip()
+            end = perf_counter()
+            self.profiler.add('flip', end - start)
+            self.profiler.end_frame(now=end)
+        if self.latency is not None:
+            self.latency.flip(perf_counter())
+
+    def dispatch_event(self, event_type, *args):
+        # Seen here, before any handler of the states may consume them.
+        # Only while a match runs frame after frame: menus run a frame on
+        # demand and step nothing, their keys would wait for the next one.
+        if (
+            self.latency is not None
+            and event_type in ('on_key_press', 'on_key_release')
+            and self.states
+            and self.state.world is not None
+            and self.animated
+        ):
+            self.latency.key_event(perf_counter())
+        return super().dispatch_event(event_type, *args)
+
+    def _draw_debug_label(self) -> None:
+        draw_calls = count_draw_calls(self.state.batch)
+        handler_count = self._count_handlers()
+        if (draw_calls, handler_count) != (
+            self.draw_calls,
+            self.handler_count,
+        ):
+            self.draw_calls = draw_calls
+            self.handler_count = handler_count
+            self.debug_label.text = (
+                f'draw calls: {draw_calls}  handlers: {handler_count}'
+            )
+        self.debug_label.draw()
+
+    def on_expose(self) -> None:
+        self._redraw_after_window_event()
+
+    def on_resize(self, width, height) -> None:
+        super().on_resize(width, height)
+        self._redraw_after_window_event()
+
+    def _redraw_after_window_event(self) -> None:
+        # Window events may come before the first state is pushed
+        if self.states:
+            self.state.mark_dirty()
 
     def on_key_press(self, symbol, modifiers):
         """
@@ -46,11 +470,227 @@ class Game(Window):
         """
         pass
 
+    def on_close(self) -> None:
+        self.quit()
+
     def quit(self) -> None:
+        # Let every state wrap up, like saving the match being recorded
+        while self.states:
+            self._deactivate_state(self.states.pop())
+        self.stop_capture()
+        self.presenter.delete()
+        if self.latency is not None and self.latency.count:
+            print(self.latency.report(), file=stderr)
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.profiler.sample_writer is not None:
+            self.profiler.sample_writer.close()
         exit(0)
 
 
 if __name__ == '__main__':
-    game = Game()
-    schedule_interval(func=game.update, interval=1 / 120.0)
-    run()
+    parser = ArgumentParser(description='PyPong')
+    parser.add_argument(
+        '--profile-csv',
+        metavar='PATH',
+        help='Stream frame profiler samples to a CSV file',
+    )
+    parser.add_argument(
+        '--record-dir',
+        metavar='DIR',
+        help='Record every match to DIR, to replay with game_modules.replay',
+    )
+    parser.add_argument(
+        '--cpu',
+        nargs='?',
+        choices=AI_DIFFICULTIES,
+        const=AI_DEFAULT_DIFFICULTY,
+        metavar='DIFFICULTY',
+        help='Play against the CPU (easy, normal or hard)',
+    )
+    parser.add_argument(
+        '--balls',
+        type=int,
+        default=1,
+        metavar='COUNT',
+        help='Play with COUNT balls bouncing off each other',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        metavar='SEED',
+        help='Start every match from SEED, to reproduce it',
+    )
+    parser.add_argument(
+        '--pacing',
+        choices=('idle', 'continuous'),
+        default='idle',
+        help='Sleep in static menus (idle) or redraw every frame',
+    )
+    parser.add_argument(
+        '--startup-timeline',
+        action='store_true',
+        help='Print how long each startup phase took, up to the first frame',
+    )
+    parser.add_argument(
+        '--telemetry',
+        metavar='PATH',
+        help='Log gameplay events to PATH, see game_modules.telemetry',
+    )
+    parser.add_argument(
+        '--telemetry-format',
+        choices=('jsonl', 'binary'),
+        default='jsonl',
+        help='Format of the --telemetry file',
+    )
+    parser.add_argument(
+        '--latency',
+        action='store_true',
+        help='Time key presses up to the frame showing them, report on exit',
+    )
+    parser.add_argument(
+        '--late-input',
+        type=float,
+        nargs='?',
+        const=0.0,
+        metavar='MS',
+        help=(
+            'Read the key events right before the physics steps of each '
+            'frame, after waiting MS milliseconds'
+        ),
+    )
+    parser.add_argument(
+        '--no-vsync',
+        action='store_true',
+        help='Do not sync frames to the display refresh',
+    )
+    parser.add_argument(
+        '--fullscreen',
+        action='store_true',
+        help='Play fullscreen, the game scaled to the display',
+    )
+    parser.add_argument(
+        '--render-scale',
+        type=float,
+        default=RENDER_SCALE,
+        metavar='SCALE',
+        help=(
+            'Draw at SCALE times the logical resolution, then scale to the '
+            'window; below 1 draws fewer pixels'
+        ),
+    )
+    parser.add_argument(
+        '--filter',
+        choices=tuple(FILTERS),
+        default=RENDER_FILTER,
+        help='Filter used to scale the frame to the window',
+    )
+    parser.add_argument(
+        '--integer-scaling',
+        action='store_true',
+        help='Only scale the frame by whole factors, to keep pixels even',
+    )
+    capture = parser.add_mutually_exclusive_group()
+    capture.add_argument(
+        '--capture',
+        metavar='DIR',
+        help=(
+            'Save every frame to DIR; with PYGLET_HEADLESS=1 set, it runs '
+            'without a display'
+        ),
+    )
+    capture.add_argument(
+        '--capture-pipe',
+        metavar='COMMAND',
+        help=(
+            'Pipe every frame as raw RGBA to COMMAND, with {width}, '
+            '{height} and {fps} filled in, like an ffmpeg rawvideo encoder'
+        ),
+    )
+    parser.add_argument(
+        '--capture-format',
+        choices=('png', 'raw'),
+        default='png',
+        help='File format of the frames saved by --capture',
+    )
+    parser.add_argument(
+        '--capture-fps',
+        type=int,
+        default=CAPTURE_FPS,
+        metavar='FPS',
+        help='Frames captured per second of game time',
+    )
+    parser.add_argument(
+        '--capture-frames',
+        type=int,
+        metavar='COUNT',
+        help='Quit after capturing COUNT frames',
+    )
+    netplay = parser.add_mutually_exclusive_group()
+    netplay.add_argument(
+        '--host',
+        type=int,
+        nargs='?',
+        const=NETPLAY_PORT,
+        metavar='PORT',
+        help='Host an online match, playing the left paddle',
+    )
+    netplay.add_argument(
+        '--join',
+        metavar='HOST[:PORT]',
+        help='Join an online match, playing the right paddle',
+    )
+    args = parser.parse_args()
+    startup = StartupTimeline(start=STARTED)
+    startup.mark('import')
+
+    game = Game(
+        profiler_csv_path=args.profile_csv,
+        record_dir=args.record_dir,
+        telemetry_path=args.telemetry,
+        telemetry_format=args.telemetry_format,
+        pacing=args.pacing,
+        vsync=not args.no_vsync,
+        fullscreen=args.fullscreen,
+        presenter=Presenter(
+            render_scale=args.render_scale,
+            filter=args.filter,
+            integer_scaling=args.integer_scaling,
+        ),
+        startup=startup,
+    )
+    game.show_startup_timeline = args.startup_timeline
+    game.show_profiler = args.profile_csv is not None
+    game.cpu_difficulty = args.cpu
+    game.ball_count = max(args.balls, 1)
+    game.seed = args.seed
+    if args.latency:
+        game.latency = LatencyTracker()
+    if args.late_input is not None:
+        game.input_delay = args.late_input / 1000
+    if args.capture or args.capture_pipe:
+        from game_modules.capture import ImageSequenceWriter, PipeWriter
+    if args.capture:
+        game.start_capture(
+            ImageSequenceWriter(args.capture, format=args.capture_format),
+            fps=args.capture_fps,
+            max_frames=args.capture_frames,
+        )
+    elif args.capture_pipe:
+        game.start_capture(
+            PipeWriter(args.capture_pipe),
+            fps=args.capture_fps,
+            max_frames=args.capture_frames,
+        )
+    if args.host is not None or args.join:
+        from game_modules.gameplay_states import NetplayState
+    if args.host is not None:
+        transport = UdpTransport(local_address=('0.0.0.0', args.host))
+        game.push_state(NetplayState(game=game, side=1, transport=transport))
+    elif args.join:
+        host, _, port = args.join.partition(':')
+        transport = UdpTransport(
+            remote_address=(host, int(port or NETPLAY_PORT))
+        )
+        game.push_state(NetplayState(game=game, side=2, transport=transport))
+    game.run()
@@ -0,0 +1,185 @@
+"""
+CPU opponent.
+
+The ball moves in straight lines between bounces, so where it crosses the x
+of a paddle has a closed form: unfold its path as if the walls were mirrors,
+then fold the y it reaches back between the walls. The controller only
+re-plans when the ball velocity changes (a bounce or a paddle hit), so most
+ticks cost a comparison and a subtraction, cheap enough to drive both
+paddles in soak tests and headless batches.
+
+Run `python -m game_modules.ai` from the src directory to play CPU against
+CPU matches headless and report how fast they run.
+"""
+from argparse import ArgumentParser
+from random import Random
+from sys import exit
+from time import perf_counter
+from typing import Optional
+
+from .consts import (
+    AI_DEFAULT_DIFFICULTY,
+    AI_DIFFICULTIES,
+    TICK_RATE,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
+from .simulation import (
+    EVENT_GOAL,
+    EVENT_PADDLE_HIT,
+    SIDE_INPUTS,
+    BallState,
+    SimulationState,
+    step,
+)
+
+
+def fold(value: float, low: float, high: float) -> float:
+    """Reflects value into [low, high], as a ball bouncing between them"""
+    span = high - low
+    if span <= 0:
+        return low
+    offset = (value - low) % (2 * span)
+    if offset > span:
+        offset = 2 * span - offset
+    return low + offset
+
+
+def predict_intercept(
+    ball: BallState, face_x: float, far_x: float, height: float
+) -> float:
+    """
+    Y of the ball centre when it next reaches face_x, going first to far_x
+    and back if it moves away. Both are x of the ball centre, and only the
+    top and bottom walls bend its path on the way.
+    """
+    if ball.vx == 0:
+        return ball.y
+    towards = (face_x - ball.x) * ball.vx
+    if towards >= 0:
+        distance = abs(face_x - ball.x)
+    else:
+        distance = abs(far_x - ball.x) + abs(far_x - face_x)
+    y = ball.y + ball.vy * distance / abs(ball.vx)
+    return fold(y, ball.radius, height - ball.radius)
+
+
+class AIController:
+    """
+    Drives the paddle of a side towards the predicted intercept. After each
+    re-plan the paddle keeps its old target for reaction_delay seconds, and
+    the new one is off by a random aim_error (standard deviation, in px).
+    """
+
+    def __init__(
+        self,
+        side: int,
+        difficulty: str = AI_DEFAULT_DIFFICULTY,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.side = side
+        self.reaction_delay, self.aim_error = AI_DIFFICULTIES[difficulty]
+        self.input_up, self.input_down = SIDE_INPUTS[side]
+        self.replans = 0
+        self._rng = Random(seed)
+        self._velocity = None  # Ball velocity of the last plan
+        self._target_y = WINDOW_HEIGHT / 2
+        self._next_target_y = self._target_y
+        self._next_target_tick = 0
+
+    def read(self, state: SimulationState, dt: float) -> int:
+        ball = state.ball
+        if self._velocity != (ball.vx, ball.vy):
+            self._velocity = (ball.vx, ball.vy)
+            self._replan(state, dt)
+        if state.tick >= self._next_target_tick:
+            self._target_y = self._next_target_y
+
+        paddle = state.paddle_1 if self.side == 1 else state.paddle_2
+        distance = self._target_y - paddle.y
+        # Stop within half a tick of movement, or the paddle would jitter
+        dead_zone = paddle.speed * dt / 2
+        if distance > dead_zone:
+            return self.input_up
+        if distance < -dead_zone:
+            return self.input_down
+        return 0
+
+    def _replan(self, state: SimulationState, dt: float) -> None:
+        self.replans += 1
+        if self.side == 1:
+            paddle, opponent, facing = state.paddle_1, state.paddle_2, 1
+        else:
+            paddle, opponent, facing = state.paddle_2, state.paddle_1, -1
+        radius = state.ball.radius
+        face_x = paddle.x + facing * (paddle.width / 2 + radius)
+        far_x = opponent.x - facing * (opponent.width / 2 + radius)
+        if (state.ball.x - face_x) * facing < 0:
+            # Already behind the paddle, chase it
+            target_y = state.ball.y
+        else:
+            target_y = predict_intercept(
+                state.ball, face_x, far_x, WINDOW_HEIGHT
+            )
+        if self.aim_error:
+            target_y += self._rng.gauss(0.0, self.aim_error)
+        self._next_target_y = target_y
+        delay_ticks = round(self.reaction_delay / dt) if dt > 0 else 0
+        self._next_target_tick = state.tick + delay_ticks
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.ai')
+    parser.add_argument('--matches', type=int, default=20)
+    parser.add_argument('--ticks', type=int, default=TICK_RATE * 60)
+    parser.add_argument(
+        '--difficulty',
+        choices=AI_DIFFICULTIES,
+        default=AI_DEFAULT_DIFFICULTY,
+    )
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    dt = 1 / TICK_RATE
+    hits = 0
+    misses = [0, 0]  # Ball reaching the wall behind each paddle
+    replans = 0
+    ai_time = 0.0
+    start = perf_counter()
+    for match in range(args.matches):
+        seed = args.seed + match
+        state = SimulationState(seed=seed)
+        controllers = [
+            AIController(side, args.difficulty, seed=seed * 2 + side)
+            for side in SIDE_INPUTS
+        ]
+        for _ in range(args.ticks):
+            ai_start = perf_counter()
+            inputs = 0
+            for controller in controllers:
+                inputs |= controller.read(state, dt)
+            ai_time += perf_counter() - ai_start
+            step(state, inputs, dt)
+            for kind, x, _ in state.events:
+                if kind == EVENT_PADDLE_HIT:
+                    hits += 1
+                elif kind == EVENT_GOAL:
+                    misses[0 if x < WINDOW_WIDTH / 2 else 1] += 1
+        replans += sum(controller.replans for controller in controllers)
+    elapsed = perf_counter() - start
+
+    ticks = args.matches * args.ticks
+    print(
+        f'{args.matches} matches, {ticks} ticks in {elapsed:.2f} s '
+        f'({ticks / elapsed:,.0f} ticks/s)'
+    )
+    print(
+        f'AI: {ai_time / ticks * 1e6:.2f} µs per tick for both paddles, '
+        f'{replans / ticks * 1000:.1f} re-plans per 1000 ticks'
+    )
+    print(f'{hits} paddle hits, misses: left {misses[0]}, right {misses[1]}')
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -1,11 +1,123 @@
+from logging import getLogger
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter
+
 from pyglet.font import add_file as load_font
-from pyglet.media import load as load_sound
+from pyglet.font import load as get_font
+
+logger = getLogger(__name__)
+
+# Resolved from this file, so the game runs from any working directory
+ASSETS_DIR = Path(__file__).resolve().parents[2] / 'assets'
+
+# Asset name => (kind, path relative to ASSETS_DIR)
+MANIFEST = {
+    'press_start_2p': ('font', 'fonts/press_start_2p.ttf'),
+    'click': ('sound', 'sounds/click.wav'),
+    'tuc': ('sound', 'sounds/tuc.wav'),
+    'you_win': ('sound', 'sounds/you_win.wav'),
+}
 
 # Fonts
-load_font('../assets/fonts/press_start_2p.ttf')
 font_press_start_2p = 'Press Start 2P'
 
-# Sounds
-sound_click = load_sound('../assets/sounds/click.wav', streaming=False)
-sound_you_win = load_sound('../assets/sounds/you_win.wav', streaming=False)
-sound_tuc = load_sound('../assets/sounds/tuc.wav', streaming=False)
+# Characters labels may show: printable ASCII, Portuguese accents and the
+# menu pointer
+GLYPHS = ''.join(map(chr, range(32, 127))) + 'ÀÁÂÃÇÉÊÍÓÔÕÚàáâãçéêíóôõú' + '→'
+
+
+def prewarm_glyphs(font_name: str, sizes, characters: str = GLYPHS) -> list:
+    """
+    Rasterizes the characters of a font into its glyph atlas for each size,
+    so the first frame showing new text does not stall on them. pyglet
+    only caches fonts while they are referenced: keep the returned list.
+    """
+    start = perf_counter()
+    fonts = []
+    for size in sizes:
+        font = get_font(font_name, size)
+        font.get_glyphs(characters)
+        fonts.append(font)
+    logger.info(
+        'Prewarmed %d glyphs of %r in %.1f ms',
+        len(characters) * len(sizes),
+        font_name,
+        (perf_counter() - start) * 1000,
+    )
+    return fonts
+
+
+class AssetManager:
+    """
+    Loads the assets of a manifest on first use and caches them. preload()
+    loads everything left in a background thread, so it can run while the
+    main menu is already showing.
+    """
+
+    def __init__(self, manifest: dict, assets_dir: Path = ASSETS_DIR):
+        self.manifest = manifest
+        self.assets_dir = assets_dir
+        self.load_times: dict[str, float] = {}  # Seconds spent per asset
+        self._cache = {}
+        self._lock = Lock()
+        self._preload_thread = None
+
+    def path(self, name: str) -> Path:
+        _, relative_path = self.manifest[name]
+        return self.assets_dir / relative_path
+
+    def get(self, name: str):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        with self._lock:
+            # Another thread may have loaded it while we waited
+            if name not in self._cache:
+                self._cache[name] = self._load(name)
+        return self._cache[name]
+
+    def preload(self, background: bool = True) -> None:
+        """Loads every asset of the manifest not loaded yet"""
+        if background:
+            if self._preload_thread is None:
+                self._preload_thread = Thread(
+                    target=self.preload,
+                    kwargs={'background': False},
+                    name='asset-preload',
+                    daemon=True,
+                )
+                self._preload_thread.start()
+            return
+        for name in self.manifest:
+            self.get(name)
+
+    def wait(self) -> None:
+        """Blocks until a background preload finishes"""
+        if self._preload_thread is not None:
+            self._preload_thread.join()
+
+    def _load(self, name: str):
+        kind, _ = self.manifest[name]
+        path = str(self.path(name))
+        start = perf_counter()
+        if kind == 'font':
+            load_font(path)
+            asset = path
+        elif kind == 'sound':
+            # Imported here: pyglet.media loads the audio and codec
+            # libraries, which the first frame does not need
+            from pyglet.media import load as load_sound
+
+            asset = load_sound(path, streaming=False)
+        else:
+            raise ValueError(f'Unknown asset kind {kind!r} for {name!r}')
+        self.load_times[name] = perf_counter() - start
+        logger.info(
+            'Loaded %s %r in %.1f ms', kind, name, self.load_times[name] * 1000
+        )
+        return asset
+
+
+assets = AssetManager(manifest=MANIFEST)
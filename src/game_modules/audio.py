@@ -0,0 +1,121 @@
+from .consts import SOUND_MAX_VOICES_PER_SOUND, SOUND_VOICES
+
+
+class PygletAudioBackend:
+    """Plays sounds from the asset manager on pyglet media players"""
+
+    def __init__(self, assets) -> None:
+        self.assets = assets
+
+    def create_voice(self):
+        # Imported here: pyglet.media needs a display, the null backend not
+        from pyglet.media import Player
+
+        return Player()
+
+    def is_busy(self, voice) -> bool:
+        # The player drops its source once the sound ends
+        return voice.source is not None
+
+    def play(self, voice, name: str) -> None:
+        if voice.source is not None:
+            # Cut what is left of the previous sound
+            voice.next_source()
+        voice.queue(self.assets.get(name))
+        voice.play()
+
+
+class NullAudioBackend:
+    """Plays nothing, for headless runs, servers and benchmarks"""
+
+    def create_voice(self) -> None:
+        return None
+
+    def is_busy(self, voice: None) -> bool:
+        return False
+
+    def play(self, voice: None, name: str) -> None:
+        pass
+
+
+class SoundEffects:
+    """
+    Sound effect playback over a fixed pool of reusable voices.
+
+    play() only requests a sound: requests are played on flush(), once per
+    update, so the same sound triggered several times in one update (like
+    a ball hitting a corner) plays once. Each sound holds at most
+    max_voices_per_sound voices at a time; past that, or when the pool is
+    full, the oldest voice is cut and reused. The voices are created by
+    prepare(), or by the first flush that has sounds to play.
+    """
+
+    def __init__(
+        self,
+        backend,
+        voices: int = SOUND_VOICES,
+        max_voices_per_sound: int = SOUND_MAX_VOICES_PER_SOUND,
+    ) -> None:
+        self.backend = backend
+        self.max_voices_per_sound = max_voices_per_sound
+        self.voice_count = voices
+        self._voices = None
+        # Per voice: name of the last sound played and when it started
+        self._voice_sounds = [None] * voices
+        self._voice_started = [0] * voices
+        self._plays = 0
+        self._pending = []
+
+    def prepare(self) -> None:
+        """Creates the voices, which starts the audio driver"""
+        if self._voices is None:
+            self._voices = [
+                self.backend.create_voice() for _ in range(self.voice_count)
+            ]
+
+    def play(self, name: str) -> None:
+        if name not in self._pending:
+            self._pending.append(name)
+
+    def flush(self) -> None:
+        """Plays the sounds requested since the last flush"""
+        if not self._pending:
+            return
+        self.prepare()
+        for name in self._pending:
+            self._play_now(name)
+        self._pending.clear()
+
+    def _play_now(self, name: str) -> None:
+        index = self._pick_voice(name)
+        self._plays += 1
+        self._voice_sounds[index] = name
+        self._voice_started[index] = self._plays
+        self.backend.play(self._voices[index], name)
+
+    def _pick_voice(self, name: str) -> int:
+        free = None
+        oldest = 0
+        oldest_same_sound = None
+        same_sound_count = 0
+        for index, voice in enumerate(self._voices):
+            if not self.backend.is_busy(voice):
+                if free is None:
+                    free = index
+                continue
+            if self._voice_started[index] < self._voice_started[oldest]:
+                oldest = index
+            if self._voice_sounds[index] == name:
+                same_sound_count += 1
+                if (
+                    oldest_same_sound is None
+                    or self._voice_started[index]
+                    < self._voice_started[oldest_same_sound]
+                ):
+                    oldest_same_sound = index
+
+        if same_sound_count >= self.max_voices_per_sound:
+            return oldest_same_sound
+        if free is not None:
+            return free
+        return oldest
@@ -0,0 +1,620 @@
+"""
+Many independent matches stepped at once with NumPy.
+
+BatchSimulation keeps N matches as structure of arrays, one array per field
+with one entry per match, and its step() applies the rules of simulation to
+all of them with array operations: the same paddle steering, the same swept
+tests against walls, paddle faces and paddle corners, resolved for every
+match in each bounce pass. Paddle and ball sizes and speeds are arrays too,
+so one batch can sweep over them.
+
+Run `python -m game_modules.batch` from the src directory to play CPU
+against CPU batches, compare them with the scalar simulation and report the
+throughput in match-ticks per second.
+"""
+from argparse import ArgumentParser
+from itertools import product
+from sys import exit
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+
+from .consts import (
+    AI_DEFAULT_DIFFICULTY,
+    AI_DIFFICULTIES,
+    BALL_RADIUS,
+    BALL_SPEED,
+    PADDLE_HEIGHT,
+    PADDLE_SPEED,
+    PADDLE_WIDTH,
+    TICK_RATE,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
+from .simulation import (
+    EVENT_GOAL,
+    EVENT_PADDLE_HIT,
+    EVENT_WALL_BOUNCE,
+    MAX_BOUNCES_PER_TICK,
+    SIDE_INPUTS,
+    SimulationState,
+    step,
+)
+
+# Margin in px added to the broad phase bounds, so rounding never skips a
+# ball the swept tests would have hit
+_BROAD_PHASE_SLACK = 1e-6
+
+
+class BatchSimulation:
+    """
+    N matches as arrays. Paddle fields have shape (N, 2), column 0 being
+    the left paddle, ball fields shape (N,). Matches all share the tick.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        seed: Optional[int] = None,
+        ball_speed=BALL_SPEED,
+        ball_radius=BALL_RADIUS,
+        paddle_width=PADDLE_WIDTH,
+        paddle_height=PADDLE_HEIGHT,
+        paddle_speed=PADDLE_SPEED,
+        record_events: bool = False,
+        goals: bool = True,
+    ) -> None:
+        """
+        Sizes and speeds are a number for all matches or one per match. With
+        record_events, events lists the bounces of the last step. Without
+        goals, balls bounce off the walls behind the paddles instead of
+        being served again.
+        """
+        self.count = count
+        self.goals = goals
+        self.rng = np.random.default_rng(seed)
+        self.ball_radius = _per_match(ball_radius, count)
+        self.paddle_width = _per_match(paddle_width, count)
+        self.paddle_height = _per_match(paddle_height, count)
+        self.paddle_speed = _per_match(paddle_speed, count)
+
+        self.paddle_x = np.empty((count, 2))
+        self.paddle_x[:, 0] = 20
+        self.paddle_x[:, 1] = WINDOW_WIDTH - 20
+        self.paddle_y = np.full((count, 2), WINDOW_HEIGHT / 2)
+        self.paddle_vy = np.zeros((count, 2))
+        self.ball_x = np.full(count, WINDOW_WIDTH / 2)
+        self.ball_y = np.full(count, WINDOW_HEIGHT / 2)
+        speed = _per_match(ball_speed, count)
+        self.ball_vx = speed * self.rng.choice((-1.0, 1.0), count)
+        self.ball_vy = speed * self.rng.choice((-1.0, 1.0), count)
+        self.tick = 0
+
+        # Counters since the start, per match
+        self.paddle_hits = np.zeros(count, dtype=np.int64)
+        # Ball reaching the wall behind the left and the right paddle, the
+        # points of the right and the left side
+        self.misses = np.zeros((count, 2), dtype=np.int64)
+
+        # Per bounce pass of the last step: (kinds, contact xs, contact ys)
+        self.events = [] if record_events else None
+
+    def load(self, index: int, state: SimulationState) -> None:
+        """Copies a scalar simulation state into match index"""
+        for column, paddle in enumerate((state.paddle_1, state.paddle_2)):
+            self.paddle_x[index, column] = paddle.x
+            self.paddle_y[index, column] = paddle.y
+            self.paddle_vy[index, column] = paddle.vy
+        self.paddle_width[index] = state.paddle_1.width
+        self.paddle_height[index] = state.paddle_1.height
+        self.paddle_speed[index] = state.paddle_1.speed
+        ball = state.ball
+        self.ball_x[index] = ball.x
+        self.ball_y[index] = ball.y
+        self.ball_vx[index] = ball.vx
+        self.ball_vy[index] = ball.vy
+        self.ball_radius[index] = ball.radius
+        self.misses[index] = (state.score_2, state.score_1)
+
+    def step(self, inputs: np.ndarray, dt: float) -> None:
+        """Advances every match by dt, inputs holding one bitmask per match"""
+        if self.events is not None:
+            self.events.clear()
+        for column, (up, down) in enumerate(
+            SIDE_INPUTS[side] for side in SIDE_INPUTS
+        ):
+            self._steer_paddles(column, inputs & up, inputs & down, dt)
+        self._move_balls(dt)
+        self.paddle_y += self.paddle_vy * dt
+        self.tick += 1
+
+    def _steer_paddles(
+        self, column: int, up: np.ndarray, down: np.ndarray, dt: float
+    ) -> None:
+        up = up != 0
+        moving = up | (down != 0)
+        y = self.paddle_y[:, column]
+        distance = self.paddle_speed * dt
+        half_height = self.paddle_height / 2
+        target_y = np.clip(
+            np.where(up, y + distance, y - distance),
+            half_height,
+            WINDOW_HEIGHT - half_height,
+        )
+        self.paddle_vy[:, column] = np.where(
+            moving, (target_y - y) / dt if dt > 0 else 0.0, 0.0
+        )
+
+    def _move_balls(self, dt: float) -> None:
+        # Broad phase: balls that cannot touch a wall or a paddle this tick
+        # just move, the others go through the swept tests
+        x, y = self.ball_x, self.ball_y
+        dx = self.ball_vx * dt
+        dy = self.ball_vy * dt
+        near = _near_walls(x, y, dx, dy, self.ball_radius)
+        for column in (0, 1):
+            near |= _near_box(
+                x,
+                y,
+                dx,
+                dy - self.paddle_vy[:, column] * dt,
+                self.ball_radius,
+                self.paddle_x[:, column],
+                self.paddle_y[:, column],
+                self.paddle_width / 2,
+                self.paddle_height / 2,
+            )
+        far = ~near
+        np.add(x, dx, out=x, where=far)
+        np.add(y, dy, out=y, where=far)
+
+        # Matches still moving this tick, fewer after each bounce pass
+        index = np.flatnonzero(near)
+        elapsed = np.zeros(self.count)
+
+        for _ in range(MAX_BOUNCES_PER_TICK):
+            remaining = dt - elapsed[index]
+            still = remaining > 0
+            index = index[still]
+            if not len(index):
+                return
+            remaining = remaining[still]
+            x = self.ball_x[index]
+            y = self.ball_y[index]
+            vx = self.ball_vx[index]
+            vy = self.ball_vy[index]
+            radius = self.ball_radius[index]
+            dx = vx * remaining
+            dy = vy * remaining
+
+            hits = _Hits(len(index))
+            hits.sweep_walls(x, y, dx, dy, radius)
+            for column in (0, 1):
+                paddle_vy = self.paddle_vy[index, column]
+                paddle_x = self.paddle_x[index, column]
+                paddle_y = (
+                    self.paddle_y[index, column] + paddle_vy * elapsed[index]
+                )
+                half_width = self.paddle_width[index] / 2
+                half_height = self.paddle_height[index] / 2
+                relative_dy = dy - paddle_vy * remaining
+                near = np.flatnonzero(
+                    _near_box(
+                        x,
+                        y,
+                        dx,
+                        relative_dy,
+                        radius,
+                        paddle_x,
+                        paddle_y,
+                        half_width,
+                        half_height,
+                    )
+                )
+                if len(near):
+                    hits.sweep_aabbs(
+                        near,
+                        x[near],
+                        y[near],
+                        dx[near],
+                        relative_dy[near],
+                        radius[near],
+                        paddle_x[near] - half_width[near],
+                        paddle_y[near] - half_height[near],
+                        paddle_x[near] + half_width[near],
+                        paddle_y[near] + half_height[near],
+                        column,
+                    )
+
+            hit = np.isfinite(hits.t)
+            free = ~hit
+            self.ball_x[index[free]] = x[free] + dx[free]
+            self.ball_y[index[free]] = y[free] + dy[free]
+            index = index[hit]
+            if not len(index):
+                return
+
+            t = hits.t[hit]
+            nx = hits.nx[hit]
+            ny = hits.ny[hit]
+            column = hits.paddle[hit]
+            vx = vx[hit]
+            vy = vy[hit]
+            self.ball_x[index] = x[hit] + dx[hit] * t
+            self.ball_y[index] = y[hit] + dy[hit] * t
+            elapsed[index] += remaining[hit] * t
+
+            on_paddle = column >= 0
+            surface_vy = np.where(
+                on_paddle,
+                self.paddle_vy[index, np.maximum(column, 0)],
+                0.0,
+            )
+            # Paddles redirect the ball, but never speed it up past the
+            # speed of the paddle itself
+            speed_x = np.abs(vx)
+            speed_y = np.maximum(np.abs(vy), np.abs(surface_vy))
+            relative_vy = vy - surface_vy
+            dot = vx * nx + relative_vy * ny
+            towards = dot < 0
+            vx = np.where(towards, vx - 2 * dot * nx, vx)
+            vy = np.where(towards, relative_vy - 2 * dot * ny + surface_vy, vy)
+            self.ball_vx[index] = np.where(
+                on_paddle, np.copysign(speed_x, vx), vx
+            )
+            self.ball_vy[index] = np.where(
+                on_paddle, np.copysign(speed_y, vy), vy
+            )
+
+            side_wall = ~on_paddle & (nx != 0)
+            goal = side_wall if self.goals else np.zeros_like(side_wall)
+            if self.events is not None:
+                hit_radius = radius[hit]
+                self.events.append(
+                    (
+                        np.where(
+                            on_paddle,
+                            EVENT_PADDLE_HIT,
+                            np.where(goal, EVENT_GOAL, EVENT_WALL_BOUNCE),
+                        ),
+                        self.ball_x[index] - nx * hit_radius,
+                        self.ball_y[index] - ny * hit_radius,
+                    )
+                )
+            self.paddle_hits[index] += on_paddle
+            self.misses[index[side_wall], (nx[side_wall] < 0).astype(int)] += 1
+            if goal.any():
+                self._serve(index[goal], missed_left=nx[goal] > 0)
+                elapsed[index[goal]] = dt  # Their tick ends there
+
+    def _serve(self, index: np.ndarray, missed_left: np.ndarray) -> None:
+        """Serves the balls of index as simulation.serve"""
+        speed = np.abs(self.ball_vx[index])
+        points = self.misses[index].sum(axis=1)
+        self.ball_x[index] = WINDOW_WIDTH / 2
+        self.ball_y[index] = WINDOW_HEIGHT / 2
+        self.ball_vx[index] = np.where(missed_left, -speed, speed)
+        self.ball_vy[index] = np.where(points % 2, speed, -speed)
+
+
+class _Hits:
+    """
+    Earliest swept hit of each ball of a bounce pass. Tests are applied in
+    the order of the scalar simulation and only replace a hit strictly
+    earlier, so ties resolve the same way.
+    """
+
+    def __init__(self, count: int) -> None:
+        self.t = np.full(count, np.inf)
+        self.nx = np.zeros(count)
+        self.ny = np.zeros(count)
+        self.paddle = np.full(count, -1, dtype=np.int8)
+
+    def keep_earliest(
+        self,
+        rows: np.ndarray,
+        valid: np.ndarray,
+        t: np.ndarray,
+        nx,
+        ny,
+        paddle,
+    ) -> None:
+        """Takes the valid tested times of rows earlier than their hit"""
+        earlier = valid & (t < self.t[rows])
+        rows = rows[earlier]
+        self.t[rows] = t[earlier]
+        self.nx[rows] = np.broadcast_to(nx, t.shape)[earlier]
+        self.ny[rows] = np.broadcast_to(ny, t.shape)[earlier]
+        self.paddle[rows] = paddle
+
+    def sweep_walls(self, x, y, dx, dy, radius) -> None:
+        rows = np.arange(len(x))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p, d, size, normal in (
+                (x, dx, WINDOW_WIDTH, (1.0, 0.0)),
+                (y, dy, WINDOW_HEIGHT, (0.0, 1.0)),
+            ):
+                towards_low = d < 0
+                t = np.where(
+                    towards_low,
+                    (0 - (p - radius)) / d,
+                    (size - (p + radius)) / d,
+                )
+                sign = np.where(towards_low, 1.0, -1.0)
+                self.keep_earliest(
+                    rows,
+                    (d != 0) & (t <= 1),
+                    np.maximum(t, 0.0),
+                    normal[0] * sign,
+                    normal[1] * sign,
+                    -1,
+                )
+
+    def sweep_aabbs(
+        self, rows, x, y, dx, dy, radius, left, bottom, right, top, paddle
+    ) -> None:
+        """Sweeps the balls of rows against one box each, see collision"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Faces of the boxes grown by the radius
+            for p, d, low, high, q, dq, q_min, q_max, normal in (
+                (x, dx, left, right, y, dy, bottom, top, (1.0, 0.0)),
+                (y, dy, bottom, top, x, dx, left, right, (0.0, 1.0)),
+            ):
+                towards_high = d < 0
+                plane = np.where(towards_high, high + radius, low - radius)
+                t = (plane - p) / d
+                q_at_t = q + dq * t
+                sign = np.where(towards_high, 1.0, -1.0)
+                self.keep_earliest(
+                    rows,
+                    (d != 0)
+                    & (t >= 0)
+                    & (t <= 1)
+                    & (q_at_t >= q_min)
+                    & (q_at_t <= q_max),
+                    t,
+                    normal[0] * sign,
+                    normal[1] * sign,
+                    paddle,
+                )
+
+            # Corner circles
+            a = dx * dx + dy * dy
+            for corner_x, corner_y in (
+                (left, bottom),
+                (left, top),
+                (right, bottom),
+                (right, top),
+            ):
+                mx = x - corner_x
+                my = y - corner_y
+                c = mx * mx + my * my - radius * radius
+                b = mx * dx + my * dy
+                discriminant = b * b - a * c
+                t = (-b - np.sqrt(np.maximum(discriminant, 0.0))) / a
+                self.keep_earliest(
+                    rows,
+                    (c >= 0) & (b < 0) & (discriminant >= 0) & (t <= 1),
+                    t,
+                    (mx + dx * t) / radius,
+                    (my + dy * t) / radius,
+                    paddle,
+                )
+
+
+class BatchAI:
+    """
+    AIController for one side of every match of a batch: same intercept,
+    re-planned when a ball velocity changes, same reaction delay and error
+    """
+
+    def __init__(
+        self,
+        batch: BatchSimulation,
+        side: int,
+        difficulty: str = AI_DEFAULT_DIFFICULTY,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.batch = batch
+        self.side = side
+        self.reaction_delay, self.aim_error = AI_DIFFICULTIES[difficulty]
+        self.input_up, self.input_down = SIDE_INPUTS[side]
+        self.rng = np.random.default_rng(seed)
+        count = batch.count
+        self._vx = np.full(count, np.nan)  # Ball velocity of the last plan
+        self._vy = np.full(count, np.nan)
+        self._target_y = np.full(count, WINDOW_HEIGHT / 2)
+        self._next_target_y = self._target_y.copy()
+        self._next_target_tick = np.zeros(count, dtype=np.int64)
+
+    def read(self, dt: float) -> np.ndarray:
+        """Input bits of this side for every match"""
+        batch = self.batch
+        changed = (batch.ball_vx != self._vx) | (batch.ball_vy != self._vy)
+        if changed.any():
+            self._replan(np.flatnonzero(changed), dt)
+        ready = batch.tick >= self._next_target_tick
+        self._target_y[ready] = self._next_target_y[ready]
+
+        column = self.side - 1
+        distance = self._target_y - batch.paddle_y[:, column]
+        dead_zone = batch.paddle_speed * dt / 2
+        return np.where(
+            distance > dead_zone,
+            self.input_up,
+            np.where(distance < -dead_zone, self.input_down, 0),
+        ).astype(np.uint8)
+
+    def _replan(self, index: np.ndarray, dt: float) -> None:
+        batch = self.batch
+        column = self.side - 1
+        facing = 1.0 if self.side == 1 else -1.0
+        x = batch.ball_x[index]
+        y = batch.ball_y[index]
+        vx = batch.ball_vx[index]
+        vy = batch.ball_vy[index]
+        radius = batch.ball_radius[index]
+        reach = batch.paddle_width[index] / 2 + radius
+        face_x = batch.paddle_x[index, column] + facing * reach
+        far_x = batch.paddle_x[index, 1 - column] - facing * reach
+
+        towards = (face_x - x) * vx >= 0
+        distance = np.where(
+            towards,
+            np.abs(face_x - x),
+            np.abs(far_x - x) + np.abs(far_x - face_x),
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unfolded_y = y + vy * distance / np.abs(vx)
+        target_y = _fold(unfolded_y, radius, WINDOW_HEIGHT - radius)
+        # Chase balls with no velocity or already behind the paddle
+        chase = (vx == 0) | ((x - face_x) * facing < 0)
+        target_y = np.where(chase, y, target_y)
+        if self.aim_error:
+            target_y += self.rng.normal(0.0, self.aim_error, len(index))
+
+        self._vx[index] = vx
+        self._vy[index] = vy
+        self._next_target_y[index] = target_y
+        delay_ticks = round(self.reaction_delay / dt) if dt > 0 else 0
+        self._next_target_tick[index] = batch.tick + delay_ticks
+
+
+def _near_walls(x, y, dx, dy, radius) -> np.ndarray:
+    """Whether the swept bounds of the balls reach a wall"""
+    return (
+        (x + np.minimum(dx, 0) - radius <= _BROAD_PHASE_SLACK)
+        | (x + np.maximum(dx, 0) + radius >= WINDOW_WIDTH - _BROAD_PHASE_SLACK)
+        | (y + np.minimum(dy, 0) - radius <= _BROAD_PHASE_SLACK)
+        | (
+            y + np.maximum(dy, 0) + radius
+            >= WINDOW_HEIGHT - _BROAD_PHASE_SLACK
+        )
+    )
+
+
+def _near_box(
+    x, y, dx, dy, radius, center_x, center_y, half_width, half_height
+) -> np.ndarray:
+    """Whether the swept bounds of the balls overlap the boxes"""
+    return (
+        np.abs(x + dx / 2 - center_x)
+        <= half_width + radius + np.abs(dx) / 2 + _BROAD_PHASE_SLACK
+    ) & (
+        np.abs(y + dy / 2 - center_y)
+        <= half_height + radius + np.abs(dy) / 2 + _BROAD_PHASE_SLACK
+    )
+
+
+def _per_match(value, count: int) -> np.ndarray:
+    return np.broadcast_to(
+        np.asarray(value, dtype=np.float64), (count,)
+    ).copy()
+
+
+def _fold(value: np.ndarray, low: np.ndarray, high: np.ndarray):
+    span = high - low
+    offset = np.mod(value - low, 2 * span)
+    return low + np.where(offset > span, 2 * span - offset, offset)
+
+
+def compare_with_scalar(count: int, ticks: int, seed: int) -> float:
+    """
+    Steps count matches with random inputs both ways, returns the largest
+    difference found in a ball or paddle position or a score
+    """
+    dt = 1 / TICK_RATE
+    rng = np.random.default_rng(seed)
+    states = [SimulationState(seed=seed + index) for index in range(count)]
+    batch = BatchSimulation(count)
+    for index, state in enumerate(states):
+        batch.load(index, state)
+    largest = 0.0
+    for _ in range(ticks):
+        inputs = rng.integers(0, 16, count, dtype=np.uint8)
+        batch.step(inputs, dt)
+        for index, state in enumerate(states):
+            step(state, int(inputs[index]), dt)
+            largest = max(
+                largest,
+                abs(state.ball.x - batch.ball_x[index]),
+                abs(state.ball.y - batch.ball_y[index]),
+                abs(state.paddle_1.y - batch.paddle_y[index, 0]),
+                abs(state.paddle_2.y - batch.paddle_y[index, 1]),
+                abs(state.score_1 - batch.misses[index, 1]),
+                abs(state.score_2 - batch.misses[index, 0]),
+            )
+    return largest
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.batch')
+    parser.add_argument('--matches', type=int, default=10_000)
+    parser.add_argument('--ticks', type=int, default=TICK_RATE * 60)
+    parser.add_argument(
+        '--difficulty',
+        choices=AI_DIFFICULTIES,
+        default=AI_DEFAULT_DIFFICULTY,
+    )
+    parser.add_argument(
+        '--ball-speed', type=float, nargs='+', default=[BALL_SPEED]
+    )
+    parser.add_argument(
+        '--paddle-height', type=float, nargs='+', default=[PADDLE_HEIGHT]
+    )
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument(
+        '--verify',
+        type=int,
+        default=0,
+        metavar='TICKS',
+        help='First compare 16 matches with the scalar simulation',
+    )
+    args = parser.parse_args()
+
+    if args.verify:
+        largest = compare_with_scalar(16, args.verify, args.seed)
+        print(f'largest difference with the scalar simulation: {largest:g}')
+        if largest > 1e-6:
+            return 1
+
+    # The matches are split evenly between every combination of settings
+    settings = list(product(args.ball_speed, args.paddle_height))
+    per_setting = max(args.matches // len(settings), 1)
+    count = per_setting * len(settings)
+    ball_speed, paddle_height = np.repeat(settings, per_setting, axis=0).T
+    batch = BatchSimulation(
+        count,
+        seed=args.seed,
+        ball_speed=ball_speed,
+        paddle_height=paddle_height,
+    )
+    players = [
+        BatchAI(batch, side, args.difficulty, seed=args.seed + side)
+        for side in SIDE_INPUTS
+    ]
+    dt = 1 / TICK_RATE
+    start = perf_counter()
+    for _ in range(args.ticks):
+        inputs = players[0].read(dt) | players[1].read(dt)
+        batch.step(inputs, dt)
+    elapsed = perf_counter() - start
+
+    match_ticks = count * args.ticks
+    print(
+        f'{count} matches x {args.ticks} ticks in {elapsed:.2f} s: '
+        f'{match_ticks / elapsed:,.0f} match-ticks/s'
+    )
+    minutes = args.ticks * dt / 60
+    print('ball speed  paddle height  hits/min  misses/min')
+    for index, (speed, height) in enumerate(settings):
+        matches = slice(index * per_setting, (index + 1) * per_setting)
+        hits = batch.paddle_hits[matches].mean() / minutes
+        misses = batch.misses[matches].sum(axis=1).mean() / minutes
+        print(f'{speed:10g}  {height:13g}  {hits:8.2f}  {misses:10.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
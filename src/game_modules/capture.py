@@ -0,0 +1,279 @@
+"""
+Frame capture.
+
+glReadPixels into client memory waits for the GPU to finish the frame, which
+costs about as much as drawing it. FrameCapture instead reads each frame
+into the next of a ring of pixel buffer objects: the copy happens on the GPU
+while the game goes on, and a buffer is only mapped once the ring wraps
+around to it, frames later, when its pixels are long done. A FrameWriter
+then encodes and saves them on a background thread.
+
+Capturing makes Game advance by exactly 1 / fps per frame, whatever the
+wall clock says, so recordings play at the right speed even when encoding
+or a slow (or GPU-less, headless) machine runs behind real time.
+"""
+from abc import ABC, abstractmethod
+from ctypes import string_at
+from pathlib import Path
+from queue import Queue
+from shlex import split
+from struct import pack
+from subprocess import PIPE, Popen
+from threading import Thread
+from zlib import compress, crc32
+
+import numpy as np
+from pyglet.gl import (
+    GL_MAP_READ_BIT,
+    GL_PACK_ALIGNMENT,
+    GL_PIXEL_PACK_BUFFER,
+    GL_RGBA,
+    GL_STREAM_READ,
+    GL_UNSIGNED_BYTE,
+    GLubyte,
+    GLuint,
+    glBindBuffer,
+    glBufferData,
+    glDeleteBuffers,
+    glGenBuffers,
+    glMapBufferRange,
+    glPixelStorei,
+    glReadPixels,
+    glUnmapBuffer,
+)
+
+from .consts import CAPTURE_BUFFERS, CAPTURE_FPS, CAPTURE_QUEUE_SIZE
+
+
+def read_pixels(width: int, height: int) -> np.ndarray:
+    """
+    Reads the current framebuffer right away, as (height, width, 4) RGBA
+    rows from the top. Stalls until the GPU is done: for tests, not frames.
+    """
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = (GLubyte * (width * height * 4))()
+    glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+    return _top_down(bytes(pixels), width, height)
+
+
+def _top_down(pixels: bytes, width: int, height: int) -> np.ndarray:
+    # OpenGL rows start at the bottom of the window
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 4)[
+        ::-1
+    ]
+
+
+def encode_png(frame: np.ndarray, level: int = 1) -> bytes:
+    """PNG of a (height, width, 4) RGBA frame, fast rather than small"""
+    height, width, _ = frame.shape
+    # Each row starts with its filter type, 0 for none
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = frame.reshape(height, -1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            pack('>I', len(data))
+            + kind
+            + data
+            + pack('>I', crc32(kind + data))
+        )
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        + chunk(b'IDAT', compress(rows.tobytes(), level))
+        + chunk(b'IEND', b'')
+    )
+
+
+class FrameWriter(ABC):
+    """
+    Writes captured frames from a background thread, subclasses say where.
+    The queue is bounded: when the writer falls that far behind, capture()
+    waits for it rather than dropping frames from the recording.
+    """
+
+    def __init__(self, queue_size: int = CAPTURE_QUEUE_SIZE) -> None:
+        self.width = self.height = self.fps = None
+        self.written = 0
+        self.error = None  # What stopped the writer, if anything did
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = None
+
+    def start(self, width: int, height: int, fps: int) -> None:
+        self.width, self.height, self.fps = width, height, fps
+        self._thread = Thread(
+            target=self._run, name='frame-writer', daemon=True
+        )
+        self._thread.start()
+
+    def put(self, index: int, pixels: bytes) -> None:
+        """Queues frame index, as read by glReadPixels"""
+        if self.error is not None:
+            raise RuntimeError('The frame writer failed') from self.error
+        self._queue.put((index, pixels))
+
+    def close(self) -> None:
+        """Writes what is still queued, then stops the thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                index, pixels = item
+                self.write(index, _top_down(pixels, self.width, self.height))
+                self.written += 1
+        except Exception as error:
+            self.error = error
+            # Keep emptying the queue, so capture() never blocks on it
+            while self._queue.get() is not None:
+                pass
+        finally:
+            self.finish()
+
+    @abstractmethod
+    def write(self, index: int, frame: np.ndarray) -> None:
+        """Writes a (height, width, 4) RGBA frame, rows from the top"""
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+class ImageSequenceWriter(FrameWriter):
+    """One file per frame in a directory, PNG or raw RGBA bytes"""
+
+    def __init__(
+        self,
+        directory: str,
+        format: str = 'png',
+        queue_size: int = CAPTURE_QUEUE_SIZE,
+    ) -> None:
+        if format not in ('png', 'raw'):
+            raise ValueError(f'Unknown frame format {format!r}')
+        super().__init__(queue_size=queue_size)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.format = format
+
+    def write(self, index: int, frame: np.ndarray) -> None:
+        path = self.directory / f'frame-{index:06d}.{self.format}'
+        if self.format == 'png':
+            path.write_bytes(encode_png(frame))
+        else:
+            path.write_bytes(frame.tobytes())
+
+
+class PipeWriter(FrameWriter):
+    """
+    Pipes raw RGBA frames into the standard input of an encoder process.
+    {width}, {height} and {fps} in the command are filled in, like:
+
+        ffmpeg -y -f rawvideo -pix_fmt rgba -s {width}x{height}
+            -r {fps} -i - -pix_fmt yuv420p match.mp4
+    """
+
+    def __init__(
+        self, command: str, queue_size: int = CAPTURE_QUEUE_SIZE
+    ) -> None:
+        super().__init__(queue_size=queue_size)
+        self.command = command
+        self.process = None
+
+    def start(self, width: int, height: int, fps: int) -> None:
+        self.process = Popen(
+            split(self.command.format(width=width, height=height, fps=fps)),
+            stdin=PIPE,
+        )
+        super().start(width, height, fps)
+
+    def write(self, index: int, frame: np.ndarray) -> None:
+        self.process.stdin.write(frame.tobytes())
+
+    def finish(self) -> None:
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class FrameCapture:
+    """
+    Captures the frames drawn into the current framebuffer: call capture()
+    once the frame is drawn, before the buffers are flipped. A frame reaches
+    the writer buffer_count - 1 frames after it was captured, close() hands
+    over the ones still in flight.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        writer: FrameWriter,
+        fps: int = CAPTURE_FPS,
+        buffer_count: int = CAPTURE_BUFFERS,
+        max_frames: int = None,
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.writer = writer
+        self.fps = fps
+        self.max_frames = max_frames  # Unlimited when None
+        self.frames = 0  # Captured so far
+        self._size = width * height * 4
+        self._buffers = (GLuint * buffer_count)()
+        glGenBuffers(buffer_count, self._buffers)
+        for buffer in self._buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(
+                GL_PIXEL_PACK_BUFFER, self._size, None, GL_STREAM_READ
+            )
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        writer.start(width, height, fps)
+
+    @property
+    def done(self) -> bool:
+        return self.max_frames is not None and self.frames >= self.max_frames
+
+    def capture(self) -> None:
+        buffer_count = len(self._buffers)
+        slot = self.frames % buffer_count
+        if self.frames >= buffer_count:
+            # The slot still holds the frame from buffer_count frames ago
+            self._hand_over(self.frames - buffer_count)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self._buffers[slot])
+        # With a pack buffer bound, the last argument is an offset into it
+        # and the call returns without waiting for the pixels
+        glReadPixels(
+            0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, 0
+        )
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.frames += 1
+
+    def close(self) -> None:
+        """Hands over the frames in flight, then waits for the writer"""
+        if self._buffers is None:
+            return
+        first = max(self.frames - len(self._buffers), 0)
+        for index in range(first, self.frames):
+            self._hand_over(index)
+        glDeleteBuffers(len(self._buffers), self._buffers)
+        self._buffers = None
+        self.writer.close()
+
+    def _hand_over(self, index: int) -> None:
+        glBindBuffer(
+            GL_PIXEL_PACK_BUFFER, self._buffers[index % len(self._buffers)]
+        )
+        address = glMapBufferRange(
+            GL_PIXEL_PACK_BUFFER, 0, self._size, GL_MAP_READ_BIT
+        )
+        pixels = string_at(address, self._size)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.writer.put(index, pixels)
@@ -7,3 +7,87 @@ COLOR_RED = (255, 0, 0, 255)
 COLOR_WHITE = (255, 255, 255, 255)
 COLOR_GREEN = (0, 255, 0, 255)
 COLOR_BLUE = (0, 0, 255, 255)
+
+# Game objects
+PADDLE_WIDTH = 20
+PADDLE_HEIGHT = 120
+PADDLE_SPEED = 200
+BALL_RADIUS = 10
+BALL_SPEED = 200
+
+# Game loop
+TICK_RATE = 120  # Physics ticks per second
+MAX_CATCH_UP_STEPS = 8  # Physics ticks run at most per update after a stall
+
+# Menus: a held key repeats its action after a delay, then at an interval
+MENU_REPEAT_DELAY = 0.4
+MENU_REPEAT_INTERVAL = 0.15
+
+# Sound effects
+SOUND_VOICES = 8  # Media players shared by every sound effect
+SOUND_MAX_VOICES_PER_SOUND = 2
+
+# Profiler
+PROFILER_HISTORY = 240  # Frames kept for the graph and percentiles
+PROFILER_HITCH_THRESHOLD = 0.02  # Frames slower than this are hitches
+
+# Input latency
+LATENCY_HISTORY = 1000  # Key events kept for the latency percentiles
+
+# Telemetry
+TELEMETRY_CAPACITY = 8192  # Events the ring holds until the thread flushes
+TELEMETRY_FLUSH_INTERVAL = 0.5  # Seconds between flushes
+TELEMETRY_MAX_BYTES = 8 * 1024 * 1024  # File size that triggers rotation
+TELEMETRY_BACKUPS = 3  # Rotated files kept
+
+# Replays
+REPLAY_SNAPSHOT_INTERVAL = 600  # Ticks between the snapshots used to seek
+
+# Netplay
+NETPLAY_PORT = 7777
+NETPLAY_MAX_ROLLBACK = 30  # Ticks a side may run ahead of the other one
+NETPLAY_RESEND_WINDOW = 64  # Unacknowledged inputs repeated per packet
+NETPLAY_START_DELAY = 0.5  # Seconds from the first hello to the start
+NETPLAY_SYNC_INTERVAL = 8  # Ticks at least between stalls to stay in step
+NETPLAY_SYNC_SMOOTHING = 0.05  # Weight of each packet in the tick advantage
+
+# Match server
+SERVER_PORT = 7878
+SERVER_MAX_ROOMS = 512  # Rows of the batch stepping every room's match
+SERVER_SNAPSHOT_RATE = 30  # Snapshots per second sent to each member
+SERVER_MAX_BUFFERED = 64 * 1024  # Bytes queued before a member skips some
+
+# CPU opponent: difficulty => (reaction delay in seconds, aim error in px)
+AI_DIFFICULTIES = {
+    'easy': (0.25, 60.0),
+    'normal': (0.12, 25.0),
+    'hard': (0.04, 6.0),
+}
+AI_DEFAULT_DIFFICULTY = 'normal'
+
+# Multi ball
+MULTIBALL_FILL = 0.25  # Share of the field covered by balls, sets radius
+
+# Particles
+PARTICLE_CAPACITY = 2048  # Particles alive at once, the oldest are recycled
+PARTICLE_DRAG = 3.0  # Share of their speed particles lose per second
+PARTICLE_SPARKS = 12  # Sparks per collision
+PARTICLE_SPARK_SPEED = 240
+PARTICLE_SPARK_LIFETIME = 0.35
+PARTICLE_TRAIL_LIFETIME = 0.2
+COLOR_SPARK_PADDLE = (255, 220, 120, 255)
+COLOR_SPARK_WALL = (120, 180, 255, 255)
+COLOR_TRAIL = (255, 255, 255, 160)
+
+# Match
+WINNING_SCORE = 5  # Points that win a match
+FONT_SIZES = (18, 24, 30, 36)  # Label sizes, their glyphs load at startup
+
+# Frame capture
+CAPTURE_FPS = 60  # Frames captured per second of game time
+CAPTURE_BUFFERS = 3  # Pixel buffers in flight, frames are read this late
+CAPTURE_QUEUE_SIZE = 8  # Frames waiting for the writer before capture waits
+
+# Presentation, see presenter
+RENDER_SCALE = 1.0  # Texture size relative to the logical resolution
+RENDER_FILTER = 'nearest'  # Or 'linear', when scaling the texture up
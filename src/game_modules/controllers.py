@@ -0,0 +1,25 @@
+"""
+Controllers decide the input bits of a paddle on each tick: read(state, dt)
+returns them for the simulation state about to be stepped. Gameplay ORs the
+bits of every controller into the inputs of the tick, so a paddle does not
+care whether a player or the CPU (see ai) drives it.
+"""
+from .simulation import SIDE_INPUTS, SimulationState
+
+
+class KeyboardController:
+    """Drives the paddle of a side from the keys held on a KeyStateHandler"""
+
+    def __init__(self, keyboard, side: int, key_up: int, key_down: int):
+        self.keyboard = keyboard
+        self.key_up = key_up
+        self.key_down = key_down
+        self.input_up, self.input_down = SIDE_INPUTS[side]
+
+    def read(self, state: SimulationState, dt: float) -> int:
+        inputs = 0
+        if self.keyboard[self.key_up]:
+            inputs |= self.input_up
+        if self.keyboard[self.key_down]:
+            inputs |= self.input_down
+        return inputs
@@ -0,0 +1,139 @@
+"""
+Entity component system.
+
+A World stores each component as a packed array with one row per entity,
+like positions in a (capacity, 2) array, next to a mask of the entities that
+have it. A system handles every entity with the components it needs in a
+few array operations instead of a method call per object, so adding
+entities adds rows, not Python calls. Queries for a set of components are
+cached until entities are spawned or despawned.
+
+Systems run in the order they were added: update() once per tick, render()
+once per frame, each only for the systems that override it. With timed set,
+the world keeps how long each one takes.
+
+Like the simulation, this module imports no pyglet: systems that draw live
+in systems.
+"""
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+
+# Weight of the newest run in the smoothed system timings
+_TIMING_SMOOTHING = 0.1
+
+
+class System:
+    """Base of the systems, both steps do nothing unless overridden"""
+
+    name = 'system'
+
+    def update(self, world: 'World', dt: float) -> None:
+        pass
+
+    def render(self, world: 'World', alpha: float) -> None:
+        pass
+
+
+class World:
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.components: dict[str, np.ndarray] = {}
+        self.masks: dict[str, np.ndarray] = {}
+        # Shared values that are not per entity, like the inputs of a tick
+        self.resources = {}
+        self.systems: list[System] = []
+        self.timed = False
+        # 'name.update' or 'name.render' => smoothed seconds per run
+        self.timings: dict[str, float] = {}
+        self.version = 0  # Bumped when entities come or go
+        self._queries = {}
+        self._updating: list[System] = []
+        self._rendering: list[System] = []
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.components[name]
+
+    def register(
+        self, name: str, shape: tuple = (), dtype=np.float64
+    ) -> np.ndarray:
+        """Adds a component, each row holding an array of shape"""
+        array = np.zeros((self.capacity, *shape), dtype=dtype)
+        self.components[name] = array
+        self.masks[name] = np.zeros(self.capacity, dtype=bool)
+        return array
+
+    def spawn(self, count: int = 1, **components) -> np.ndarray:
+        """
+        Creates count entities with the given component values, either one
+        value for all of them or one per entity. Returns their rows.
+        """
+        rows = np.flatnonzero(~self.alive)[:count]
+        if len(rows) < count:
+            raise ValueError(f'No room for {count} more entities')
+        self.alive[rows] = True
+        for name, value in components.items():
+            self.components[name][rows] = value
+            self.masks[name][rows] = True
+        self._changed()
+        return rows
+
+    def despawn(self, rows) -> None:
+        self.alive[rows] = False
+        for mask in self.masks.values():
+            mask[rows] = False
+        self._changed()
+
+    def query(self, *names: str) -> np.ndarray:
+        """Rows of the living entities having every named component"""
+        rows = self._queries.get(names)
+        if rows is None:
+            mask = self.alive.copy()
+            for name in names:
+                mask &= self.masks[name]
+            rows = self._queries[names] = np.flatnonzero(mask)
+        return rows
+
+    def add_system(self, system: System) -> System:
+        self.systems.append(system)
+        if type(system).update is not System.update:
+            self._updating.append(system)
+        if type(system).render is not System.render:
+            self._rendering.append(system)
+        return system
+
+    def get_system(self, name: str) -> Optional[System]:
+        for system in self.systems:
+            if system.name == name:
+                return system
+        return None
+
+    def update(self, dt: float) -> None:
+        if self.timed:
+            for system in self._updating:
+                start = perf_counter()
+                system.update(self, dt)
+                self._time(f'{system.name}.update', perf_counter() - start)
+        else:
+            for system in self._updating:
+                system.update(self, dt)
+
+    def render(self, alpha: float) -> None:
+        if self.timed:
+            for system in self._rendering:
+                start = perf_counter()
+                system.render(self, alpha)
+                self._time(f'{system.name}.render', perf_counter() - start)
+        else:
+            for system in self._rendering:
+                system.render(self, alpha)
+
+    def _time(self, key: str, seconds: float) -> None:
+        mean = self.timings.get(key, seconds)
+        self.timings[key] = mean + (seconds - mean) * _TIMING_SMOOTHING
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._queries.clear()
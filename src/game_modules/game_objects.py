@@ -1,176 +1,78 @@
-from random import choice
-from typing import Literal, Union
+from math import cos, pi, sin
+
+import numpy as np
+from pyglet.gl import GL_TRIANGLES
+from pyglet.graphics import Batch, Group, ShaderGroup
+from pyglet.shapes import get_default_shader
+
+# Kinds of shape a renderable entity is drawn as, see systems.RenderSystem
+SHAPE_BOX = 0
+SHAPE_CIRCLE = 1
+
+
+def _outline(kind: int, segments: int) -> np.ndarray:
+    """Triangles of a shape of half extents 1 around (0, 0), as (n, 2)"""
+    if kind == SHAPE_BOX:
+        return np.asarray(
+            ((-1, -1), (1, -1), (1, 1), (-1, -1), (1, 1), (-1, 1)),
+            dtype=np.float64,
+        )
+    # A fan of triangles around the centre
+    angles = [2 * pi * i / segments for i in range(segments + 1)]
+    fan = []
+    for i in range(segments):
+        fan += [0.0, 0.0]
+        fan += [cos(angles[i]), sin(angles[i])]
+        fan += [cos(angles[i + 1]), sin(angles[i + 1])]
+    return np.asarray(fan).reshape(-1, 2)
+
+
+class ShapeMesh:
+    """
+    Rendered view of many shapes of one kind, all in one vertex list: each
+    is made of triangles around its centre, scaled by its half extents, and
+    moving the shapes only rewrites the per vertex translations, in bulk
+    """
 
-from pyglet.shapes import Circle, Rectangle
-from pyglet.window.key import DOWN, UP, KeyStateHandler, S, W
-
-from .assets import sound_tuc
-from .consts import COLOR_WHITE, WINDOW_HEIGHT, WINDOW_WIDTH
-
-
-class Player(Rectangle):
     def __init__(
         self,
-        keyboard: KeyStateHandler,
-        key_to_up: Union[UP, W],
-        key_to_down: Union[DOWN, S],
-        x: int,
-        y: int,
+        kind: int,
+        half_extents: np.ndarray,
+        colors: np.ndarray,
+        batch: Batch = None,
+        group: Group = None,
+        segments: int = 12,
     ) -> None:
-        super().__init__(x=x, y=y, width=20, height=120, color=COLOR_WHITE)
-        self.keyboard = keyboard
-        self.key_to_up = key_to_up
-        self.key_to_down = key_to_down
-        self.x = x
-        self.y = y
-        self.speed = 200
-
-        # Centralize anchors from object
-        self.anchor_x = self.width / 2
-        self.anchor_y = self.height / 2
-
-    def update(self, dt) -> None:
-        if (
-            self.keyboard[self.key_to_up]
-            and not self._collide_with_top_window()
-        ):
-            self._move_to_up(dt=dt)
-        elif (
-            self.keyboard[self.key_to_down]
-            and not self._collide_with_bottom_window()
-        ):
-            self._move_to_down(dt=dt)
-
-    def draw(self) -> None:
-        super().draw()
-
-    def _get_top(self) -> int:
-        top = self.y + (self.height / 2)
-        return int(top)
-
-    def _get_bottom(self) -> int:
-        bottom = self.y - (self.height / 2)
-        return int(bottom)
-
-    def _collide_with_top_window(self) -> bool:
-        top = self._get_top()
-        if top <= WINDOW_HEIGHT:
-            return False
-        return True
-
-    def _collide_with_bottom_window(self) -> bool:
-        bottom = self._get_bottom()
-        if bottom >= 0:
-            return False
-        return True
-
-    def _move_to_up(self, dt) -> None:
-        self.y += self.speed * dt
-
-    def _move_to_down(self, dt) -> None:
-        self.y -= self.speed * dt
-
-
-class Ball(Circle):
-    def __init__(
-        self,
-        x: Union[int, float],
-        y: Union[int, float],
-        radius: Union[int, float],
-    ) -> None:
-        super().__init__(x=x, y=y, radius=radius, color=COLOR_WHITE)
-        self.x = x
-        self.y = y
-        self.radius = radius
-
-        # Centralize anchors from object
-        # self.anchor_x = self.width / 2
-        # self.anchor_y = self.height / 2
-        # Circle já é centralizado por padrão
-
-        self.speed = 200
-        self.direction_x: Literal['left', 'right'] = choice(['left', 'right'])
-        self.direction_y: Literal['up', 'down'] = choice(['up', 'down'])
-
-    def draw(self) -> None:
-        super().draw()
-
-    def update(self, dt) -> None:
-        self._handle_collide()
-
-        if self.direction_x == 'left':
-            self._move_to_left(dt=dt)
-        elif self.direction_x == 'right':
-            self._move_to_right(dt=dt)
-
-        if self.direction_y == 'up':
-            self._move_to_up(dt=dt)
-        elif self.direction_y == 'down':
-            self._move_to_down(dt=dt)
-
-    def _get_left(self) -> int:
-        left = self.x - (self.radius / 2)
-        return int(left)
-
-    def _get_right(self) -> int:
-        right = self.x + (self.radius / 2)
-        return int(right)
-
-    def _get_top(self) -> int:
-        top = self.y + (self.radius / 2)
-        return int(top)
-
-    def _get_bottom(self) -> int:
-        bottom = self.y - (self.radius / 2)
-        return int(bottom)
-
-    def _collide_with_left_window(self) -> bool:
-        left = self._get_left()
-        if left >= 0:
-            return False
-        return True
-
-    def _collide_with_right_window(self) -> bool:
-        right = self._get_right()
-        if right <= WINDOW_WIDTH:
-            return False
-        return True
-
-    def _collide_with_top_window(self) -> bool:
-        top = self._get_top()
-        if top <= WINDOW_HEIGHT:
-            return False
-        return True
-
-    def _collide_with_bottom_window(self) -> bool:
-        bottom = self._get_bottom()
-        if bottom >= 0:
-            return False
-        return True
-
-    def _handle_collide(self) -> None:
-        if self.direction_x == 'left' and self._collide_with_left_window():
-            sound_tuc.play()
-            self.direction_x = 'right'
-        elif self.direction_x == 'right' and self._collide_with_right_window():
-            sound_tuc.play()
-            self.direction_x = 'left'
-
-        if self.direction_y == 'up' and self._collide_with_top_window():
-            sound_tuc.play()
-            self.direction_y = 'down'
-        elif self.direction_y == 'down' and self._collide_with_bottom_window():
-            sound_tuc.play()
-            self.direction_y = 'up'
-
-    def _move_to_left(self, dt) -> None:
-        self.x -= self.speed * dt
-
-    def _move_to_right(self, dt) -> None:
-        self.x += self.speed * dt
-
-    def _move_to_up(self, dt) -> None:
-        self.y += self.speed * dt
-
-    def _move_to_down(self, dt) -> None:
-        self.y -= self.speed * dt
+        """half_extents is (n, 2) and colors (n, 4), one row per shape"""
+        outline = _outline(kind, segments)
+        self.count = len(half_extents)
+        self.vertices_per_shape = len(outline)
+        position = outline[None, :, :] * np.asarray(half_extents)[:, None, :]
+        colors = np.repeat(
+            np.asarray(colors, dtype=np.uint8), self.vertices_per_shape, axis=0
+        )
+
+        program = get_default_shader()
+        vertices = self.count * self.vertices_per_shape
+        self.vertex_list = program.vertex_list(
+            vertices,
+            GL_TRIANGLES,
+            batch=batch,
+            group=ShaderGroup(program=program, parent=group),
+            position=('f', position.ravel().tolist()),
+            colors=('Bn', colors.ravel().tolist()),
+            translation=('f', (0.0, 0.0) * vertices),
+            rotation=('f', (0.0,) * vertices),
+        )
+
+    def sync(self, positions: np.ndarray) -> None:
+        """Moves every shape to its row of the (n, 2) positions"""
+        # Reading the attribute marks it for upload, writes go straight to
+        # the mapped buffer
+        translation = np.ctypeslib.as_array(
+            self.vertex_list.translation
+        ).reshape(self.count, self.vertices_per_shape, 2)
+        translation[:] = positions[:, None, :]
+
+    def delete(self) -> None:
+        self.vertex_list.delete()
@@ -1,19 +1,47 @@
 from abc import ABC, abstractmethod
-from time import time
-from typing import Literal
 
+from pyglet.clock import schedule_once, unschedule
+from pyglet.graphics import Batch, Group
 from pyglet.text import Label
-from pyglet.window.key import DOWN, ENTER, SPACE, UP, KeyStateHandler, S, W
-
-from .assets import font_press_start_2p, sound_click
-from .consts import COLOR_GREEN, COLOR_WHITE, WINDOW_HEIGHT, WINDOW_WIDTH
-from .game_objects import Ball, Player
+from pyglet.window.key import DOWN, ENTER, SPACE, UP, S, W
+
+from .assets import font_press_start_2p
+from .consts import (
+    AI_DEFAULT_DIFFICULTY,
+    COLOR_GREEN,
+    COLOR_WHITE,
+    MENU_REPEAT_DELAY,
+    MENU_REPEAT_INTERVAL,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
 from .gui import Checkbox
 
 
 class GameState(ABC):
-    def __init__(self) -> None:
-        self.game = None
+    # Animated states are updated and drawn every frame, the others only
+    # when marked dirty (with idle pacing, see Game)
+    animated = True
+    # Cacheable states are built once by Game.get_state and reused, so their
+    # labels and glyph layouts survive transitions
+    cacheable = False
+    # ecs.World of the states made of entities and systems
+    world = None
+
+    def __init__(self, game) -> None:
+        self.game = game
+
+        # Event handlers pushed on the window while the state is active
+        self.handlers = []
+
+        # Every object of the state joins this batch, so drawing a frame
+        # costs a single batch.draw() call
+        self.batch = Batch()
+        self.background = Group(order=0)
+        self.foreground = Group(order=1)
+
+        # Whether the state needs drawing, see animated
+        self.dirty = True
 
     @abstractmethod
     def enter(self):
@@ -27,21 +55,105 @@ class GameState(ABC):
     def update(self, dt):
         pass
 
-    @abstractmethod
-    def draw(self):
+    def interpolate(self, alpha: float) -> None:
+        """
+        Called before each draw with how far the frame lies between the
+        last two physics ticks, from 0 (previous tick) to 1 (last tick)
+        """
         pass
 
+    def draw(self) -> None:
+        self.batch.draw()
+
+    def mark_dirty(self) -> None:
+        """Asks for a frame, to show a change of a state not animated"""
+        self.dirty = True
+        self.game.request_frame()
+
+
+class MenuState(GameState):
+    """
+    Menu driven by key events: nothing runs on the game ticks, the pointer
+    only moves when a key is pressed and held keys repeat on the clock
+    """
 
-class MainMenuState(GameState):
-    def __init__(self) -> None:
-        super().__init__()
+    cacheable = True
+    animated = False
+    keys_to_up = (UP, W)
+    keys_to_down = (DOWN, S)
+    keys_to_execute = (ENTER, SPACE)
+    repeat_delay = MENU_REPEAT_DELAY
+    repeat_interval = MENU_REPEAT_INTERVAL
+
+    def __init__(self, game) -> None:
+        super().__init__(game=game)
+
+        # The menu itself handles the key events
+        self.handlers.append(self)
+        self.selected_option = 0
+        self._repeating_key = None
+
+        # Filled by subclasses, the pointer lines up with each option
+        self.options = []
+        self.pointer_label = None
 
     def enter(self) -> None:
-        # Key handler
-        self.keyboard = KeyStateHandler()
-        self.game.push_handlers(self.keyboard)
-        self.last_key_action_time = 0
-        self.key_action_cooldown = 0.2
+        pass
+
+    def exit(self) -> None:
+        self._stop_repeat()
+
+    def update(self, dt) -> None:
+        pass
+
+    def on_key_press(self, symbol, modifiers) -> None:
+        if symbol in self.keys_to_up or symbol in self.keys_to_down:
+            self._stop_repeat()
+            self._move_pointer(symbol=symbol)
+            self._repeating_key = symbol
+            schedule_once(self._repeat_key, self.repeat_delay)
+        elif symbol in self.keys_to_execute:
+            self.game.sound_effects.play('click')
+            self._execute_option()
+            self.mark_dirty()
+
+    def on_key_release(self, symbol, modifiers) -> None:
+        if symbol == self._repeating_key:
+            self._stop_repeat()
+
+    def on_deactivate(self) -> None:
+        # Key releases are lost while the window is out of focus
+        self._stop_repeat()
+
+    def _repeat_key(self, dt) -> None:
+        self._move_pointer(symbol=self._repeating_key)
+        schedule_once(self._repeat_key, self.repeat_interval)
+
+    def _stop_repeat(self) -> None:
+        if self._repeating_key is not None:
+            unschedule(self._repeat_key)
+            self._repeating_key = None
+
+    def _move_pointer(self, symbol) -> None:
+        self.game.sound_effects.play('click')
+        step = -1 if symbol in self.keys_to_up else 1
+        self.selected_option = (self.selected_option + step) % len(
+            self.options
+        )
+        self._update_pointer_position()
+
+    def _update_pointer_position(self) -> None:
+        self.pointer_label.y = self.options[self.selected_option].y
+        self.mark_dirty()
+
+    @abstractmethod
+    def _execute_option(self) -> None:
+        pass
+
+
+class MainMenuState(MenuState):
+    def __init__(self, game) -> None:
+        super().__init__(game=game)
 
         # GUI Components
         self.title_label = Label(
@@ -52,6 +164,8 @@ class MainMenuState(GameState):
             y=WINDOW_HEIGHT - 100,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.start_label = Label(
             'Iniciar Jogo',
@@ -61,6 +175,8 @@ class MainMenuState(GameState):
             y=WINDOW_HEIGHT // 2,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.options_label = Label(
             'Opções',
@@ -70,6 +186,8 @@ class MainMenuState(GameState):
             y=WINDOW_HEIGHT // 2 - 50,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.exit_label = Label(
             'Sair',
@@ -79,6 +197,8 @@ class MainMenuState(GameState):
             y=WINDOW_HEIGHT // 2 - 100,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.pointer_label = Label(
             '→',
@@ -88,92 +208,34 @@ class MainMenuState(GameState):
             y=WINDOW_HEIGHT // 2,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
-        self.pointer_selected_option: Literal[
-            'Iniciar Jogo', 'Opções', 'Sair'
-        ] = 'Iniciar Jogo'
-
-    def exit(self) -> None:
-        pass
-
-    def update(self, dt) -> None:
-        self._update_pointer_position()
-        if self._is_time_for_action():
-            if self.keyboard[UP] or self.keyboard[W]:
-                self._move_pointer_to_up()
-            elif self.keyboard[DOWN] or self.keyboard[S]:
-                self._move_pointer_to_down()
-            elif self.keyboard[ENTER] or self.keyboard[SPACE]:
-                self._execute_option()
-
-    def draw(self):
-        self.title_label.draw()
-        self.start_label.draw()
-        self.options_label.draw()
-        self.exit_label.draw()
-        self.pointer_label.draw()
-
-    def _update_pointer_position(self) -> None:
-        if self.pointer_selected_option == 'Iniciar Jogo':
-            self.pointer_label.y = self.start_label.y
-        elif self.pointer_selected_option == 'Opções':
-            self.pointer_label.y = self.options_label.y
-        elif self.pointer_selected_option == 'Sair':
-            self.pointer_label.y = self.exit_label.y
-
-    def _is_time_for_action(self) -> bool:
-        current_time = time()
-        elapsed_time = current_time - self.last_key_action_time
-        if elapsed_time > self.key_action_cooldown:
-            return True
-        elif elapsed_time < self.key_action_cooldown:
-            return False
-
-    def _update_last_key_action_time(self) -> None:
-        current_time = time()
-        self.last_key_action_time = current_time
-
-    def _move_pointer_to_up(self) -> None:
-        sound_click.play()
-        self._update_last_key_action_time()
-        if self.pointer_selected_option == 'Iniciar Jogo':
-            self.pointer_selected_option = 'Sair'
-        elif self.pointer_selected_option == 'Opções':
-            self.pointer_selected_option = 'Iniciar Jogo'
-        elif self.pointer_selected_option == 'Sair':
-            self.pointer_selected_option = 'Opções'
-
-    def _move_pointer_to_down(self) -> None:
-        sound_click.play()
-        self._update_last_key_action_time()
-        if self.pointer_selected_option == 'Iniciar Jogo':
-            self.pointer_selected_option = 'Opções'
-        elif self.pointer_selected_option == 'Opções':
-            self.pointer_selected_option = 'Sair'
-        elif self.pointer_selected_option == 'Sair':
-            self.pointer_selected_option = 'Iniciar Jogo'
+        self.options = [self.start_label, self.options_label, self.exit_label]
 
     def _execute_option(self) -> None:
-        sound_click.play()
-        self._update_last_key_action_time()
-        if self.pointer_selected_option == 'Iniciar Jogo':
-            self.game.set_state(state=GameplayState())
-        elif self.pointer_selected_option == 'Opções':
-            self.game.set_state(state=OptionMenuState())
-        elif self.pointer_selected_option == 'Sair':
+        option = self.options[self.selected_option]
+        if option is self.start_label:
+            # Imported on first use: matches need NumPy and the simulation
+            # modules, the menus shown at startup do not
+            from .gameplay_states import GameplayState, MultiBallGameplayState
+
+            if self.game.ball_count > 1:
+                gameplay = MultiBallGameplayState
+            else:
+                gameplay = GameplayState
+            self.game.push_state(state=self.game.get_state(gameplay))
+        elif option is self.options_label:
+            self.game.push_state(state=self.game.get_state(OptionMenuState))
+        elif option is self.exit_label:
             self.game.quit()
 
 
-class OptionMenuState(GameState):
-    def __init__(self) -> None:
-        super().__init__()
+class OptionMenuState(MenuState):
+    keys_to_execute = (ENTER,)
 
-    def enter(self) -> None:
-        # Key handler
-        self.keyboard = KeyStateHandler()
-        self.game.push_handlers(self.keyboard)
-        self.last_key_action_time = 0
-        self.key_action_cooldown = 0.2
+    def __init__(self, game) -> None:
+        super().__init__(game=game)
 
         # GUI Components
         self.title_label = Label(
@@ -184,6 +246,8 @@ class OptionMenuState(GameState):
             y=WINDOW_HEIGHT - 100,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.show_fps_label = Label(
             'Mostrar FPS',
@@ -193,6 +257,8 @@ class OptionMenuState(GameState):
             y=WINDOW_HEIGHT // 2,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.show_fps_button = Checkbox(
             x=self.show_fps_label.x - 220,
@@ -202,15 +268,63 @@ class OptionMenuState(GameState):
             line_color=COLOR_GREEN,
             border_color=COLOR_WHITE,
             fill_type='v',
+            batch=self.batch,
+            group=self.background,
+        )
+        self.show_profiler_label = Label(
+            'Mostrar perfil',
+            font_name=font_press_start_2p,
+            font_size=24,
+            x=WINDOW_WIDTH // 2,
+            y=self.show_fps_label.y - 60,
+            anchor_x='center',
+            anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
+        )
+        self.show_profiler_button = Checkbox(
+            x=self.show_profiler_label.x - 220,
+            y=self.show_profiler_label.y - 10,
+            size=20,
+            checked=self.game.show_profiler,
+            line_color=COLOR_GREEN,
+            border_color=COLOR_WHITE,
+            fill_type='v',
+            batch=self.batch,
+            group=self.background,
+        )
+        self.cpu_opponent_label = Label(
+            'Jogar contra CPU',
+            font_name=font_press_start_2p,
+            font_size=24,
+            x=WINDOW_WIDTH // 2,
+            y=self.show_profiler_label.y - 60,
+            anchor_x='center',
+            anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
+        )
+        self.cpu_opponent_button = Checkbox(
+            x=self.cpu_opponent_label.x - 220,
+            y=self.cpu_opponent_label.y - 10,
+            size=20,
+            checked=self.game.cpu_difficulty is not None,
+            line_color=COLOR_GREEN,
+            border_color=COLOR_WHITE,
+            fill_type='v',
+            batch=self.batch,
+            group=self.background,
         )
         self.return_to_main_menu_label = Label(
             'Voltar ao menu principal',
             font_name=font_press_start_2p,
             font_size=24,
             x=WINDOW_WIDTH // 2,
-            y=self.show_fps_label.y - 60,
+            y=self.cpu_opponent_label.y - 60,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
         self.pointer_label = Label(
             '→',
@@ -220,113 +334,39 @@ class OptionMenuState(GameState):
             y=self.show_fps_button.y,
             anchor_x='center',
             anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
         )
-        self.pointer_selected_option: Literal[
-            'Mostrar FPS', 'Voltar ao menu principal'
-        ] = 'Mostrar FPS'
-
-    def exit(self) -> None:
-        pass
-
-    def update(self, dt) -> None:
-        self._update_pointer_position()
-        if self._is_time_for_action():
-            if self.keyboard[UP] or self.keyboard[W]:
-                self._move_pointer_to_up()
-            elif self.keyboard[DOWN] or self.keyboard[S]:
-                self._move_pointer_to_down()
-            elif self.keyboard[ENTER]:
-                self._execute_option()
-        self.game.show_fps = self.show_fps_button.checked
-
-    def draw(self) -> None:
-        self.title_label.draw()
-        self.show_fps_label.draw()
-        self.show_fps_button.draw()
-        self.return_to_main_menu_label.draw()
-        self.pointer_label.draw()
-
-    def _update_pointer_position(self) -> None:
-        if self.pointer_selected_option == 'Mostrar FPS':
-            self.pointer_label.y = self.show_fps_button.y
-        elif self.pointer_selected_option == 'Voltar ao menu principal':
-            self.pointer_label.y = self.return_to_main_menu_label.y
-
-    def _is_time_for_action(self) -> bool:
-        current_time = time()
-        elapsed_time = current_time - self.last_key_action_time
-        if elapsed_time > self.key_action_cooldown:
-            return True
-        elif elapsed_time < self.key_action_cooldown:
-            return False
-
-    def _update_last_key_action_time(self) -> None:
-        current_time = time()
-        self.last_key_action_time = current_time
-
-    def _move_pointer_to_up(self) -> None:
-        sound_click.play()
-        self._update_last_key_action_time()
-        if self.pointer_selected_option == 'Mostrar FPS':
-            self.pointer_selected_option = 'Voltar ao menu principal'
-        elif self.pointer_selected_option == 'Voltar ao menu principal':
-            self.pointer_selected_option = 'Mostrar FPS'
-
-    def _move_pointer_to_down(self) -> None:
-        sound_click.play()
-        self._update_last_key_action_time()
-        if self.pointer_selected_option == 'Mostrar FPS':
-            self.pointer_selected_option = 'Voltar ao menu principal'
-        elif self.pointer_selected_option == 'Voltar ao menu principal':
-            self.pointer_selected_option = 'Mostrar FPS'
-
-    def _execute_option(self) -> None:
-        sound_click.play()
-        self._update_last_key_action_time()
-        if self.pointer_selected_option == 'Mostrar FPS':
-            if self.show_fps_button.checked:
-                self.show_fps_button.checked = False
-            elif not self.show_fps_button.checked:
-                self.show_fps_button.checked = True
-        elif self.pointer_selected_option == 'Voltar ao menu principal':
-            self.game.set_state(state=MainMenuState())
-
-
-class GameplayState(GameState):
-    def __init__(self) -> None:
-        super().__init__()
+        self.options = [
+            self.show_fps_button,
+            self.show_profiler_button,
+            self.cpu_opponent_button,
+            self.return_to_main_menu_label,
+        ]
 
     def enter(self) -> None:
-        # Key handler
-        self.keyboard = KeyStateHandler()
-        self.game.push_handlers(self.keyboard)
-
-        # Game objects
-        self.player_1 = Player(
-            keyboard=self.keyboard,
-            key_to_up=W,
-            key_to_down=S,
-            x=20,
-            y=WINDOW_HEIGHT / 2,
-        )
-        self.player_2 = Player(
-            keyboard=self.keyboard,
-            key_to_up=UP,
-            key_to_down=DOWN,
-            x=WINDOW_WIDTH - 20,
-            y=WINDOW_HEIGHT / 2,
-        )
-        self.ball = Ball(x=WINDOW_WIDTH / 2, y=WINDOW_HEIGHT / 2, radius=10)
-
-    def exit(self) -> None:
-        pass
-
-    def update(self, dt) -> None:
-        self.player_1.update(dt=dt)
-        self.player_2.update(dt=dt)
-        self.ball.update(dt=dt)
+        self.show_fps_button.checked = self.game.show_fps
+        self.show_profiler_button.checked = self.game.show_profiler
+        self.cpu_opponent_button.checked = self.game.cpu_difficulty is not None
 
-    def draw(self) -> None:
-        self.player_1.draw()
-        self.player_2.draw()
-        self.ball.draw()
+    def _execute_option(self) -> None:
+        option = self.options[self.selected_option]
+        if option is self.show_fps_button:
+            self.show_fps_button.checked = not self.show_fps_button.checked
+            self.game.show_fps = self.show_fps_button.checked
+        elif option is self.show_profiler_button:
+            self.show_profiler_button.checked = (
+                not self.show_profiler_button.checked
+            )
+            self.game.show_profiler = self.show_profiler_button.checked
+        elif option is self.cpu_opponent_button:
+            self.cpu_opponent_button.checked = (
+                not self.cpu_opponent_button.checked
+            )
+            self.game.cpu_difficulty = (
+                AI_DEFAULT_DIFFICULTY
+                if self.cpu_opponent_button.checked
+                else None
+            )
+        elif option is self.return_to_main_menu_label:
+            self.game.pop_state()
@@ -0,0 +1,407 @@
+"""
+States that play matches, kept apart from the menus so that startup, which
+only shows the main menu, does not import NumPy and the simulation.
+
+Paddles and balls are entities of a World, moved, heard and drawn by its
+systems (see ecs and systems); the states only set them up and handle the
+match around them.
+"""
+from random import getrandbits
+from time import perf_counter, strftime
+
+import numpy as np
+from pyglet.text import Label
+from pyglet.window.key import DOWN, ESCAPE, UP, KeyStateHandler, S, W
+
+from .ai import AIController
+from .assets import font_press_start_2p
+from .consts import (
+    COLOR_SPARK_PADDLE,
+    COLOR_SPARK_WALL,
+    COLOR_WHITE,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
+from .controllers import KeyboardController
+from .game_objects import SHAPE_BOX, SHAPE_CIRCLE
+from .game_states import GameState
+from .gui import ScoreBoard
+from .multiball import MultiBallAIController, MultiBallSimulation
+from .netplay import RollbackSession
+from .particles import ParticleSystem
+from .replay import Recording
+from .simulation import (
+    EVENT_GOAL,
+    EVENT_PADDLE_HIT,
+    EVENT_WALL_BOUNCE,
+    SimulationState,
+    checksum,
+    winner,
+)
+from .systems import (
+    AudioSystem,
+    EffectsSystem,
+    InputSystem,
+    MultiBallPhysicsSystem,
+    PhysicsSystem,
+    RenderSystem,
+    RollbackPhysicsSystem,
+    TelemetrySystem,
+    match_world,
+)
+from .telemetry import MATCH_END
+
+
+class GameplayState(GameState):
+    def __init__(self, game) -> None:
+        super().__init__(game=game)
+
+        # Key handlers, the state itself handles ESC
+        self.keyboard = KeyStateHandler()
+        self.handlers.append(self.keyboard)
+        self.handlers.append(self)
+
+        seed = self.game.seed
+        if seed is None:
+            seed = getrandbits(32)
+        self.simulation = SimulationState(seed=seed)
+
+        # Paddle controllers, the right one is the CPU when enabled
+        self.controllers = [
+            KeyboardController(self.keyboard, side=1, key_up=W, key_down=S)
+        ]
+        if self.game.cpu_difficulty is None:
+            self.controllers.append(
+                KeyboardController(
+                    self.keyboard, side=2, key_up=UP, key_down=DOWN
+                )
+            )
+        else:
+            self.controllers.append(
+                AIController(
+                    side=2, difficulty=self.game.cpu_difficulty, seed=seed
+                )
+            )
+
+        # Per tick inputs, to replay the match (fixed timestep only)
+        self.recording = None
+        if self.game.record_dir and self.game.fixed_timestep:
+            self.recording = Recording(seed=seed, dt=self.game.tick_interval)
+
+        # Entities: both paddles, then the ball
+        self.world = match_world(capacity=3)
+        paddles = (self.simulation.paddle_1, self.simulation.paddle_2)
+        positions = [(paddle.x, paddle.y) for paddle in paddles]
+        self.paddle_rows = self.world.spawn(
+            2,
+            position=positions,
+            previous_position=positions,
+            collider=[
+                (paddle.width / 2, paddle.height / 2) for paddle in paddles
+            ],
+            shape=SHAPE_BOX,
+            color=COLOR_WHITE,
+        )
+        ball = self.simulation.ball
+        self.ball_rows = self.world.spawn(
+            position=(ball.x, ball.y),
+            previous_position=(ball.x, ball.y),
+            velocity=(ball.vx, ball.vy),
+            collider=(ball.radius, ball.radius),
+            shape=SHAPE_CIRCLE,
+            color=COLOR_WHITE,
+            trail=True,
+        )
+
+        # Sparks and the ball trail, behind everything else
+        self.particles = ParticleSystem(
+            batch=self.batch, group=self.background, seed=seed
+        )
+        for system in (
+            *self._simulation_systems(),
+            *self._telemetry_systems(),
+            AudioSystem(self.game.sound_effects),
+            EffectsSystem(
+                self.particles,
+                spark_colors={
+                    EVENT_PADDLE_HIT: COLOR_SPARK_PADDLE,
+                    EVENT_WALL_BOUNCE: COLOR_SPARK_WALL,
+                    EVENT_GOAL: COLOR_SPARK_WALL,
+                },
+            ),
+            RenderSystem(batch=self.batch, group=self.foreground),
+        ):
+            self.world.add_system(system)
+
+        # Points and match time, then who won once the match is over
+        self.elapsed = 0.0
+        self.winner = None
+        self.score_board = ScoreBoard(batch=self.batch, group=self.foreground)
+        self.winner_label = Label(
+            '',
+            font_name=font_press_start_2p,
+            font_size=24,
+            x=WINDOW_WIDTH // 2,
+            y=WINDOW_HEIGHT // 2,
+            anchor_x='center',
+            anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
+        )
+
+    def _simulation_systems(self) -> tuple:
+        """Systems that read the inputs and step the simulation"""
+        return (
+            InputSystem(self.controllers, self.simulation, self.recording),
+            PhysicsSystem(self.simulation, self.paddle_rows, self.ball_rows),
+        )
+
+    def _telemetry_systems(self) -> tuple:
+        if self.game.telemetry is None:
+            return ()
+        return (
+            TelemetrySystem(
+                self.game.telemetry, self.simulation, self.ball_rows
+            ),
+        )
+
+    def enter(self) -> None:
+        self.keyboard.data.clear()
+
+    def exit(self) -> None:
+        if self.recording is not None and len(self.recording):
+            self.recording.final_checksum = checksum(self.simulation)
+            self.recording.save(
+                path=self.game.record_dir
+                / f'match-{strftime("%Y%m%d-%H%M%S")}.pong'
+            )
+            self.recording = None
+
+    def on_key_press(self, symbol, modifiers) -> None:
+        if symbol == ESCAPE:
+            self.game.pop_state()
+
+    def update(self, dt) -> None:
+        if self.winner is not None:
+            self.particles.update(dt)
+            return
+        self.world.update(dt)
+        self.elapsed += dt
+        self._update_score_board()
+        side = winner(self.simulation)
+        if side is not None:
+            self._end_match(side)
+
+    def interpolate(self, alpha: float) -> None:
+        self.world.render(alpha)
+
+    def _update_score_board(self) -> None:
+        self.score_board.update(
+            self.simulation.score_1, self.simulation.score_2, self.elapsed
+        )
+
+    def _end_match(self, side: int) -> None:
+        self.winner = side
+        self.world.despawn(self.ball_rows)
+        if any(
+            isinstance(controller, AIController) and controller.side == side
+            for controller in self.controllers
+        ):
+            self.winner_label.text = 'CPU venceu!'
+        else:
+            self.winner_label.text = f'Jogador {side} venceu!'
+        self.game.sound_effects.play('you_win')
+        if self.game.telemetry is not None:
+            self.game.telemetry.emit(
+                MATCH_END,
+                side,
+                self.simulation.score_1,
+                self.simulation.score_2,
+                self.elapsed,
+            )
+
+
+class MultiBallGameplayState(GameState):
+    """
+    Match with game.ball_count balls bouncing off the walls, the paddles and
+    each other, see multiball. Not recorded, replays only know one ball.
+    """
+
+    def __init__(self, game) -> None:
+        super().__init__(game=game)
+
+        # Key handlers, the state itself handles ESC
+        self.keyboard = KeyStateHandler()
+        self.handlers.append(self.keyboard)
+        self.handlers.append(self)
+
+        seed = self.game.seed
+        if seed is None:
+            seed = getrandbits(32)
+        self.simulation = MultiBallSimulation(
+            count=self.game.ball_count, seed=seed
+        )
+
+        self.controllers = [
+            KeyboardController(self.keyboard, side=1, key_up=W, key_down=S)
+        ]
+        if self.game.cpu_difficulty is None:
+            self.controllers.append(
+                KeyboardController(
+                    self.keyboard, side=2, key_up=UP, key_down=DOWN
+                )
+            )
+        else:
+            self.controllers.append(
+                MultiBallAIController(
+                    side=2, difficulty=self.game.cpu_difficulty, seed=seed
+                )
+            )
+
+        # Entities: both paddles, as in the first row of the batch, then
+        # every ball
+        simulation = self.simulation
+        self.world = match_world(capacity=simulation.count + 2)
+        positions = np.column_stack(
+            (simulation.paddle_x[0], simulation.paddle_y[0])
+        )
+        paddle_rows = self.world.spawn(
+            2,
+            position=positions,
+            previous_position=positions,
+            collider=np.repeat(
+                [[simulation.paddle_width[0], simulation.paddle_height[0]]],
+                2,
+                axis=0,
+            )
+            / 2,
+            shape=SHAPE_BOX,
+            color=COLOR_WHITE,
+        )
+        positions = np.column_stack((simulation.ball_x, simulation.ball_y))
+        ball_rows = self.world.spawn(
+            simulation.count,
+            position=positions,
+            previous_position=positions,
+            velocity=np.column_stack((simulation.ball_vx, simulation.ball_vy)),
+            collider=np.repeat(simulation.ball_radius[:, None], 2, axis=1),
+            shape=SHAPE_CIRCLE,
+            color=COLOR_WHITE,
+        )
+
+        # Sparks of the paddle hits only, with this many balls the others
+        # would fill the screen
+        self.particles = ParticleSystem(
+            batch=self.batch, group=self.background, seed=seed
+        )
+        for system in (
+            InputSystem(self.controllers, simulation),
+            MultiBallPhysicsSystem(simulation, paddle_rows, ball_rows),
+            AudioSystem(self.game.sound_effects),
+            EffectsSystem(
+                self.particles,
+                spark_colors={EVENT_PADDLE_HIT: COLOR_SPARK_PADDLE},
+            ),
+            RenderSystem(batch=self.batch, group=self.foreground),
+        ):
+            self.world.add_system(system)
+
+    def enter(self) -> None:
+        self.keyboard.data.clear()
+
+    def exit(self) -> None:
+        pass
+
+    def on_key_press(self, symbol, modifiers) -> None:
+        if symbol == ESCAPE:
+            self.game.pop_state()
+
+    def update(self, dt) -> None:
+        self.world.update(dt)
+
+    def interpolate(self, alpha: float) -> None:
+        self.world.render(alpha)
+
+
+class NetplayState(GameplayState):
+    """
+    Match against a player on another machine. The local player controls
+    the paddle of its side with W/S or the arrows, see netplay for how the
+    inputs of both sides are kept in sync.
+    """
+
+    def __init__(self, game, side: int, transport) -> None:
+        # Read by _simulation_systems, during the base initialization
+        self.side = side
+        self.transport = transport
+        super().__init__(game=game)
+        # Only the local inputs are known when stepping, nothing to record,
+        # and both sides are players
+        self.recording = None
+        self.controllers = []
+        self.waiting_label = Label(
+            'Aguardando oponente...',
+            font_name=font_press_start_2p,
+            font_size=18,
+            x=WINDOW_WIDTH // 2,
+            y=WINDOW_HEIGHT - 100,
+            anchor_x='center',
+            anchor_y='center',
+            batch=self.batch,
+            group=self.foreground,
+        )
+
+    def _simulation_systems(self) -> tuple:
+        self.session = RollbackSession(
+            side=self.side,
+            transport=self.transport,
+            state=self.simulation,
+            dt=self.game.tick_interval,
+        )
+        self.physics = RollbackPhysicsSystem(
+            self.session, self._local_input, self.paddle_rows, self.ball_rows
+        )
+        return (self.physics,)
+
+    def _telemetry_systems(self) -> tuple:
+        # Events of predicted ticks would be logged even when a rollback
+        # undoes them: only the match end, final once confirmed, is logged
+        return ()
+
+    def exit(self) -> None:
+        super().exit()
+        self.session.transport.close()
+
+    def update(self, dt) -> None:
+        if self.winner is not None or winner(self.simulation) is not None:
+            self.particles.update(dt)
+            # Polling keeps confirming the peer's ticks, so it ends too. A
+            # win is only final once every remote input up to it is known,
+            # a rollback may still undo a predicted one.
+            self.session.poll(now=perf_counter())
+            if self.winner is None:
+                self.physics.publish(self.world, with_events=False)
+            self._update_score_board()
+            side = winner(self.simulation)
+            if (
+                self.winner is None
+                and side is not None
+                and self.session.remote_confirmed >= self.simulation.tick
+            ):
+                self._end_match(side)
+            return
+        self.world.update(dt)
+        # Also shown when stalled waiting for inputs of a lagging peer, not
+        # for the single ticks skipped to stay in step with it
+        waiting = not self.session.can_advance()
+        if self.waiting_label.visible != waiting:
+            self.waiting_label.visible = waiting
+        if self.physics.advanced:
+            self.elapsed += dt
+            self._update_score_board()
+
+    def _local_input(self) -> int:
+        return self.session.local_input(
+            up=self.keyboard[W] or self.keyboard[UP],
+            down=self.keyboard[S] or self.keyboard[DOWN],
+        )
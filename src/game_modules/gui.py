@@ -1,6 +1,11 @@
 from typing import Literal
 
+from pyglet.graphics import Batch, Group
 from pyglet.shapes import Line, Rectangle
+from pyglet.text import Label
+
+from .assets import font_press_start_2p
+from .consts import COLOR_WHITE, WINDOW_HEIGHT, WINDOW_WIDTH
 
 
 class Checkbox:
@@ -17,10 +22,11 @@ class Checkbox:
             int, int, int, int
         ],  # Color rgbo = (RED, GREEN, BLUE, OPACITY)
         fill_type: Literal['x', 'v'],
+        batch: Batch = None,
+        group: Group = None,
     ) -> None:
         self.x = x
         self.y = y
-        self.checked = checked
         self.line_color = line_color
         self.border_color = border_color
         self.fill_type = fill_type
@@ -30,7 +36,11 @@ class Checkbox:
             width=size,
             height=size,
             color=self.border_color,
+            batch=batch,
+            group=group,
         )
+        # Check mark lines are drawn over the box
+        lines_group = Group(order=1, parent=group)
         if self.fill_type == 'x':
             self.line_1 = Line(
                 x=self.x,
@@ -39,6 +49,8 @@ class Checkbox:
                 y2=self.y + size,
                 width=2,
                 color=self.line_color,
+                batch=batch,
+                group=lines_group,
             )
             self.line_2 = Line(
                 x=self.x + size,
@@ -47,6 +59,8 @@ class Checkbox:
                 y2=self.y + size,
                 width=2,
                 color=self.line_color,
+                batch=batch,
+                group=lines_group,
             )
         elif self.fill_type == 'v':
             self.line_1 = Line(
@@ -56,6 +70,8 @@ class Checkbox:
                 y2=self.y,
                 width=4,
                 color=self.line_color,
+                batch=batch,
+                group=lines_group,
             )
             self.line_2 = Line(
                 x=self.x + size,
@@ -64,10 +80,68 @@ class Checkbox:
                 y2=self.y,
                 width=4,
                 color=self.line_color,
+                batch=batch,
+                group=lines_group,
             )
 
-    def draw(self) -> None:
-        self.box.draw()
-        if self.checked:
-            self.line_1.draw()
-            self.line_2.draw()
+        self.checked = checked
+
+    @property
+    def checked(self) -> bool:
+        return self._checked
+
+    @checked.setter
+    def checked(self, value: bool) -> None:
+        self._checked = value
+        self.line_1.visible = value
+        self.line_2.visible = value
+
+
+class ScoreBoard:
+    """
+    Points of both sides around the match time, at the top of the screen.
+    Setting a label text lays out all its glyphs again, so update() only
+    touches the labels whose value changed: once per point, and once per
+    second for the time.
+    """
+
+    def __init__(self, batch: Batch = None, group: Group = None) -> None:
+        self.score_labels = [
+            Label(
+                '0',
+                font_name=font_press_start_2p,
+                font_size=30,
+                x=WINDOW_WIDTH // 2 + offset,
+                y=WINDOW_HEIGHT - 40,
+                anchor_x='center',
+                anchor_y='center',
+                color=COLOR_WHITE,
+                batch=batch,
+                group=group,
+            )
+            for offset in (-120, 120)
+        ]
+        self.time_label = Label(
+            '00:00',
+            font_name=font_press_start_2p,
+            font_size=18,
+            x=WINDOW_WIDTH // 2,
+            y=WINDOW_HEIGHT - 40,
+            anchor_x='center',
+            anchor_y='center',
+            color=COLOR_WHITE,
+            batch=batch,
+            group=group,
+        )
+        self._scores = [0, 0]
+        self._seconds = 0
+
+    def update(self, score_1: int, score_2: int, seconds: float) -> None:
+        for index, score in enumerate((score_1, score_2)):
+            if score != self._scores[index]:
+                self._scores[index] = score
+                self.score_labels[index].text = str(score)
+        seconds = int(seconds)
+        if seconds != self._seconds:
+            self._seconds = seconds
+            self.time_label.text = f'{seconds // 60:02}:{seconds % 60:02}'
@@ -0,0 +1,78 @@
+"""
+Input latency.
+
+LatencyTracker follows each key event to the first physics tick run after
+it, which read it, and to the flip of the frame drawn after that tick,
+which showed its result. It keeps the three intervals of the last events:
+
+    wait    from the key event to the tick that read it
+    render  from that tick to the flip that showed it
+    total   from the key event to the flip
+
+Times are taken when pyglet dispatches the event and when the flip
+returns: the OS queue before the event and the display scanout after the
+flip add their own delay, the same for every setting compared.
+"""
+from array import array
+
+from .consts import LATENCY_HISTORY
+
+STAGES = ('wait', 'render', 'total')
+
+
+class LatencyTracker:
+    def __init__(self, capacity: int = LATENCY_HISTORY) -> None:
+        self.capacity = capacity
+        self.samples = {
+            stage: array('d', bytes(8 * capacity)) for stage in STAGES
+        }
+        self.index = 0  # Next slot written in the ring buffers
+        self.count = 0  # Events stored, up to capacity
+        self._waiting: list[float] = []  # Times of events not read yet
+        self._shown: list[tuple[float, float]] = []  # (event, tick) times
+
+    def key_event(self, now: float) -> None:
+        self._waiting.append(now)
+
+    def reset(self) -> None:
+        """Forgets the events not shown yet, as when the state changes"""
+        self._waiting.clear()
+        self._shown.clear()
+
+    def tick(self, now: float) -> None:
+        """A physics tick starts, reading the events so far"""
+        if self._waiting:
+            self._shown.extend((event, now) for event in self._waiting)
+            self._waiting.clear()
+
+    def flip(self, now: float) -> None:
+        """A frame was flipped, showing the ticks run before it"""
+        for event, tick in self._shown:
+            index = self.index
+            self.samples['wait'][index] = tick - event
+            self.samples['render'][index] = now - tick
+            self.samples['total'][index] = now - event
+            self.index = (index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        self._shown.clear()
+
+    def percentiles(self, stage: str, *fractions: float) -> list[float]:
+        if not self.count:
+            return [0.0] * len(fractions)
+        samples = sorted(self.samples[stage][: self.count])
+        last = self.count - 1
+        return [
+            samples[min(int(self.count * fraction), last)]
+            for fraction in fractions
+        ]
+
+    def report(self) -> str:
+        lines = [f'Latency of the last {self.count} key events, in ms:']
+        lines.append(f'{"":<8} {"p50":>7} {"p95":>7} {"p99":>7} {"max":>7}')
+        for stage in STAGES:
+            values = self.percentiles(stage, 0.5, 0.95, 0.99, 1.0)
+            lines.append(
+                f'{stage:<8} '
+                + ' '.join(f'{value * 1000:7.1f}' for value in values)
+            )
+        return '\n'.join(lines)
@@ -0,0 +1,329 @@
+"""
+Matches with many balls.
+
+MultiBallSimulation runs on the batch engine with one row per ball: each
+row holds its own copy of the two paddles and every row is steered by the
+same inputs, so the copies never drift apart. Walls and paddles are swept
+exactly as in the one ball game, except that there are no points: balls
+bounce off the walls behind the paddles too. On top of that balls bounce
+off each other.
+
+Candidate ball pairs come from a uniform grid with cells as wide as a ball,
+so two balls can only touch when their cells are neighbours. The balls are
+kept sorted by cell: each tick re-sorts the order of the previous tick,
+which is almost sorted already since few balls change cell, so the cost
+grows linearly with the number of balls instead of quadratically.
+
+Run `python -m game_modules.multiball` from the src directory to time a
+tick against the number of balls.
+"""
+from argparse import ArgumentParser
+from math import ceil, pi, sqrt
+from sys import exit
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+
+from .ai import AIController
+from .batch import BatchSimulation
+from .consts import (
+    AI_DEFAULT_DIFFICULTY,
+    BALL_RADIUS,
+    BALL_SPEED,
+    MULTIBALL_FILL,
+    TICK_RATE,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
+from .simulation import (
+    EVENT_BALL_HIT,
+    INPUT_P1_DOWN,
+    INPUT_P1_UP,
+    INPUT_P2_DOWN,
+    INPUT_P2_UP,
+    SimulationState,
+)
+
+# Cells of the forward half of a 3x3 neighbourhood: visiting these from
+# every cell covers each neighbouring pair of cells once
+_NEIGHBOUR_CELLS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+def fit_radius(count: int) -> float:
+    """Ball radius for count balls to cover MULTIBALL_FILL of the field"""
+    area = WINDOW_WIDTH * WINDOW_HEIGHT * MULTIBALL_FILL / count
+    return min(float(BALL_RADIUS), sqrt(area / pi))
+
+
+class MultiBallSimulation(BatchSimulation):
+    """One match with count balls, see the module docstring"""
+
+    def __init__(
+        self,
+        count: int,
+        seed: Optional[int] = None,
+        ball_speed: float = BALL_SPEED,
+        ball_radius: Optional[float] = None,
+    ) -> None:
+        """ball_radius defaults to what fits count balls, see fit_radius"""
+        if ball_radius is None:
+            ball_radius = fit_radius(count)
+        super().__init__(
+            count,
+            seed=seed,
+            ball_speed=ball_speed,
+            ball_radius=ball_radius,
+            record_events=True,
+            goals=False,
+        )
+        # Balls start scattered between the paddles, in every direction
+        margin = 60 + ball_radius
+        self.ball_x[:] = self.rng.uniform(margin, WINDOW_WIDTH - margin, count)
+        self.ball_y[:] = self.rng.uniform(
+            ball_radius, WINDOW_HEIGHT - ball_radius, count
+        )
+        self.ball_vy[:] = self.rng.uniform(-ball_speed, ball_speed, count)
+        self.ball_hits = 0  # Ball against ball bounces since the start
+
+        self.cell_size = 2 * ball_radius
+        self.columns = ceil(WINDOW_WIDTH / self.cell_size)
+        self.rows = ceil(WINDOW_HEIGHT / self.cell_size)
+        self.order = np.arange(count)  # Balls sorted by cell
+        self._inputs = np.zeros(count, dtype=np.uint8)
+
+    def step(self, inputs: int, dt: float) -> None:
+        """Advances the match by dt with the inputs bitmask"""
+        self._inputs.fill(inputs)
+        super().step(self._inputs, dt)
+        self.collide_balls()
+
+    def collide_balls(self) -> int:
+        """Bounces touching balls, returns how many pairs were tested"""
+        first, second = self.candidate_pairs()
+        self._collide_balls(first, second)
+        return len(first)
+
+    def candidate_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """Indices of the ball pairs in neighbouring cells, each pair once"""
+        cell_x = np.clip(
+            (self.ball_x // self.cell_size).astype(np.int64),
+            0,
+            self.columns - 1,
+        )
+        cell_y = np.clip(
+            (self.ball_y // self.cell_size).astype(np.int64), 0, self.rows - 1
+        )
+        cells = cell_y * self.columns + cell_x
+        # Re-sorting last tick's order: nearly sorted input sorts in
+        # linear time with a stable sort
+        order = self.order[np.argsort(cells[self.order], kind='stable')]
+        self.order = order
+        counts = np.bincount(cells, minlength=self.columns * self.rows)
+        cell_end = np.cumsum(counts)
+        cell_start = cell_end - counts
+
+        position = np.arange(self.count)
+        sorted_x = cell_x[order]
+        sorted_y = cell_y[order]
+        sorted_cells = cells[order]
+        first = []
+        second = []
+        for offset_x, offset_y in _NEIGHBOUR_CELLS:
+            if (offset_x, offset_y) == (0, 0):
+                # Same cell: only the balls sorted after this one
+                start = position + 1
+                end = cell_end[sorted_cells]
+            else:
+                neighbour_x = sorted_x + offset_x
+                neighbour_y = sorted_y + offset_y
+                inside = (
+                    (neighbour_x >= 0)
+                    & (neighbour_x < self.columns)
+                    & (neighbour_y < self.rows)
+                )
+                neighbour = np.where(
+                    inside, neighbour_y * self.columns + neighbour_x, 0
+                )
+                start = cell_start[neighbour]
+                end = np.where(inside, cell_end[neighbour], start)
+            pairs = np.maximum(end - start, 0)
+            total = int(pairs.sum())
+            if not total:
+                continue
+            # Expand every (ball, run of balls) into single pairs
+            run_offset = np.arange(total) - np.repeat(
+                np.cumsum(pairs) - pairs, pairs
+            )
+            first.append(order[np.repeat(position, pairs)])
+            second.append(order[np.repeat(start, pairs) + run_offset])
+        if not first:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(first), np.concatenate(second)
+
+    def _collide_balls(self, first: np.ndarray, second: np.ndarray) -> None:
+        x, y = self.ball_x, self.ball_y
+        dx = x[second] - x[first]
+        dy = y[second] - y[first]
+        reach = self.ball_radius[first] + self.ball_radius[second]
+        distance_2 = dx * dx + dy * dy
+        touching = (distance_2 < reach * reach) & (distance_2 > 0)
+        if not touching.any():
+            return
+        first = first[touching]
+        second = second[touching]
+
+        # Pairs are resolved in rounds where no ball appears twice, each
+        # round seeing the velocities left by the previous one, as if the
+        # contacts were resolved one by one
+        bounced_x = []
+        bounced_y = []
+        while len(first):
+            pair = np.arange(len(first))
+            owner = np.full(self.count, len(first))
+            np.minimum.at(owner, first, pair)
+            np.minimum.at(owner, second, pair)
+            now = (owner[first] == pair) & (owner[second] == pair)
+            contact_x, contact_y = self._bounce(first[now], second[now])
+            bounced_x.append(contact_x)
+            bounced_y.append(contact_y)
+            first = first[~now]
+            second = second[~now]
+
+        radius = self.ball_radius
+        np.clip(x, radius, WINDOW_WIDTH - radius, out=x)
+        np.clip(y, radius, WINDOW_HEIGHT - radius, out=y)
+        contact_x = np.concatenate(bounced_x)
+        if len(contact_x):
+            self.ball_hits += len(contact_x)
+            self.events.append(
+                (
+                    np.full(len(contact_x), EVENT_BALL_HIT),
+                    contact_x,
+                    np.concatenate(bounced_y),
+                )
+            )
+
+    def _bounce(self, first: np.ndarray, second: np.ndarray):
+        """
+        Bounces pairs of touching balls, no ball in two pairs. Returns the
+        contact points of the pairs that were closing in.
+        """
+        x, y = self.ball_x, self.ball_y
+        vx, vy = self.ball_vx, self.ball_vy
+        dx = x[second] - x[first]
+        dy = y[second] - y[first]
+        distance = np.sqrt(dx * dx + dy * dy)
+        nx = dx / distance
+        ny = dy / distance
+
+        # Equal masses: the balls swap their speeds along the normal
+        closing = (vx[second] - vx[first]) * nx + (vy[second] - vy[first]) * ny
+        closing = np.minimum(closing, 0.0)
+        vx[first] += closing * nx
+        vx[second] -= closing * nx
+        vy[first] += closing * ny
+        vy[second] -= closing * ny
+
+        # Then each moves half the overlap away from the other
+        push = (
+            self.ball_radius[first] + self.ball_radius[second] - distance
+        ) / 2
+        x[first] -= push * nx
+        x[second] += push * nx
+        y[first] -= push * ny
+        y[second] += push * ny
+
+        bounced = closing < 0
+        return (
+            (x[first][bounced] + x[second][bounced]) / 2,
+            (y[first][bounced] + y[second][bounced]) / 2,
+        )
+
+
+class MultiBallAIController(AIController):
+    """AIController following the ball that reaches its paddle first"""
+
+    def __init__(
+        self,
+        side: int,
+        difficulty: str = AI_DEFAULT_DIFFICULTY,
+        seed: Optional[int] = None,
+    ) -> None:
+        super().__init__(side=side, difficulty=difficulty, seed=seed)
+        # One ball state the base controller reads, copied from the focus
+        self._focus = SimulationState(seed=0)
+        self._focus_index = None
+
+    def read(self, state: MultiBallSimulation, dt: float) -> int:
+        column = self.side - 1
+        facing = 1 if self.side == 1 else -1
+        face_x = state.paddle_x[0, column] + facing * (
+            state.paddle_width[0] / 2 + state.ball_radius
+        )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arrival = (face_x - state.ball_x) / state.ball_vx
+        index = int(np.argmin(np.where(arrival >= 0, arrival, np.inf)))
+        if index != self._focus_index:
+            self._focus_index = index
+            self._velocity = None  # Re-plan for the new ball
+
+        focus = self._focus
+        ball = focus.ball
+        ball.x = float(state.ball_x[index])
+        ball.y = float(state.ball_y[index])
+        ball.vx = float(state.ball_vx[index])
+        ball.vy = float(state.ball_vy[index])
+        ball.radius = float(state.ball_radius[index])
+        for paddle, paddle_column in (
+            (focus.paddle_1, 0),
+            (focus.paddle_2, 1),
+        ):
+            paddle.x = float(state.paddle_x[0, paddle_column])
+            paddle.y = float(state.paddle_y[0, paddle_column])
+        focus.tick = state.tick
+        return super().read(focus, dt)
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.multiball')
+    parser.add_argument(
+        '--balls', type=int, nargs='+', default=[100, 1000, 10_000]
+    )
+    parser.add_argument('--ticks', type=int, default=TICK_RATE * 5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    dt = 1 / TICK_RATE
+    print('balls  tick (ms)  per ball (us)  collisions (ms)  pairs tested')
+    for count in args.balls:
+        simulation = MultiBallSimulation(count, seed=args.seed)
+        collide_time = 0.0
+        pairs = 0
+        start = perf_counter()
+        for tick in range(args.ticks):
+            # Both paddles sweeping up and down
+            if tick % (TICK_RATE * 2) < TICK_RATE:
+                inputs = INPUT_P1_UP | INPUT_P2_UP
+            else:
+                inputs = INPUT_P1_DOWN | INPUT_P2_DOWN
+            simulation.step(inputs, dt)
+        elapsed = perf_counter() - start
+
+        # Ball against ball alone, on the final positions
+        for _ in range(args.ticks):
+            collide_start = perf_counter()
+            pairs += simulation.collide_balls()
+            collide_time += perf_counter() - collide_start
+        print(
+            f'{count:5}  {elapsed / args.ticks * 1000:9.3f}  '
+            f'{elapsed / args.ticks / count * 1e6:13.3f}  '
+            f'{collide_time / args.ticks * 1000:15.3f}  '
+            f'{pairs // args.ticks:12}'
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,443 @@
+"""
+Two player matches over UDP with rollback.
+
+Each side steps the simulation right away with its local input and a
+prediction of the remote one (the last remote input it knows). When the
+real remote input of a past tick arrives and differs from the prediction,
+the session restores the snapshot of that tick and re-simulates up to the
+present, so play stays responsive whatever the round trip time.
+
+Both sides should run the same tick at the same time, each then predicting
+only the one way latency. The host answers the guest's hello with the time
+left until it starts, and the guest, which timed the round trip of its
+hello, starts half a round trip sooner than that. Input packets then carry
+the sender's tick and how far ahead of its peer it sees itself, latency
+included: half the difference between both sides' views is how far ahead
+one really is, and a side that drifts ahead stalls ticks until it is not.
+
+Run `python -m game_modules.netplay` from the src directory to play two
+scripted sessions against each other on localhost through a simulated link
+with latency, jitter and loss, and check that they end in sync.
+"""
+import socket
+from argparse import ArgumentParser
+from array import array
+from heapq import heappop, heappush
+from random import Random, getrandbits
+from struct import calcsize, pack, unpack_from
+from sys import exit
+from typing import Optional
+
+from .consts import (
+    NETPLAY_MAX_ROLLBACK,
+    NETPLAY_RESEND_WINDOW,
+    NETPLAY_START_DELAY,
+    NETPLAY_SYNC_INTERVAL,
+    NETPLAY_SYNC_SMOOTHING,
+    TICK_RATE,
+)
+from .simulation import SIDE_INPUTS, SimulationState, checksum, step
+
+# Packets: HELLO carries the match seed, the time the guest sent the hello
+# it answers and the seconds until the host starts. INPUT carries a run of
+# inputs starting at a tick, how many remote ticks the sender confirmed, its
+# current tick and how many ticks ahead of the remote ones it knows it is.
+_PACKET_HELLO = 1
+_PACKET_INPUT = 2
+_HELLO = '<BIdd'
+_INPUT = '<BIIIhB'
+
+
+class UdpTransport:
+    """Non blocking UDP socket talking to a single peer"""
+
+    def __init__(
+        self,
+        local_address: tuple[str, int] = ('0.0.0.0', 0),
+        remote_address: Optional[tuple[str, int]] = None,
+    ) -> None:
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.socket.bind(local_address)
+        # A host learns its peer from the first packet it receives
+        self.remote_address = remote_address
+
+    @property
+    def local_address(self) -> tuple[str, int]:
+        return self.socket.getsockname()
+
+    def send(self, data: bytes, now: float = 0.0) -> None:
+        if self.remote_address is not None:
+            self.socket.sendto(data, self.remote_address)
+
+    def receive(self, now: float = 0.0) -> list[bytes]:
+        packets = []
+        while True:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except (BlockingIOError, ConnectionResetError):
+                return packets
+            if self.remote_address is None:
+                self.remote_address = address
+            if address == self.remote_address:
+                packets.append(data)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+class SimulatedLink:
+    """
+    Wraps a transport and delays, jitters and drops the packets it sends,
+    to test rollback on localhost as if over a real network
+    """
+
+    def __init__(
+        self,
+        transport: UdpTransport,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self._rng = Random(seed)
+        self._in_flight = []  # Heap of (delivery time, order, data)
+        self._sent = 0
+
+    def send(self, data: bytes, now: float = 0.0) -> None:
+        if self._rng.random() < self.loss:
+            return
+        delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        self._sent += 1
+        heappush(self._in_flight, (now + max(delay, 0.0), self._sent, data))
+
+    def receive(self, now: float = 0.0) -> list[bytes]:
+        while self._in_flight and self._in_flight[0][0] <= now:
+            self.transport.send(heappop(self._in_flight)[2])
+        return self.transport.receive()
+
+
+class RollbackSession:
+    def __init__(
+        self,
+        side: int,
+        transport,
+        state: SimulationState,
+        dt: float = 1 / TICK_RATE,
+        seed: Optional[int] = None,
+        max_rollback: int = NETPLAY_MAX_ROLLBACK,
+    ) -> None:
+        """
+        The host (side 1) picks the seed and sends it in answer to the
+        hellos of the other side. The session steps state in place, so
+        views bound to it keep working.
+        """
+        self.side = side
+        self.transport = transport
+        self.state = state
+        self.dt = dt
+        self.max_rollback = max_rollback
+        self.seed = seed
+        if side == 1 and seed is None:
+            self.seed = getrandbits(32)
+        self.connected = False
+        self.start_time = None  # When both sides start, once agreed
+        self.rollbacks = 0  # Rollbacks done, and ticks re-simulated by them
+        self.resimulated_ticks = 0
+        self.sync_stalls = 0  # Ticks skipped to let the peer catch up
+        # Ticks ahead of the newest remote tick received, as seen here and
+        # as the peer last reported it; both include the latency
+        self.local_advantage = 0
+        self.remote_advantage = 0
+        # Half their difference, averaged over the last packets as jitter
+        # moves it by a few ticks either way
+        self.frame_advantage = 0.0
+        self._last_sync_stall = 0
+
+        self.local_inputs = array('B')
+        # Confirmed remote inputs, then predictions up to the current tick
+        self.remote_inputs = array('B')
+        self.remote_confirmed = 0  # Remote ticks known for sure
+        self.peer_confirmed = 0  # Local ticks the peer acknowledged
+        # snapshots[t % len] is the state at the start of tick t
+        self.snapshots = [
+            SimulationState(seed=0) for _ in range(max_rollback + 1)
+        ]
+        self._remote_bits = 0
+        for up, down in (
+            SIDE_INPUTS[other] for other in SIDE_INPUTS if other != side
+        ):
+            self._remote_bits |= up | down
+
+    @property
+    def tick(self) -> int:
+        return self.state.tick
+
+    def local_input(self, up: bool, down: bool) -> int:
+        """Input bits of this side's paddle"""
+        input_up, input_down = SIDE_INPUTS[self.side]
+        return (input_up if up else 0) | (input_down if down else 0)
+
+    def poll(self, now: float = 0.0) -> None:
+        """
+        Handles received packets, rolling back on mispredictions. now is a
+        time in seconds, of any origin but the same on every call.
+        """
+        earliest_mismatch = None
+        for data in self.transport.receive(now):
+            kind = data[0]
+            if kind == _PACKET_HELLO:
+                self._receive_hello(data, now)
+            elif kind == _PACKET_INPUT and self.connected:
+                mismatch = self._receive_inputs(data)
+                if mismatch is not None and (
+                    earliest_mismatch is None or mismatch < earliest_mismatch
+                ):
+                    earliest_mismatch = mismatch
+
+        if earliest_mismatch is not None:
+            self._rollback(earliest_mismatch)
+        if (
+            not self.connected
+            and self.start_time is not None
+            and now >= self.start_time
+        ):
+            self._start()
+        if self.connected:
+            self._send_inputs(now)
+        elif self.side != 1:
+            self.transport.send(pack(_HELLO, _PACKET_HELLO, 0, now, 0.0), now)
+
+    def can_advance(self) -> bool:
+        """False when running further ahead would exceed max_rollback"""
+        return (
+            self.connected
+            and self.tick - self.remote_confirmed < self.max_rollback
+        )
+
+    def advance(self, local_input: int, now: float = 0.0) -> bool:
+        """
+        Polls, then steps one tick with local_input and the predicted remote
+        input. Returns False, without stepping, while waiting for the peer
+        or letting it catch up.
+        """
+        self.poll(now)
+        if not self.can_advance():
+            return False
+        # One tick at a time, apart enough for the peer's reports to show
+        # the effect of the previous one
+        if (
+            self.frame_advantage >= 1
+            and self.tick - self._last_sync_stall >= NETPLAY_SYNC_INTERVAL
+        ):
+            self._last_sync_stall = self.tick
+            self.sync_stalls += 1
+            return False
+        tick = self.tick
+        self.local_inputs.append(local_input)
+        if len(self.remote_inputs) <= tick:
+            self.remote_inputs.append(self._predict_remote())
+        self.snapshots[tick % len(self.snapshots)].copy_from(
+            self.state, with_rng=True
+        )
+        step(self.state, local_input | self.remote_inputs[tick], self.dt)
+        self._send_inputs(now)
+        return True
+
+    def _predict_remote(self) -> int:
+        if self.remote_confirmed == 0:
+            return 0
+        return self.remote_inputs[self.remote_confirmed - 1]
+
+    def _receive_hello(self, data: bytes, now: float) -> None:
+        _, seed, sent, delay = unpack_from(_HELLO, data)
+        if self.side == 1:
+            if self.start_time is None:
+                self.start_time = now + NETPLAY_START_DELAY
+            # Answer every hello, the guest repeats it until it gets one
+            self.transport.send(
+                pack(
+                    _HELLO,
+                    _PACKET_HELLO,
+                    self.seed,
+                    sent,
+                    self.start_time - now,
+                ),
+                now,
+            )
+        elif self.start_time is None:
+            self.seed = seed
+            # The answer left the host half a round trip ago. Late, the
+            # guest starts right away and stalls of the host even it out.
+            self.start_time = now + delay - (now - sent) / 2
+
+    def _start(self) -> None:
+        self.state.copy_from(SimulationState(seed=self.seed), with_rng=True)
+        self.connected = True
+
+    def _receive_inputs(self, data: bytes) -> Optional[int]:
+        """Stores the remote inputs, returns the first mispredicted tick"""
+        (
+            _,
+            first_tick,
+            peer_confirmed,
+            remote_tick,
+            remote_advantage,
+            count,
+        ) = unpack_from(_INPUT, data)
+        self.peer_confirmed = max(self.peer_confirmed, peer_confirmed)
+        self.local_advantage = self.tick - remote_tick
+        self.remote_advantage = remote_advantage
+        self.frame_advantage += (
+            (self.local_advantage - remote_advantage) / 2
+            - self.frame_advantage
+        ) * NETPLAY_SYNC_SMOOTHING
+        offset = calcsize(_INPUT)
+        mismatch = None
+        for tick in range(
+            max(first_tick, self.remote_confirmed), first_tick + count
+        ):
+            if tick != self.remote_confirmed:
+                # A gap, the missing ticks will be resent
+                break
+            remote_input = data[offset + tick - first_tick] & self._remote_bits
+            if tick < len(self.remote_inputs):
+                if self.remote_inputs[tick] != remote_input:
+                    self.remote_inputs[tick] = remote_input
+                    if mismatch is None:
+                        mismatch = tick
+            else:
+                self.remote_inputs.append(remote_input)
+            self.remote_confirmed += 1
+
+        # Predictions after the confirmed ticks follow the newest input
+        if self.remote_confirmed < len(self.remote_inputs):
+            prediction = self._predict_remote()
+            for tick in range(self.remote_confirmed, len(self.remote_inputs)):
+                if self.remote_inputs[tick] != prediction:
+                    self.remote_inputs[tick] = prediction
+                    if mismatch is None or tick < mismatch:
+                        mismatch = tick
+        if mismatch is not None and mismatch >= self.tick:
+            return None
+        return mismatch
+
+    def _rollback(self, tick: int) -> None:
+        current = self.tick
+        self.state.copy_from(
+            self.snapshots[tick % len(self.snapshots)], with_rng=True
+        )
+        self.rollbacks += 1
+        self.resimulated_ticks += current - tick
+        while self.state.tick < current:
+            index = self.state.tick
+            self.snapshots[index % len(self.snapshots)].copy_from(
+                self.state, with_rng=True
+            )
+            step(
+                self.state,
+                self.local_inputs[index] | self.remote_inputs[index],
+                self.dt,
+            )
+
+    def _send_inputs(self, now: float) -> None:
+        # Everything the peer has not acknowledged yet, so lost packets are
+        # covered by the next ones
+        first_tick = max(
+            self.peer_confirmed, len(self.local_inputs) - NETPLAY_RESEND_WINDOW
+        )
+        inputs = self.local_inputs[first_tick:].tobytes()
+        self.transport.send(
+            pack(
+                _INPUT,
+                _PACKET_INPUT,
+                first_tick,
+                self.remote_confirmed,
+                self.tick,
+                self.local_advantage,
+                len(inputs),
+            )
+            + inputs,
+            now,
+        )
+
+
+def _scripted_input(rng: Random, session: RollbackSession) -> int:
+    return session.local_input(up=rng.random() < 0.4, down=rng.random() < 0.4)
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.netplay')
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--latency', type=float, default=0.06)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--loss', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Each side sends through its own simulated link, on virtual time
+    host_socket = UdpTransport(local_address=('127.0.0.1', 0))
+    guest_socket = UdpTransport(
+        local_address=('127.0.0.1', 0),
+        remote_address=host_socket.local_address,
+    )
+    sessions = []
+    for side, transport in ((1, host_socket), (2, guest_socket)):
+        link = SimulatedLink(
+            transport,
+            latency=args.latency / 2,
+            jitter=args.jitter,
+            loss=args.loss,
+            seed=args.seed + side,
+        )
+        sessions.append(
+            RollbackSession(
+                side=side, transport=link, state=SimulationState(seed=0)
+            )
+        )
+    rng = Random(args.seed)
+    dt = sessions[0].dt
+    now = 0.0
+    stalls = 0
+
+    # Play, then keep exchanging packets until both sides confirmed it all
+    while any(session.tick < args.ticks for session in sessions):
+        for session in sessions:
+            if session.tick < args.ticks:
+                if not session.advance(_scripted_input(rng, session), now):
+                    stalls += 1
+            else:
+                session.poll(now)
+        now += dt
+    deadline = now + 10
+    while (
+        any(session.remote_confirmed < args.ticks for session in sessions)
+        and now < deadline
+    ):
+        for session in sessions:
+            session.poll(now)
+        now += dt
+
+    host, guest = sessions
+    in_sync = checksum(host.state) == checksum(guest.state)
+    for session in sessions:
+        print(
+            f'side {session.side}: {session.rollbacks} rollbacks, '
+            f'{session.resimulated_ticks} ticks re-simulated, '
+            f'{session.sync_stalls} ticks stalled to stay in step'
+        )
+    print(
+        f'{args.ticks} ticks, {stalls} stalled ticks, '
+        f'{"in sync" if in_sync else "DESYNC"}'
+    )
+    host_socket.close()
+    guest_socket.close()
+    return 0 if in_sync else 1
+
+
+if __name__ == '__main__':
+    exit(main())
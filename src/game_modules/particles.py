@@ -0,0 +1,164 @@
+"""
+Sparks and trails.
+
+Particles live in preallocated NumPy arrays of a fixed capacity: spawning
+reuses dead slots, or the particles closest to dying when none are left,
+and every update and upload works on the whole arrays at once. All
+particles are quads of a single vertex list, rewritten in bulk once per
+frame, so the cost of the effects stays the same however many are alive.
+"""
+import numpy as np
+from pyglet.gl import (
+    GL_BLEND,
+    GL_ONE,
+    GL_SRC_ALPHA,
+    GL_TRIANGLES,
+    glBlendFunc,
+    glDisable,
+    glEnable,
+)
+from pyglet.graphics import Batch, Group, ShaderGroup
+from pyglet.shapes import get_default_shader
+
+from .consts import PARTICLE_CAPACITY, PARTICLE_DRAG
+
+# Two triangles per particle, around its centre
+_QUAD = ((-1, -1), (1, -1), (1, 1), (-1, -1), (1, 1), (-1, 1))
+
+
+class _AdditiveGroup(ShaderGroup):
+    """Adds the particle colors to what is behind, so overlaps glow"""
+
+    def set_state(self) -> None:
+        super().set_state()
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE)
+
+    def unset_state(self) -> None:
+        glDisable(GL_BLEND)
+        super().unset_state()
+
+
+class ParticleSystem:
+    def __init__(
+        self,
+        capacity: int = PARTICLE_CAPACITY,
+        size: float = 3.0,
+        drag: float = PARTICLE_DRAG,
+        batch: Batch = None,
+        group: Group = None,
+        seed: int = None,
+    ) -> None:
+        self.capacity = capacity
+        self.drag = drag
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.life = np.zeros(capacity)  # Seconds left, dead at 0 or less
+        self.lifetime = np.ones(capacity)  # Seconds at spawn, to fade out
+        self.color = np.zeros((capacity, 4), dtype=np.uint8)
+        self._rng = np.random.default_rng(seed)  # Spark directions
+
+        program = get_default_shader()
+        vertices = capacity * len(_QUAD)
+        corners = [value * size / 2 for corner in _QUAD for value in corner]
+        self.vertex_list = program.vertex_list(
+            vertices,
+            GL_TRIANGLES,
+            batch=batch,
+            group=_AdditiveGroup(program=program, parent=group),
+            position=('f', corners * capacity),
+            colors=('Bn', (0, 0, 0, 0) * vertices),
+            translation=('f', (0.0, 0.0) * vertices),
+            rotation=('f', (0.0,) * vertices),
+        )
+
+    @property
+    def active(self) -> int:
+        return int(np.count_nonzero(self.life > 0))
+
+    def emit(self, x, y, vx, vy, lifetime, color: tuple) -> None:
+        """
+        Spawns one particle per value of the x, y, vx, vy and lifetime
+        arrays (or numbers), all of the same color. The arrays must have
+        the same length, one particle is spawned when all are numbers.
+        """
+        values = [
+            np.asarray(value, dtype=float)
+            for value in (x, y, vx, vy, lifetime)
+        ]
+        sizes = {value.size for value in values if value.ndim}
+        if len(sizes) > 1:
+            raise ValueError(
+                f'Particle arrays of different lengths {sorted(sizes)}'
+            )
+        count = min(sizes.pop() if sizes else 1, self.capacity)
+        if not count:
+            return
+        # Numbers are spread over all the slots, arrays cut to fit
+        x, y, vx, vy, lifetime = (
+            value[:count] if value.ndim else value for value in values
+        )
+        slots = self._free_slots(count)
+        self.x[slots] = x
+        self.y[slots] = y
+        self.vx[slots] = vx
+        self.vy[slots] = vy
+        self.life[slots] = lifetime
+        self.lifetime[slots] = lifetime
+        self.color[slots] = color
+
+    def burst(
+        self, x, y, count: int, speed: float, lifetime: float, color: tuple
+    ) -> None:
+        """Sprays count particles in every direction from each point"""
+        x = np.repeat(np.atleast_1d(x), count)
+        y = np.repeat(np.atleast_1d(y), count)
+        angle = self._rng.uniform(0, 2 * np.pi, len(x))
+        speed = speed * self._rng.uniform(0.3, 1.0, len(x))
+        self.emit(
+            x,
+            y,
+            np.cos(angle) * speed,
+            np.sin(angle) * speed,
+            lifetime * self._rng.uniform(0.5, 1.0, len(x)),
+            color,
+        )
+
+    def update(self, dt: float) -> None:
+        self.x += self.vx * dt
+        self.y += self.vy * dt
+        slowdown = max(1 - self.drag * dt, 0.0)
+        self.vx *= slowdown
+        self.vy *= slowdown
+        self.life -= dt
+
+    def sync(self) -> None:
+        """Copies positions and faded colors to the vertex list"""
+        corners = len(_QUAD)
+        # Reading the attributes marks them for upload, writes go straight
+        # to the mapped buffers
+        translation = np.ctypeslib.as_array(
+            self.vertex_list.translation
+        ).reshape(self.capacity, corners, 2)
+        translation[:, :, 0] = self.x[:, None]
+        translation[:, :, 1] = self.y[:, None]
+        colors = np.ctypeslib.as_array(self.vertex_list.colors).reshape(
+            self.capacity, corners, 4
+        )
+        fade = np.clip(self.life / self.lifetime, 0.0, 1.0)
+        colors[:, :, :3] = self.color[:, None, :3]
+        colors[:, :, 3] = (self.color[:, 3] * fade)[:, None]
+
+    def _free_slots(self, count: int):
+        if count == 1:
+            # The lowest life is a dead particle if there is any. A slice
+            # takes both a number and an array of one value.
+            slot = int(np.argmin(self.life))
+            return slice(slot, slot + 1)
+        dead = np.flatnonzero(self.life <= 0)
+        if len(dead) >= count:
+            return dead[:count]
+        # Not enough dead particles, recycle those closest to dying
+        return np.argpartition(self.life, count - 1)[:count]
@@ -0,0 +1,128 @@
+"""
+Logical resolution.
+
+Everything is laid out in a fixed WINDOW_WIDTH x WINDOW_HEIGHT space.
+Presenter draws it into a texture of that size times render_scale, then
+presents the texture scaled up to the real window, or fullscreen, keeping
+its aspect ratio with black bars around it:
+
+    filter           nearest keeps the pixels of the texture sharp, as the
+                     Press Start 2P glyphs are meant to look; linear smooths
+                     them, better for scales that are not whole numbers
+    integer_scaling  scales by the largest whole factor that fits, so every
+                     texture pixel covers the same number of screen pixels
+    render_scale     below 1, fewer pixels are drawn than the logical size
+                     has, and upscaling makes up for it: on a large display
+                     with a weak GPU, fill rate rather than the scene's few
+                     draw calls bounds the frame time
+
+When nothing would be scaled, the window at the logical size in pixels and
+render_scale 1, the scene is drawn straight into the window instead, with
+no texture and no extra pass.
+"""
+from pyglet.gl import GL_LINEAR, GL_NEAREST, GL_ONE, GL_ZERO, glViewport
+from pyglet.image import Texture
+from pyglet.image.buffer import Framebuffer
+from pyglet.math import Mat4
+from pyglet.sprite import Sprite
+
+from .consts import RENDER_FILTER, RENDER_SCALE, WINDOW_HEIGHT, WINDOW_WIDTH
+
+FILTERS = {'nearest': GL_NEAREST, 'linear': GL_LINEAR}
+
+
+class Presenter:
+    def __init__(
+        self,
+        render_scale: float = RENDER_SCALE,
+        filter: str = RENDER_FILTER,
+        integer_scaling: bool = False,
+    ) -> None:
+        if filter not in FILTERS:
+            raise ValueError(f'Unknown filter {filter!r}')
+        if render_scale <= 0:
+            raise ValueError(f'Render scale {render_scale} is not positive')
+        self.render_scale = render_scale
+        self.filter = filter
+        self.integer_scaling = integer_scaling
+        # Size of the texture the scene is drawn into
+        self.width = max(round(WINDOW_WIDTH * render_scale), 1)
+        self.height = max(round(WINDOW_HEIGHT * render_scale), 1)
+        self.projection = Mat4.orthogonal_projection(
+            0, WINDOW_WIDTH, 0, WINDOW_HEIGHT, -255, 255
+        )
+        self.offscreen = False  # Whether this frame goes to the texture
+        self._framebuffer = None
+        self._sprite = None
+        self._layout_size = None  # Window size the sprite was placed for
+
+    def begin(self, window) -> None:
+        """Directs the drawing that follows to the logical resolution"""
+        size = window.get_framebuffer_size()
+        self.offscreen = size != (self.width, self.height) or (
+            self.render_scale != 1
+        )
+        if self.offscreen:
+            if self._framebuffer is None:
+                self._create_target()
+            self._framebuffer.bind()
+        glViewport(0, 0, self.width, self.height)
+        window.projection = self.projection
+
+    def end(self, window) -> None:
+        """Presents the frame drawn since begin() to the window"""
+        if not self.offscreen:
+            return
+        self._framebuffer.unbind()
+        width, height = window.get_framebuffer_size()
+        if self._layout_size != (width, height):
+            self._place(width, height)
+        # Drawn in framebuffer pixels, which may be finer than the window's
+        glViewport(0, 0, width, height)
+        window.projection = Mat4.orthogonal_projection(
+            0, width, 0, height, -255, 255
+        )
+        window.clear()
+        self._sprite.draw()
+
+    def scaled_rect(self, width: int, height: int) -> tuple:
+        """(x, y, width, height) of the frame in a window of that size"""
+        scale = min(width / self.width, height / self.height)
+        if self.integer_scaling and scale >= 1:
+            scale = int(scale)
+        scaled_width = round(self.width * scale)
+        scaled_height = round(self.height * scale)
+        return (
+            (width - scaled_width) // 2,
+            (height - scaled_height) // 2,
+            scaled_width,
+            scaled_height,
+        )
+
+    def delete(self) -> None:
+        if self._framebuffer is not None:
+            self._sprite.delete()
+            self._framebuffer.delete()
+            self._framebuffer = self._sprite = None
+            self._layout_size = None
+
+    def _create_target(self) -> None:
+        gl_filter = FILTERS[self.filter]
+        texture = Texture.create(
+            self.width, self.height, min_filter=gl_filter, mag_filter=gl_filter
+        )
+        self._framebuffer = Framebuffer()
+        self._framebuffer.attach_texture(texture)
+        self._framebuffer.unbind()
+        # Copied as is: the texture already holds the blended frame
+        self._sprite = Sprite(texture, blend_src=GL_ONE, blend_dest=GL_ZERO)
+
+    def _place(self, width: int, height: int) -> None:
+        x, y, scaled_width, scaled_height = self.scaled_rect(width, height)
+        self._sprite.update(
+            x=x,
+            y=y,
+            scale_x=scaled_width / self.width,
+            scale_y=scaled_height / self.height,
+        )
+        self._layout_size = (width, height)
@@ -0,0 +1,246 @@
+from array import array
+from csv import writer as csv_writer
+from queue import SimpleQueue
+from threading import Thread
+
+from pyglet.gl import GL_LINES
+from pyglet.graphics import Batch, ShaderGroup
+from pyglet.shapes import get_default_shader
+from pyglet.text import Label
+
+from .consts import (
+    COLOR_GREEN,
+    COLOR_RED,
+    PROFILER_HISTORY,
+    PROFILER_HITCH_THRESHOLD,
+)
+
+PHASES = ('update', 'state.update', 'state.draw', 'flip')
+
+
+class FrameProfiler:
+    """
+    Times the phases of every frame and keeps the last `capacity` frames in
+    ring buffers. A frame's time runs from one buffer flip to the next, so
+    it also covers the time spent outside the timed phases.
+    """
+
+    def __init__(
+        self,
+        capacity: int = PROFILER_HISTORY,
+        hitch_threshold: float = PROFILER_HITCH_THRESHOLD,
+    ) -> None:
+        self.capacity = capacity
+        self.hitch_threshold = hitch_threshold
+        self.frame_times = array('d', bytes(8 * capacity))
+        self.phase_times = {
+            phase: array('d', bytes(8 * capacity)) for phase in PHASES
+        }
+        self.index = 0  # Next slot written in the ring buffers
+        self.count = 0  # Frames stored, up to capacity
+        self.frames = 0  # Frames seen since the start
+        self.hitches = 0
+        self.sample_writer = None
+        self._current = dict.fromkeys(PHASES, 0.0)
+        self._last_flip = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self._current[phase] += seconds
+
+    def end_frame(self, now: float) -> None:
+        """Closes the current frame, now being the time of its flip"""
+        if self._last_flip is None:
+            self._last_flip = now
+            self._reset_current()
+            return
+        frame_time = now - self._last_flip
+        self._last_flip = now
+
+        index = self.index
+        self.frame_times[index] = frame_time
+        for phase, seconds in self._current.items():
+            self.phase_times[phase][index] = seconds
+        self.index = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.frames += 1
+        if frame_time > self.hitch_threshold:
+            self.hitches += 1
+
+        if self.sample_writer is not None:
+            self.sample_writer.write(
+                (self.frames, frame_time, *self._current.values())
+            )
+        self._reset_current()
+
+    def ordered_frame_times(self) -> list[float]:
+        """Stored frame times, from oldest to newest"""
+        if self.count < self.capacity:
+            return self.frame_times[: self.count].tolist()
+        return (
+            self.frame_times[self.index :].tolist()
+            + self.frame_times[: self.index].tolist()
+        )
+
+    def percentiles(self, *fractions: float) -> list[float]:
+        if not self.count:
+            return [0.0] * len(fractions)
+        frame_times = sorted(self.frame_times[: self.count])
+        last = self.count - 1
+        return [
+            frame_times[min(int(self.count * fraction), last)]
+            for fraction in fractions
+        ]
+
+    def phase_mean(self, phase: str) -> float:
+        if not self.count:
+            return 0.0
+        return sum(self.phase_times[phase][: self.count]) / self.count
+
+    def _reset_current(self) -> None:
+        for phase in self._current:
+            self._current[phase] = 0.0
+
+
+class CsvSampleWriter:
+    """
+    Streams frame samples to a CSV file from a background thread, so the
+    game loop never waits on disk I/O
+    """
+
+    def __init__(self, path: str) -> None:
+        self._queue = SimpleQueue()
+        self._thread = Thread(
+            target=self._run,
+            args=(path,),
+            name='profiler-csv',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def write(self, row: tuple) -> None:
+        self._queue.put(row)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self, path: str) -> None:
+        with open(path, 'w', newline='') as file:
+            writer = csv_writer(file)
+            writer.writerow(('frame', 'frame_time', *PHASES))
+            while True:
+                row = self._queue.get()
+                if row is None:
+                    return
+                writer.writerow(row)
+                # Write whatever else is queued before flushing
+                while not self._queue.empty():
+                    row = self._queue.get()
+                    if row is None:
+                        return
+                    writer.writerow(row)
+                file.flush()
+
+
+class ProfilerOverlay:
+    """Frame time graph and phase statistics of a FrameProfiler"""
+
+    def __init__(
+        self,
+        profiler: FrameProfiler,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        refresh_frames: int = 10,
+    ) -> None:
+        self.profiler = profiler
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        # The graph tops out at twice the hitch threshold
+        self.graph_max = profiler.hitch_threshold * 2
+        self.refresh_frames = refresh_frames
+        self.systems = None
+        self._last_refresh = None
+
+        self.batch = Batch()
+        program = get_default_shader()
+        group = ShaderGroup(program=program)
+        # One line segment per pair of consecutive frames, all in a single
+        # vertex list that is rewritten in bulk
+        segments = profiler.capacity - 1
+        self.graph = program.vertex_list(
+            segments * 2,
+            GL_LINES,
+            batch=self.batch,
+            group=group,
+            position=('f', (0.0, 0.0) * segments * 2),
+            colors=('Bn', COLOR_GREEN * segments * 2),
+            translation=('f', (x, y) * segments * 2),
+        )
+        threshold_y = y + height / 2
+        self.threshold_line = program.vertex_list(
+            2,
+            GL_LINES,
+            batch=self.batch,
+            group=group,
+            position=('f', (0, 0, width, 0)),
+            colors=('Bn', COLOR_RED * 2),
+            translation=('f', (x, threshold_y) * 2),
+        )
+        self.label = Label(
+            '',
+            x=x,
+            y=y - 4,
+            width=width,
+            multiline=True,
+            anchor_y='top',
+            font_size=9,
+            color=(127, 127, 127, 255),
+            batch=self.batch,
+        )
+
+    def draw(self, systems: dict = None) -> None:
+        """systems maps names to seconds, like ecs.World.timings"""
+        self.systems = systems
+        if self._last_refresh != self.profiler.frames and (
+            self.profiler.frames % self.refresh_frames == 0
+        ):
+            self._last_refresh = self.profiler.frames
+            self._refresh()
+        self.batch.draw()
+
+    def _refresh(self) -> None:
+        frame_times = self.profiler.ordered_frame_times()
+        if len(frame_times) < 2:
+            return
+        segments = self.profiler.capacity - 1
+        step_x = self.width / segments
+        scale_y = self.height / self.graph_max
+        # Newest frames are on the right, missing history stays at 0
+        offset = segments + 1 - len(frame_times)
+        points = [0.0] * (segments + 1) * 2
+        for i, frame_time in enumerate(frame_times, start=offset):
+            points[i * 2] = i * step_x
+            points[i * 2 + 1] = min(frame_time * scale_y, self.height)
+        for i in range(offset):
+            points[i * 2] = i * step_x
+        vertices = [0.0] * segments * 4
+        for i in range(segments):
+            vertices[i * 4 : i * 4 + 4] = points[i * 2 : i * 2 + 4]
+        self.graph.position[:] = vertices
+
+        p95, p99 = self.profiler.percentiles(0.95, 0.99)
+        lines = [
+            f'p95 {p95 * 1000:.1f} ms  p99 {p99 * 1000:.1f} ms  '
+            f'hitches {self.profiler.hitches}'
+        ]
+        for phase in PHASES:
+            mean = self.profiler.phase_mean(phase)
+            lines.append(f'{phase} {mean * 1000:.2f} ms')
+        if self.systems:
+            for name, seconds in self.systems.items():
+                lines.append(f'{name} {seconds * 1000:.2f} ms')
+        self.label.text = '\n'.join(lines)
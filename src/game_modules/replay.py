@@ -0,0 +1,150 @@
+"""
+Match recording and deterministic replay.
+
+A recording is the seed of the match simulation, the tick length and one
+input bitmask per tick, so a whole match takes a byte per tick. Replaying
+re-runs the simulation from those inputs without rendering, as fast as the
+CPU goes, and seeks through snapshots taken every few seconds of play.
+
+Run `python -m game_modules.replay FILE...` from the src directory to replay
+recordings and check that they still end in the recorded state.
+"""
+from argparse import ArgumentParser
+from array import array
+from struct import calcsize, pack, unpack_from
+from sys import exit
+from time import perf_counter
+
+from .consts import REPLAY_SNAPSHOT_INTERVAL
+from .simulation import SimulationState, checksum, step
+
+# Magic, format version, seed, tick length, checksum of the final state
+_HEADER = '<4sBIdI'
+_MAGIC = b'PONG'
+_VERSION = 2  # 2: points and serves after a goal
+
+
+class Recording:
+    def __init__(self, seed: int, dt: float) -> None:
+        self.seed = seed
+        self.dt = dt
+        self.inputs = array('B')  # One bitmask per tick
+        self.final_checksum = 0
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def to_bytes(self) -> bytes:
+        header = pack(
+            _HEADER,
+            _MAGIC,
+            _VERSION,
+            self.seed,
+            self.dt,
+            self.final_checksum,
+        )
+        return header + self.inputs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Recording':
+        magic, version, seed, dt, final_checksum = unpack_from(_HEADER, data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('Not a PyPong recording, or an unknown version')
+        recording = cls(seed=seed, dt=dt)
+        recording.final_checksum = final_checksum
+        recording.inputs.frombytes(data[calcsize(_HEADER) :])
+        return recording
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'Recording':
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+class Replay:
+    def __init__(
+        self,
+        recording: Recording,
+        snapshot_interval: int = REPLAY_SNAPSHOT_INTERVAL,
+    ) -> None:
+        self.recording = recording
+        self.snapshot_interval = snapshot_interval
+        self.state = SimulationState(seed=recording.seed)
+        # snapshots[i] is the state at tick i * snapshot_interval
+        self.snapshots = [self._snapshot()]
+
+    @property
+    def tick(self) -> int:
+        return self.state.tick
+
+    def run(self, until: int = None) -> SimulationState:
+        """Simulates up to the tick until, by default the end of the match"""
+        inputs = self.recording.inputs
+        until = len(inputs) if until is None else min(until, len(inputs))
+        state = self.state
+        dt = self.recording.dt
+        interval = self.snapshot_interval
+        snapshots = self.snapshots
+        while state.tick < until:
+            step(state, inputs[state.tick], dt)
+            if state.tick % interval == 0 and state.tick // interval == len(
+                snapshots
+            ):
+                snapshots.append(self._snapshot())
+        return state
+
+    def seek(self, tick: int) -> SimulationState:
+        """Restores the closest snapshot before tick and simulates to it"""
+        index = min(tick // self.snapshot_interval, len(self.snapshots) - 1)
+        if not (index * self.snapshot_interval <= self.tick <= tick):
+            self.state.copy_from(self.snapshots[index], with_rng=True)
+        return self.run(until=tick)
+
+    def verify(self) -> bool:
+        """Replays the whole match and compares it with the recorded end"""
+        return checksum(self.run()) == self.recording.final_checksum
+
+    def _snapshot(self) -> SimulationState:
+        snapshot = SimulationState(seed=0)
+        snapshot.copy_from(self.state, with_rng=True)
+        return snapshot
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.replay')
+    parser.add_argument('paths', nargs='+', metavar='FILE')
+    parser.add_argument(
+        '--seek', type=int, metavar='TICK', help='Print the state at TICK'
+    )
+    args = parser.parse_args()
+
+    mismatches = 0
+    ticks = 0
+    start = perf_counter()
+    for path in args.paths:
+        replay = Replay(Recording.load(path))
+        if args.seek is not None:
+            ball = replay.seek(args.seek).ball
+            print(f'{path}: tick {replay.tick} ball {ball.x:.2f} {ball.y:.2f}')
+            continue
+        if not replay.verify():
+            mismatches += 1
+            print(f'{path}: MISMATCH at the end of {len(replay.recording)}')
+        ticks += replay.tick
+    elapsed = perf_counter() - start
+
+    if args.seek is None:
+        print(
+            f'{len(args.paths)} recordings, {mismatches} mismatches, '
+            f'{ticks} ticks in {elapsed:.2f} s '
+            f'({ticks / max(elapsed, 1e-9):,.0f} ticks/s)'
+        )
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    exit(main())
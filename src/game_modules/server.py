@@ -0,0 +1,632 @@
+"""
+Headless match server.
+
+One asyncio event loop hosts many independent rooms. Every match of every
+room is a row of a single BatchSimulation, so each tick steps all of them
+in a few array operations instead of one Python simulation step per room:
+hundreds of rooms cost little more than a handful. Rows are loaded from a
+fresh SimulationState when a room's match starts, and the batch applies the
+same rules, scores and serves as the game.
+
+Clients talk over TCP, each message framed by its length like WebSocket
+frames. Two players join a room and send the keys they hold, any number of
+spectators join it to watch. Every member of a room gets the same stream of
+snapshots: a full one first, then only the fields that changed since the
+previous one. A stream is encoded once per room and the same bytes are
+written to every member; a member too slow to keep up skips snapshots and
+gets a full one once it has caught up.
+
+Run `python -m game_modules.server` from the src directory to host rooms,
+with --bots to fill rooms with scripted players and spectators on localhost,
+report the metrics and check that every spectator ended in sync.
+"""
+import asyncio
+import json
+from argparse import ArgumentParser
+from random import Random
+from struct import calcsize
+from struct import error as StructError
+from struct import pack, unpack_from
+from sys import exit
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+
+from .batch import BatchSimulation
+from .consts import (
+    MAX_CATCH_UP_STEPS,
+    SERVER_MAX_BUFFERED,
+    SERVER_MAX_ROOMS,
+    SERVER_PORT,
+    SERVER_SNAPSHOT_RATE,
+    TICK_RATE,
+    WINNING_SCORE,
+)
+from .simulation import SIDE_INPUTS, SimulationState
+
+# Messages start with their kind. Client to server: JOIN a room as a player
+# or a spectator, INPUT the keys a player holds (KEY_UP | KEY_DOWN), STATS
+# asks for the metrics. Server to client: WELCOME with the side played (0
+# for spectators), SNAPSHOT and DELTA of the room's match, END with the
+# winner, ERROR with a reason and STATS with the metrics, both as text.
+MESSAGE_JOIN = 1
+MESSAGE_INPUT = 2
+MESSAGE_STATS = 3
+MESSAGE_WELCOME = 4
+MESSAGE_SNAPSHOT = 5
+MESSAGE_DELTA = 6
+MESSAGE_END = 7
+MESSAGE_ERROR = 8
+
+ROLE_PLAYER = 1
+ROLE_SPECTATOR = 2
+
+KEY_UP = 1
+KEY_DOWN = 2
+
+# Fields of a snapshot, sent as float32. A delta has a bit per field that
+# changed, then the values of those.
+FIELDS = (
+    'paddle_1_y',
+    'paddle_2_y',
+    'ball_x',
+    'ball_y',
+    'ball_vx',
+    'ball_vy',
+    'score_1',
+    'score_2',
+)
+_FRAME = '<H'  # Length of the message that follows
+_JOIN = '<BB'  # Then the room name in UTF-8
+_INPUT = '<BB'
+_WELCOME = '<BBH'  # Side, tick rate
+_SNAPSHOT = f'<BI{len(FIELDS)}f'  # Tick, every field
+_DELTA = '<BIB'  # Tick, changed fields mask, then their values
+_END = '<BB'
+
+
+class MalformedMessage(Exception):
+    """A client sent a message the protocol does not allow"""
+
+
+def frame(message: bytes) -> bytes:
+    return pack(_FRAME, len(message)) + message
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(calcsize(_FRAME))
+    (length,) = unpack_from(_FRAME, header)
+    return await reader.readexactly(length)
+
+
+class Member:
+    """A connection in a room, playing a side or watching (side 0)"""
+
+    def __init__(self, writer: asyncio.StreamWriter, room, side: int):
+        self.writer = writer
+        self.room = room
+        self.side = side
+        self.needs_full = True  # Next snapshot sent in full
+
+    def send(self, message: bytes) -> int:
+        data = frame(message)
+        self.writer.write(data)
+        return len(data)
+
+    @property
+    def backlogged(self) -> bool:
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() > SERVER_MAX_BUFFERED
+
+
+class Room:
+    def __init__(self, name: str, row: int, seed: int) -> None:
+        self.name = name
+        self.row = row  # Of the server's batch
+        self.seed = seed
+        self.players: dict[int, Member] = {}  # Side => member
+        self.spectators: list[Member] = []
+        self.status = 'waiting'  # Then 'playing', then 'over'
+        self.start_tick = 0  # Batch tick of the start of the match
+        self.winner = 0
+        # Last snapshot sent, as float32 fields, and its tick
+        self.sent: Optional[np.ndarray] = None
+        self.sent_tick = 0
+        # Metrics
+        self.snapshots = 0
+        self.bytes_sent = 0
+        self.broadcast_time = 0.0  # Smoothed seconds per broadcast
+
+    @property
+    def members(self) -> list[Member]:
+        return [*self.players.values(), *self.spectators]
+
+    def metrics(self) -> dict:
+        score = (0, 0) if self.sent is None else self.sent[-2:]
+        return {
+            'status': self.status,
+            'ticks': self.sent_tick,  # Played, as of the last snapshot
+            'players': len(self.players),
+            'spectators': len(self.spectators),
+            'score': [int(points) for points in score],
+            'snapshots': self.snapshots,
+            'bytes_sent': self.bytes_sent,
+            'broadcast_us': self.broadcast_time * 1e6,
+        }
+
+
+class MatchServer:
+    def __init__(
+        self,
+        max_rooms: int = SERVER_MAX_ROOMS,
+        tick_rate: int = TICK_RATE,
+        snapshot_rate: int = SERVER_SNAPSHOT_RATE,
+        winning_score: int = WINNING_SCORE,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.tick_rate = tick_rate
+        self.winning_score = winning_score
+        self.dt = 1 / tick_rate
+        # Ticks between snapshots
+        self.snapshot_interval = max(round(tick_rate / snapshot_rate), 1)
+        self.batch = BatchSimulation(max_rooms)
+        self.inputs = np.zeros(max_rooms, dtype=np.int64)
+        self.rooms: dict[str, Room] = {}
+        # Room name => the room of its last finished match, for the last
+        # max_rooms matches: older ones are forgotten
+        self.results: dict[str, Room] = {}
+        self.max_results = max_rooms
+        self.free_rows = list(range(max_rooms - 1, -1, -1))
+        self.rng = Random(seed)
+        self.server = None
+        # Metrics
+        self.step_time = 0.0  # Smoothed seconds per batch step
+        self.late_ticks = 0  # Dropped after falling too far behind
+
+    async def start(self, host: str = '127.0.0.1', port: int = SERVER_PORT):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def run(self) -> None:
+        """Steps the rooms at the tick rate until cancelled"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            due = int((loop.time() - next_tick) / self.dt) + 1
+            if due > MAX_CATCH_UP_STEPS:
+                # Like Game after a stall: drop the backlog
+                self.late_ticks += due - MAX_CATCH_UP_STEPS
+                next_tick += (due - MAX_CATCH_UP_STEPS) * self.dt
+                due = MAX_CATCH_UP_STEPS
+            for _ in range(due):
+                self.tick()
+            next_tick += due * self.dt
+            await asyncio.sleep(max(next_tick - loop.time(), 0))
+
+    def tick(self) -> None:
+        start = perf_counter()
+        self.batch.step(self.inputs, self.dt)
+        seconds = perf_counter() - start
+        self.step_time += (seconds - self.step_time) * 0.1
+
+        # Points are the misses of the other side
+        misses = self.batch.misses
+        tick = self.batch.tick
+        broadcast = tick % self.snapshot_interval == 0
+        for room in self.rooms.values():
+            if room.status != 'playing':
+                continue
+            score_2, score_1 = misses[room.row]
+            if max(score_1, score_2) >= self.winning_score:
+                self._broadcast(room)
+                self._end(room, 1 if score_1 > score_2 else 2)
+            elif broadcast:
+                self._broadcast(room)
+
+    def metrics(self) -> dict:
+        playing = sum(room.status == 'playing' for room in self.rooms.values())
+        return {
+            'tick': self.batch.tick,
+            'rooms': len(self.rooms),
+            'playing': playing,
+            'step_us': self.step_time * 1e6,
+            'step_us_per_room': self.step_time * 1e6 / max(playing, 1),
+            'late_ticks': self.late_ticks,
+            'room': {
+                name: room.metrics() for name, room in self.rooms.items()
+            },
+        }
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+
+    def snapshot(self, room: Room) -> np.ndarray:
+        """The fields of a room's match, as float32"""
+        batch = self.batch
+        row = room.row
+        return np.array(
+            (
+                batch.paddle_y[row, 0],
+                batch.paddle_y[row, 1],
+                batch.ball_x[row],
+                batch.ball_y[row],
+                batch.ball_vx[row],
+                batch.ball_vy[row],
+                batch.misses[row, 1],
+                batch.misses[row, 0],
+            ),
+            dtype=np.float32,
+        )
+
+    async def _serve(self, reader, writer) -> None:
+        member = None
+        try:
+            while True:
+                message = await read_message(reader)
+                member = self._receive(message, writer, member)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        # Whatever the client is, it does not speak the protocol: it is
+        # told why, then disconnected
+        except MalformedMessage as error:
+            self._refuse(writer, str(error))
+        except (IndexError, StructError, UnicodeDecodeError):
+            self._refuse(writer, 'Malformed message')
+        finally:
+            if member is not None:
+                self._leave(member)
+            writer.close()
+
+    def _receive(self, message: bytes, writer, member: Optional[Member]):
+        if not message:
+            raise MalformedMessage('Empty message')
+        kind = message[0]
+        if kind == MESSAGE_INPUT and member is not None and member.side:
+            if len(message) != calcsize(_INPUT):
+                raise MalformedMessage('Malformed input message')
+            _, keys = unpack_from(_INPUT, message)
+            up, down = SIDE_INPUTS[member.side]
+            inputs = self.inputs[member.room.row] & ~(up | down)
+            if keys & KEY_UP:
+                inputs |= up
+            if keys & KEY_DOWN:
+                inputs |= down
+            self.inputs[member.room.row] = inputs
+        elif kind == MESSAGE_JOIN and member is None:
+            if len(message) < calcsize(_JOIN):
+                raise MalformedMessage('Malformed join message')
+            _, role = unpack_from(_JOIN, message)
+            if role not in (ROLE_PLAYER, ROLE_SPECTATOR):
+                raise MalformedMessage(f'Unknown role {role}')
+            name = message[calcsize(_JOIN) :].decode()
+            return self._join(name, role, writer)
+        elif kind == MESSAGE_STATS:
+            writer.write(
+                frame(
+                    bytes((MESSAGE_STATS,))
+                    + json.dumps(self.metrics()).encode()
+                )
+            )
+        elif kind == MESSAGE_INPUT:
+            raise MalformedMessage('Only players in a room send inputs')
+        elif kind == MESSAGE_JOIN:
+            raise MalformedMessage('Already in a room')
+        else:
+            raise MalformedMessage(f'Unknown message kind {kind}')
+        return member
+
+    def _join(self, name: str, role: int, writer) -> Optional[Member]:
+        room = self.rooms.get(name)
+        if room is None:
+            if not self.free_rows:
+                return self._refuse(writer, 'The server is full')
+            room = Room(name, self.free_rows.pop(), self.rng.getrandbits(32))
+            self.rooms[name] = room
+        if room.status == 'over':
+            return self._refuse(writer, 'The match is over')
+
+        side = 0
+        if role == ROLE_PLAYER:
+            free = [side for side in SIDE_INPUTS if side not in room.players]
+            if not free:
+                return self._refuse(writer, 'The room is full')
+            side = free[0]
+        member = Member(writer, room, side)
+        member.send(pack(_WELCOME, MESSAGE_WELCOME, side, self.tick_rate))
+        if side:
+            room.players[side] = member
+        else:
+            room.spectators.append(member)
+        if room.status == 'waiting' and len(room.players) == 2:
+            self._start(room)
+        elif room.sent is not None:
+            # Joining a match under way: start from its last snapshot
+            self._send_full(room, member)
+        return member
+
+    def _refuse(self, writer, reason: str) -> None:
+        writer.write(frame(bytes((MESSAGE_ERROR,)) + reason.encode()))
+        return None
+
+    def _start(self, room: Room) -> None:
+        self.batch.load(room.row, SimulationState(seed=room.seed))
+        self.inputs[room.row] = 0
+        room.status = 'playing'
+        room.start_tick = self.batch.tick
+        self._broadcast(room)
+
+    def _end(self, room: Room, winner: int) -> None:
+        room.status = 'over'
+        room.winner = winner
+        # Moved last, as the newest result
+        self.results.pop(room.name, None)
+        self.results[room.name] = room
+        if len(self.results) > self.max_results:
+            del self.results[next(iter(self.results))]
+        self.inputs[room.row] = 0
+        for member in room.members:
+            room.bytes_sent += member.send(pack(_END, MESSAGE_END, winner))
+
+    def _leave(self, member: Member) -> None:
+        room = member.room
+        if member.side:
+            del room.players[member.side]
+            up, down = SIDE_INPUTS[member.side]
+            self.inputs[room.row] &= ~(up | down)
+        else:
+            room.spectators.remove(member)
+        if not room.players and not room.spectators:
+            del self.rooms[room.name]
+            self.free_rows.append(room.row)
+
+    def _broadcast(self, room: Room) -> None:
+        start = perf_counter()
+        values = self.snapshot(room)
+        tick = self.batch.tick - room.start_tick
+        full = None
+        delta = None
+        for member in room.members:
+            if member.backlogged:
+                # Its stream has a gap now, it needs a full snapshot
+                member.needs_full = True
+                continue
+            if member.needs_full or room.sent is None:
+                if full is None:
+                    full = pack(_SNAPSHOT, MESSAGE_SNAPSHOT, tick, *values)
+                room.bytes_sent += member.send(full)
+                member.needs_full = False
+            else:
+                if delta is None:
+                    delta = _encode_delta(tick, room.sent, values)
+                room.bytes_sent += member.send(delta)
+        room.sent = values
+        room.sent_tick = tick
+        room.snapshots += 1
+        seconds = perf_counter() - start
+        room.broadcast_time += (seconds - room.broadcast_time) * 0.1
+
+    def _send_full(self, room: Room, member: Member) -> None:
+        room.bytes_sent += member.send(
+            pack(_SNAPSHOT, MESSAGE_SNAPSHOT, room.sent_tick, *room.sent)
+        )
+        member.needs_full = False
+
+
+def _encode_delta(tick: int, previous: np.ndarray, values: np.ndarray):
+    # Compared as sent, so the client rebuilds exactly the same values
+    changed = np.flatnonzero(
+        previous.view(np.uint32) != values.view(np.uint32)
+    )
+    mask = int(np.bitwise_or.reduce(1 << changed)) if len(changed) else 0
+    return pack(_DELTA, MESSAGE_DELTA, tick, mask) + values[changed].tobytes()
+
+
+class MatchClient:
+    """
+    Connection to a MatchServer, keeping the latest state of its room in
+    values (float32 FIELDS) as snapshots arrive
+    """
+
+    def __init__(self) -> None:
+        self.reader = None
+        self.writer = None
+        self.room = None
+        self.side = None  # 0 for spectators
+        self.tick = 0
+        self.values = np.zeros(len(FIELDS), dtype=np.float32)
+        self.snapshots = 0
+        self.winner = 0
+        self.error = None
+        self.stats = None  # Metrics of the last STATS reply
+
+    async def connect(self, host: str, port: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def join(self, room: str, role: int) -> int:
+        """Joins a room, returns the side played, 0 for spectators"""
+        self.room = room
+        self.writer.write(
+            frame(pack(_JOIN, MESSAGE_JOIN, role) + room.encode())
+        )
+        message = await read_message(self.reader)
+        if message[0] == MESSAGE_ERROR:
+            raise ConnectionError(message[1:].decode())
+        _, self.side, _ = unpack_from(_WELCOME, message)
+        return self.side
+
+    def send_keys(self, keys: int) -> None:
+        self.writer.write(frame(pack(_INPUT, MESSAGE_INPUT, keys)))
+
+    def request_stats(self) -> None:
+        self.writer.write(frame(bytes((MESSAGE_STATS,))))
+
+    async def receive(self) -> int:
+        """Reads and applies the next message, returns its kind"""
+        message = await read_message(self.reader)
+        kind = message[0]
+        if kind == MESSAGE_SNAPSHOT:
+            _, self.tick, *values = unpack_from(_SNAPSHOT, message)
+            self.values[:] = values
+            self.snapshots += 1
+        elif kind == MESSAGE_DELTA:
+            _, self.tick, mask = unpack_from(_DELTA, message)
+            changed = [i for i in range(len(FIELDS)) if mask >> i & 1]
+            self.values[changed] = np.frombuffer(
+                message, dtype=np.float32, offset=calcsize(_DELTA)
+            )
+            self.snapshots += 1
+        elif kind == MESSAGE_END:
+            _, self.winner = unpack_from(_END, message)
+        elif kind == MESSAGE_ERROR:
+            self.error = message[1:].decode()
+        elif kind == MESSAGE_STATS:
+            self.stats = json.loads(message[1:])
+        return kind
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def run_bot(
+    host: str, port: int, room: str, role: int, seed: int
+) -> MatchClient:
+    """
+    Plays (or watches) a room until its match ends. A player follows the
+    ball, aiming off by a random amount so that points are scored.
+    """
+    client = MatchClient()
+    await client.connect(host, port)
+    try:
+        await client.join(room, role)
+        rng = Random(seed)
+        aim_error = 0.0
+        keys = 0
+        while not client.winner:
+            kind = await client.receive()
+            if not client.side or kind not in (
+                MESSAGE_SNAPSHOT,
+                MESSAGE_DELTA,
+            ):
+                continue
+            if rng.random() < 0.05:
+                aim_error = rng.uniform(-120, 120)
+            paddle_y = client.values[client.side - 1]
+            target_y = client.values[3] + aim_error
+            wanted = 0
+            if target_y > paddle_y + 10:
+                wanted = KEY_UP
+            elif target_y < paddle_y - 10:
+                wanted = KEY_DOWN
+            if wanted != keys:
+                keys = wanted
+                client.send_keys(keys)
+    finally:
+        client.close()
+    return client
+
+
+async def _run_bots(args) -> int:
+    server = MatchServer(
+        max_rooms=max(args.max_rooms, args.bots),
+        snapshot_rate=args.snapshot_rate,
+        winning_score=args.points,
+        seed=args.seed,
+    )
+    host, port = await server.start(args.host, args.port)
+    ticking = asyncio.create_task(server.run())
+    bots = []
+    for index in range(args.bots):
+        room = f'room-{index}'
+        for side in (1, 2):
+            bots.append(
+                run_bot(host, port, room, ROLE_PLAYER, args.seed + side)
+            )
+        for _ in range(args.spectators):
+            bots.append(run_bot(host, port, room, ROLE_SPECTATOR, args.seed))
+    start = perf_counter()
+    clients = await asyncio.wait_for(
+        asyncio.gather(*bots), timeout=args.timeout
+    )
+    elapsed = perf_counter() - start
+    ticking.cancel()
+    server.close()
+
+    # Every client must have ended on the last snapshot of its room
+    rooms = server.results
+    out_of_sync = sum(
+        not np.array_equal(client.values, rooms[client.room].sent)
+        for client in clients
+    )
+    ticks = [room.sent_tick for room in rooms.values()]
+    sent = sum(room.bytes_sent for room in rooms.values())
+    snapshots = sum(room.snapshots for room in rooms.values())
+    members = 2 + args.spectators
+    print(
+        f'{len(rooms)} rooms of 2 players and {args.spectators} spectators: '
+        f'matches of {min(ticks)}-{max(ticks)} ticks in {elapsed:.1f} s'
+    )
+    print(
+        f'step {server.step_time * 1e6:.0f} us per tick for every room, '
+        f'{server.late_ticks} late ticks dropped'
+    )
+    print(
+        f'{snapshots} snapshots of {sent / snapshots / members:.1f} bytes '
+        f'on average per member'
+    )
+    print(f'{out_of_sync} of {len(clients)} clients out of sync')
+    return 1 if out_of_sync else 0
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--max-rooms', type=int, default=SERVER_MAX_ROOMS)
+    parser.add_argument(
+        '--snapshot-rate',
+        type=int,
+        default=SERVER_SNAPSHOT_RATE,
+        help='Snapshots sent per second to each member of a room',
+    )
+    parser.add_argument(
+        '--points',
+        type=int,
+        default=WINNING_SCORE,
+        help='Points that win a match',
+    )
+    parser.add_argument(
+        '--bots',
+        type=int,
+        metavar='ROOMS',
+        help='Play ROOMS matches of scripted bots on localhost, then report',
+    )
+    parser.add_argument('--spectators', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.bots:
+        return asyncio.run(_run_bots(args))
+
+    async def serve() -> None:
+        server = MatchServer(
+            max_rooms=args.max_rooms,
+            snapshot_rate=args.snapshot_rate,
+            winning_score=args.points,
+        )
+        host, port = await server.start(args.host, args.port)
+        print(f'Serving {args.max_rooms} rooms on {host}:{port}')
+        await server.run()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
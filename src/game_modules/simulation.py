@@ -0,0 +1,280 @@
+"""
+Headless Pong simulation.
+
+Pure Python on purpose: nothing here imports pyglet, so the physics runs on
+servers and test runners without a GL context. The pyglet shapes in
+game_objects only read from these states when a frame is rendered.
+"""
+from math import copysign
+from random import Random
+from struct import pack
+from typing import Optional
+from zlib import crc32
+
+from .collision import sweep_circle_aabb, sweep_circle_walls
+from .consts import (
+    BALL_RADIUS,
+    BALL_SPEED,
+    PADDLE_HEIGHT,
+    PADDLE_SPEED,
+    PADDLE_WIDTH,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+    WINNING_SCORE,
+)
+
+# Inputs of a tick, one bit per key the paddles listen to
+INPUT_P1_UP = 1 << 0
+INPUT_P1_DOWN = 1 << 1
+INPUT_P2_UP = 1 << 2
+INPUT_P2_DOWN = 1 << 3
+
+# Paddle side => its (up, down) input bits
+SIDE_INPUTS = {
+    1: (INPUT_P1_UP, INPUT_P1_DOWN),
+    2: (INPUT_P2_UP, INPUT_P2_DOWN),
+}
+
+# Events raised while stepping, stored as (kind, x, y) of the contact point
+EVENT_WALL_BOUNCE = 0
+EVENT_PADDLE_HIT = 1
+EVENT_BALL_HIT = 2  # Two balls bouncing off each other, see multiball
+EVENT_GOAL = 3  # The ball reaching the wall behind a paddle
+
+# Bounces resolved within a single tick, the rest of the tick is dropped
+MAX_BOUNCES_PER_TICK = 4
+
+
+class PaddleState:
+    __slots__ = ('x', 'y', 'width', 'height', 'speed', 'vy')
+
+    def __init__(self, x: float, y: float) -> None:
+        self.x = float(x)
+        self.y = float(y)
+        self.width = float(PADDLE_WIDTH)
+        self.height = float(PADDLE_HEIGHT)
+        self.speed = float(PADDLE_SPEED)
+        self.vy = 0.0
+
+    def copy_from(self, other: 'PaddleState') -> None:
+        self.x = other.x
+        self.y = other.y
+        self.vy = other.vy
+
+
+class BallState:
+    __slots__ = ('x', 'y', 'radius', 'vx', 'vy')
+
+    def __init__(self, x: float, y: float, vx: float, vy: float) -> None:
+        self.x = float(x)
+        self.y = float(y)
+        self.radius = float(BALL_RADIUS)
+        self.vx = float(vx)
+        self.vy = float(vy)
+
+    def copy_from(self, other: 'BallState') -> None:
+        self.x = other.x
+        self.y = other.y
+        self.vx = other.vx
+        self.vy = other.vy
+
+
+class SimulationState:
+    __slots__ = (
+        'paddle_1',
+        'paddle_2',
+        'ball',
+        'rng',
+        'tick',
+        'score_1',
+        'score_2',
+        'events',
+    )
+
+    def __init__(self, seed: Optional[int] = None) -> None:
+        self.rng = Random(seed)
+        self.paddle_1 = PaddleState(x=20, y=WINDOW_HEIGHT / 2)
+        self.paddle_2 = PaddleState(x=WINDOW_WIDTH - 20, y=WINDOW_HEIGHT / 2)
+        self.ball = BallState(
+            x=WINDOW_WIDTH / 2,
+            y=WINDOW_HEIGHT / 2,
+            vx=BALL_SPEED * self.rng.choice((-1, 1)),
+            vy=BALL_SPEED * self.rng.choice((-1, 1)),
+        )
+        self.tick = 0
+        self.score_1 = 0
+        self.score_2 = 0
+        self.events: list[tuple[int, float, float]] = []
+
+    def copy_from(
+        self, other: 'SimulationState', with_rng: bool = False
+    ) -> None:
+        """
+        Copies the entities of another state without allocating. The random
+        generator state is only copied with_rng, as snapshots that resume
+        stepping need it but per tick interpolation copies do not
+        """
+        self.paddle_1.copy_from(other.paddle_1)
+        self.paddle_2.copy_from(other.paddle_2)
+        self.ball.copy_from(other.ball)
+        self.tick = other.tick
+        self.score_1 = other.score_1
+        self.score_2 = other.score_2
+        if with_rng:
+            self.rng.setstate(other.rng.getstate())
+
+
+def checksum(state: SimulationState) -> int:
+    """CRC32 of the tick, scores and entities, to compare two simulations"""
+    ball = state.ball
+    return crc32(
+        pack(
+            '<Q2I8d',
+            state.tick,
+            state.score_1,
+            state.score_2,
+            state.paddle_1.y,
+            state.paddle_1.vy,
+            state.paddle_2.y,
+            state.paddle_2.vy,
+            ball.x,
+            ball.y,
+            ball.vx,
+            ball.vy,
+        )
+    )
+
+
+def winner(state: SimulationState) -> Optional[int]:
+    """Side that reached WINNING_SCORE, None while the match goes on"""
+    if state.score_1 >= WINNING_SCORE:
+        return 1
+    if state.score_2 >= WINNING_SCORE:
+        return 2
+    return None
+
+
+def serve(ball: BallState, towards: int, points: int) -> None:
+    """
+    Puts the ball back in the centre, moving towards the paddle of a side.
+    It goes up or down depending on the points played so far, so serves
+    need no random numbers and the batch simulation can repeat them.
+    """
+    # Bounces never change the horizontal speed, it is the serve speed
+    speed = abs(ball.vx)
+    ball.x = WINDOW_WIDTH / 2
+    ball.y = WINDOW_HEIGHT / 2
+    ball.vx = -speed if towards == 1 else speed
+    ball.vy = speed if points % 2 else -speed
+
+
+def step(state: SimulationState, inputs: int, dt: float) -> None:
+    """Advances the simulation by dt seconds using the inputs bitmask"""
+    state.events.clear()
+    _steer_paddle(state.paddle_1, inputs, INPUT_P1_UP, INPUT_P1_DOWN, dt)
+    _steer_paddle(state.paddle_2, inputs, INPUT_P2_UP, INPUT_P2_DOWN, dt)
+    # The ball sweeps against the paddles while they move, so paddles only
+    # reach their new position after it
+    _move_ball(state, dt)
+    state.paddle_1.y += state.paddle_1.vy * dt
+    state.paddle_2.y += state.paddle_2.vy * dt
+    state.tick += 1
+
+
+def _steer_paddle(
+    paddle: PaddleState, inputs: int, up: int, down: int, dt: float
+) -> None:
+    if inputs & up:
+        target_y = paddle.y + paddle.speed * dt
+    elif inputs & down:
+        target_y = paddle.y - paddle.speed * dt
+    else:
+        paddle.vy = 0.0
+        return
+
+    half_height = paddle.height / 2
+    target_y = min(max(target_y, half_height), WINDOW_HEIGHT - half_height)
+    paddle.vy = (target_y - paddle.y) / dt if dt > 0 else 0.0
+
+
+def _move_ball(state: SimulationState, dt: float) -> None:
+    ball = state.ball
+    paddles = (state.paddle_1, state.paddle_2)
+    elapsed = 0.0
+
+    for _ in range(MAX_BOUNCES_PER_TICK):
+        remaining = dt - elapsed
+        if remaining <= 0:
+            return
+        dx = ball.vx * remaining
+        dy = ball.vy * remaining
+
+        hit = sweep_circle_walls(
+            ball.x, ball.y, dx, dy, ball.radius, WINDOW_WIDTH, WINDOW_HEIGHT
+        )
+        hit_paddle = None
+        for paddle in paddles:
+            # Swept in the paddle frame of reference, so its motion counts
+            paddle_y = paddle.y + paddle.vy * elapsed
+            half_width = paddle.width / 2
+            half_height = paddle.height / 2
+            paddle_hit = sweep_circle_aabb(
+                ball.x,
+                ball.y,
+                dx,
+                dy - paddle.vy * remaining,
+                ball.radius,
+                paddle.x - half_width,
+                paddle_y - half_height,
+                paddle.x + half_width,
+                paddle_y + half_height,
+            )
+            if paddle_hit and (hit is None or paddle_hit[0] < hit[0]):
+                hit = paddle_hit
+                hit_paddle = paddle
+
+        if hit is None:
+            ball.x += dx
+            ball.y += dy
+            return
+
+        t, nx, ny = hit
+        ball.x += dx * t
+        ball.y += dy * t
+        elapsed += remaining * t
+        contact_x = ball.x - nx * ball.radius
+        contact_y = ball.y - ny * ball.radius
+
+        if hit_paddle is None and nx != 0:
+            # Behind a paddle: a point for the other side, who serves
+            # towards the side that missed, and the tick ends there
+            state.events.append((EVENT_GOAL, contact_x, contact_y))
+            missed = 1 if nx > 0 else 2
+            if missed == 1:
+                state.score_2 += 1
+            else:
+                state.score_1 += 1
+            serve(ball, towards=missed, points=state.score_1 + state.score_2)
+            return
+        if hit_paddle is None:
+            _reflect(ball, nx, ny, 0.0)
+            state.events.append((EVENT_WALL_BOUNCE, contact_x, contact_y))
+        else:
+            # Paddles redirect the ball, but never speed it up past the
+            # speed of the paddle itself
+            speed_x = abs(ball.vx)
+            speed_y = max(abs(ball.vy), abs(hit_paddle.vy))
+            _reflect(ball, nx, ny, hit_paddle.vy)
+            ball.vx = copysign(speed_x, ball.vx)
+            ball.vy = copysign(speed_y, ball.vy)
+            state.events.append((EVENT_PADDLE_HIT, contact_x, contact_y))
+
+
+def _reflect(ball: BallState, nx: float, ny: float, surface_vy: float) -> None:
+    """Mirrors the ball velocity, relative to the surface, along the normal"""
+    relative_vy = ball.vy - surface_vy
+    dot = ball.vx * nx + relative_vy * ny
+    if dot >= 0:
+        return
+    ball.vx -= 2 * dot * nx
+    ball.vy = relative_vy - 2 * dot * ny + surface_vy
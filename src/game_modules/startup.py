@@ -0,0 +1,39 @@
+"""
+Startup timeline.
+
+Game marks the end of each startup phase, from importing game.py to the
+first frame of the main menu, so the time to first frame can be tracked and
+a regression pinned to the phase that caused it. Work the first frame does
+not need (sounds, the match modules) only starts after it.
+"""
+from time import perf_counter
+from typing import Optional
+
+
+class StartupTimeline:
+    def __init__(self, start: Optional[float] = None) -> None:
+        """start is a perf_counter() time, now by default"""
+        self.start = perf_counter() if start is None else start
+        self.phases: list[tuple[str, float]] = []  # (name, seconds)
+        self._last = self.start
+
+    @property
+    def total(self) -> float:
+        """Seconds from the start to the end of the last phase"""
+        return self._last - self.start
+
+    def mark(self, name: str) -> float:
+        """Ends the phase called name, returns how long it took"""
+        now = perf_counter()
+        duration = now - self._last
+        self.phases.append((name, duration))
+        self._last = now
+        return duration
+
+    def report(self) -> str:
+        lines = [
+            f'{name:<12} {duration * 1000:8.1f} ms'
+            for name, duration in self.phases
+        ]
+        lines.append(f'{"total":<12} {self.total * 1000:8.1f} ms')
+        return '\n'.join(lines)
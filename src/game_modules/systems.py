@@ -0,0 +1,349 @@
+"""
+Systems of the match states, see ecs.
+
+Each tick runs input, physics, audio and effects, and each frame runs the
+effects upload and the shape rendering. Physics stays the deterministic
+simulation step, which netplay and replays rely on to the bit: the system
+drives it and copies the paddles and balls it moved into the component
+rows that every other system reads.
+"""
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+from pyglet.graphics import Batch, Group
+
+from .consts import (
+    COLOR_TRAIL,
+    PARTICLE_SPARK_LIFETIME,
+    PARTICLE_SPARK_SPEED,
+    PARTICLE_SPARKS,
+    PARTICLE_TRAIL_LIFETIME,
+    WINDOW_WIDTH,
+)
+from .ecs import System, World
+from .game_objects import SHAPE_BOX, SHAPE_CIRCLE, ShapeMesh
+from .multiball import MultiBallSimulation
+from .netplay import RollbackSession
+from .particles import ParticleSystem
+from .simulation import (
+    EVENT_GOAL,
+    EVENT_PADDLE_HIT,
+    EVENT_WALL_BOUNCE,
+    SimulationState,
+    step,
+)
+from .telemetry import (
+    GOAL,
+    PADDLE_HIT,
+    RALLY_END,
+    RALLY_START,
+    WALL_BOUNCE,
+    Telemetry,
+)
+
+# Events of a tick as (kinds, contact xs, contact ys) arrays
+NO_EVENTS = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+
+def match_world(capacity: int) -> World:
+    """World with the components of the paddles and balls of a match"""
+    world = World(capacity)
+    world.register('position', (2,))
+    world.register('previous_position', (2,))  # Of the last tick
+    world.register('velocity', (2,))
+    world.register('collider', (2,))  # Half extents, the radius for balls
+    # Renderables: drawn as a SHAPE_* of the collider size
+    world.register('shape', dtype=np.int8)
+    world.register('color', (4,), dtype=np.uint8)
+    world.register('trail', dtype=bool)  # Leaves a trail of particles
+    world.resources['inputs'] = 0
+    world.resources['events'] = NO_EVENTS
+    return world
+
+
+class InputSystem(System):
+    """ORs the inputs of the controllers into the inputs resource"""
+
+    name = 'input'
+
+    def __init__(self, controllers: list, simulation, recording=None) -> None:
+        self.controllers = controllers
+        self.simulation = simulation
+        self.recording = recording
+
+    def update(self, world: World, dt: float) -> None:
+        inputs = 0
+        for controller in self.controllers:
+            inputs |= controller.read(self.simulation, dt)
+        if self.recording is not None:
+            self.recording.inputs.append(inputs)
+        world.resources['inputs'] = inputs
+
+
+class PhysicsSystem(System):
+    """Movement and collision of the one ball game"""
+
+    name = 'physics'
+
+    def __init__(
+        self,
+        simulation: SimulationState,
+        paddle_rows: np.ndarray,
+        ball_rows: np.ndarray,
+    ) -> None:
+        self.simulation = simulation
+        self.paddle_rows = paddle_rows
+        self.ball_rows = ball_rows
+
+    def update(self, world: World, dt: float) -> None:
+        np.copyto(world['previous_position'], world['position'])
+        step(self.simulation, world.resources['inputs'], dt)
+        self.publish(world)
+
+    def publish(self, world: World, with_events: bool = True) -> None:
+        """Copies the simulation into the rows, and its events if asked"""
+        simulation = self.simulation
+        position = world['position']
+        velocity = world['velocity']
+        for row, paddle in zip(
+            self.paddle_rows, (simulation.paddle_1, simulation.paddle_2)
+        ):
+            position[row] = paddle.x, paddle.y
+            velocity[row] = 0.0, paddle.vy
+        ball = simulation.ball
+        position[self.ball_rows] = ball.x, ball.y
+        velocity[self.ball_rows] = ball.vx, ball.vy
+
+        if not (with_events and simulation.events):
+            world.resources['events'] = NO_EVENTS
+            return
+        kinds, xs, ys = zip(*simulation.events)
+        world.resources['events'] = (np.asarray(kinds), xs, ys)
+        if EVENT_GOAL in kinds:
+            # Served from the centre: no sliding there from the wall
+            world['previous_position'][self.ball_rows] = ball.x, ball.y
+
+
+class RollbackPhysicsSystem(PhysicsSystem):
+    """
+    Physics of an online match: the session steps the simulation with the
+    local input and the predicted remote one, see netplay
+    """
+
+    def __init__(
+        self,
+        session: RollbackSession,
+        read_input: Callable[[], int],
+        paddle_rows: np.ndarray,
+        ball_rows: np.ndarray,
+    ) -> None:
+        super().__init__(session.state, paddle_rows, ball_rows)
+        self.session = session
+        self.read_input = read_input
+        self.advanced = False  # Whether the last tick stepped
+
+    def update(self, world: World, dt: float) -> None:
+        np.copyto(world['previous_position'], world['position'])
+        self.advanced = self.session.advance(
+            local_input=self.read_input(), now=perf_counter()
+        )
+        # Published even when stalled, as a rollback may have moved things
+        self.publish(world, with_events=self.advanced)
+
+
+class MultiBallPhysicsSystem(System):
+    """Movement and collision of the multi ball game"""
+
+    name = 'physics'
+
+    def __init__(
+        self,
+        simulation: MultiBallSimulation,
+        paddle_rows: np.ndarray,
+        ball_rows: np.ndarray,
+    ) -> None:
+        self.simulation = simulation
+        self.paddle_rows = paddle_rows
+        self.ball_rows = ball_rows
+
+    def update(self, world: World, dt: float) -> None:
+        simulation = self.simulation
+        position = world['position']
+        velocity = world['velocity']
+        np.copyto(world['previous_position'], position)
+        simulation.step(world.resources['inputs'], dt)
+
+        # Every row of the batch holds the same paddles
+        position[self.paddle_rows, 0] = simulation.paddle_x[0]
+        position[self.paddle_rows, 1] = simulation.paddle_y[0]
+        velocity[self.paddle_rows, 1] = simulation.paddle_vy[0]
+        position[self.ball_rows, 0] = simulation.ball_x
+        position[self.ball_rows, 1] = simulation.ball_y
+        velocity[self.ball_rows, 0] = simulation.ball_vx
+        velocity[self.ball_rows, 1] = simulation.ball_vy
+
+        if simulation.events:
+            world.resources['events'] = tuple(
+                np.concatenate(column) for column in zip(*simulation.events)
+            )
+        else:
+            world.resources['events'] = NO_EVENTS
+
+
+class AudioSystem(System):
+    """Plays a sound on the ticks with events"""
+
+    name = 'audio'
+
+    def __init__(self, sound_effects, sound: str = 'tuc') -> None:
+        self.sound_effects = sound_effects
+        self.sound = sound
+
+    def update(self, world: World, dt: float) -> None:
+        # Sound effects play a sound once per flush however often asked
+        if len(world.resources['events'][0]):
+            self.sound_effects.play(self.sound)
+
+
+class TelemetrySystem(System):
+    """
+    Emits the bounces, goals and rallies of the one ball game to telemetry,
+    with the ball speed after each bounce
+    """
+
+    name = 'telemetry'
+
+    def __init__(
+        self,
+        telemetry: Telemetry,
+        simulation: SimulationState,
+        ball_rows: np.ndarray,
+    ) -> None:
+        self.telemetry = telemetry
+        self.simulation = simulation
+        self.ball_row = ball_rows[0]
+        self.hits = 0  # Paddle hits of the rally
+        self.rally_time = 0.0
+        self.rally_started = False
+
+    def update(self, world: World, dt: float) -> None:
+        telemetry = self.telemetry
+        vx, vy = world['velocity'][self.ball_row]
+        speed = float(np.hypot(vx, vy))
+        if not self.rally_started:
+            self.rally_started = True
+            telemetry.emit(RALLY_START, speed)
+        self.rally_time += dt
+        kinds, xs, ys = world.resources['events']
+        for kind, x, y in zip(kinds.tolist(), xs, ys):
+            if kind == EVENT_PADDLE_HIT:
+                self.hits += 1
+                telemetry.emit(PADDLE_HIT, x, y, speed)
+            elif kind == EVENT_WALL_BOUNCE:
+                telemetry.emit(WALL_BOUNCE, x, y, speed)
+            elif kind == EVENT_GOAL:
+                # Behind the left paddle, the right side scored
+                scorer = 2 if x < WINDOW_WIDTH / 2 else 1
+                telemetry.emit(RALLY_END, scorer, self.hits, self.rally_time)
+                telemetry.emit(
+                    GOAL,
+                    scorer,
+                    self.simulation.score_1,
+                    self.simulation.score_2,
+                )
+                self.hits = 0
+                self.rally_time = 0.0
+                # The next rally starts on the next tick, with the serve
+                self.rally_started = False
+
+
+class EffectsSystem(System):
+    """
+    Sparks at the contact points of the events of spark_colors' kinds, and
+    trails behind the entities with a trail
+    """
+
+    name = 'effects'
+
+    def __init__(
+        self, particles: ParticleSystem, spark_colors: dict[int, tuple]
+    ) -> None:
+        self.particles = particles
+        self.spark_colors = spark_colors
+
+    def update(self, world: World, dt: float) -> None:
+        particles = self.particles
+        particles.update(dt)
+        kinds, xs, ys = world.resources['events']
+        if len(kinds):
+            xs = np.asarray(xs)
+            ys = np.asarray(ys)
+            for kind, color in self.spark_colors.items():
+                sparks = kinds == kind
+                if sparks.any():
+                    particles.burst(
+                        xs[sparks],
+                        ys[sparks],
+                        count=PARTICLE_SPARKS,
+                        speed=PARTICLE_SPARK_SPEED,
+                        lifetime=PARTICLE_SPARK_LIFETIME,
+                        color=color,
+                    )
+        rows = world.query('position', 'trail')
+        if len(rows):
+            position = world['position'][rows]
+            particles.emit(
+                position[:, 0],
+                position[:, 1],
+                0.0,
+                0.0,
+                PARTICLE_TRAIL_LIFETIME,
+                COLOR_TRAIL,
+            )
+
+    def render(self, world: World, alpha: float) -> None:
+        self.particles.sync()
+
+
+class RenderSystem(System):
+    """
+    Draws the renderables at their position blended from the last tick's,
+    one ShapeMesh per kind of shape, rebuilt when entities come or go
+    """
+
+    name = 'shapes'
+
+    def __init__(self, batch: Batch = None, group: Group = None) -> None:
+        self.batch = batch
+        self.group = group
+        self.meshes: list[tuple[np.ndarray, ShapeMesh]] = []
+        self._version = None
+
+    def render(self, world: World, alpha: float) -> None:
+        if world.version != self._version:
+            self._build(world)
+        previous = world['previous_position']
+        position = world['position']
+        for rows, mesh in self.meshes:
+            start = previous[rows]
+            mesh.sync(start + (position[rows] - start) * alpha)
+
+    def _build(self, world: World) -> None:
+        for _, mesh in self.meshes:
+            mesh.delete()
+        self.meshes.clear()
+        rows = world.query('position', 'shape', 'collider', 'color')
+        shapes = world['shape'][rows]
+        for kind in (SHAPE_BOX, SHAPE_CIRCLE):
+            kind_rows = rows[shapes == kind]
+            if len(kind_rows):
+                mesh = ShapeMesh(
+                    kind,
+                    world['collider'][kind_rows],
+                    world['color'][kind_rows],
+                    batch=self.batch,
+                    group=self.group,
+                )
+                self.meshes.append((kind_rows, mesh))
+        self._version = world.version
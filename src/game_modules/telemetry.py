@@ -0,0 +1,294 @@
+"""
+Gameplay telemetry.
+
+emit() stores the time, kind and fields of an event in the slots of three
+preallocated rings and returns: no lock, no I/O, no formatting and no
+container built on the game loop beyond the tuple of fields. That is about
+0.7 us per event, see the telemetry.emit benchmark. A background thread wakes
+up every flush interval and writes the events emitted since its last pass
+in one batch, as JSON lines or as compact binary records, rotating the
+file once it grows past max_bytes like logging's RotatingFileHandler.
+
+Each session appends to the file, after a session header with the wall
+clock time it started: event times count from there, and read_events
+tags every event with the start of its session.
+
+The rings have a single writer, the game loop, and a single reader, the
+flush thread, which only reads slots below the emitted count. Should the
+game lap the thread, the overwritten events are counted in dropped rather
+than waited for.
+
+Run `python -m game_modules.telemetry FILE...` from the src directory to
+summarize files of either format, or to convert them to JSON lines.
+"""
+import json
+from argparse import ArgumentParser
+from os import replace
+from pathlib import Path
+from struct import calcsize, pack, unpack_from
+from sys import exit, stdout
+from threading import Event, Thread
+from time import perf_counter, time
+from typing import Iterator
+
+from .consts import (
+    TELEMETRY_BACKUPS,
+    TELEMETRY_CAPACITY,
+    TELEMETRY_FLUSH_INTERVAL,
+    TELEMETRY_MAX_BYTES,
+)
+
+# Event kinds, the index of their entry in EVENTS
+RALLY_START = 0
+RALLY_END = 1
+PADDLE_HIT = 2
+WALL_BOUNCE = 3
+GOAL = 4
+MATCH_END = 5
+STATE_ENTER = 6
+STATE_EXIT = 7
+HITCH = 8
+
+# Kind => (name, field names, struct format of the fields in binary files)
+EVENTS = (
+    ('rally_start', ('speed',), '<f'),
+    ('rally_end', ('scorer', 'hits', 'duration'), '<BHf'),
+    ('paddle_hit', ('x', 'y', 'speed'), '<fff'),
+    ('wall_bounce', ('x', 'y', 'speed'), '<fff'),
+    ('goal', ('scorer', 'score_1', 'score_2'), '<BBB'),
+    ('match_end', ('winner', 'score_1', 'score_2', 'duration'), '<BBBf'),
+    ('state_enter', ('state',), '<32p'),
+    ('state_exit', ('state',), '<32p'),
+    ('hitch', ('frame_time',), '<f'),
+)
+
+# Binary files: a header, then records of a time since the session start,
+# a kind and the fields of that kind. A session record, with the wall clock
+# time the session started, comes first in each session. Version 1 files
+# hold one session, started at the time in their header.
+_MAGIC = b'PTEL'
+_VERSION = 2
+_HEADER = '<4sB'
+_HEADER_V1 = '<4sBd'
+_RECORD = '<dB'
+_SESSION = 255  # Kind of session records
+_SESSION_FIELDS = '<d'
+
+
+class Telemetry:
+    def __init__(
+        self,
+        path: str,
+        format: str = 'jsonl',
+        capacity: int = TELEMETRY_CAPACITY,
+        max_bytes: int = TELEMETRY_MAX_BYTES,
+        backups: int = TELEMETRY_BACKUPS,
+        flush_interval: float = TELEMETRY_FLUSH_INTERVAL,
+    ) -> None:
+        """capacity is rounded up to a power of two"""
+        if format not in ('jsonl', 'binary'):
+            raise ValueError(f'Unknown telemetry format {format!r}')
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.format = format
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()
+        self.emitted = 0  # Events since the start, the next one's slot
+        self.flushed = 0  # Events the thread has been through
+        self.dropped = 0  # Overwritten before the thread got to them
+        self.started = time()
+        self._origin = perf_counter()
+        # Parallel rings, an event is the same slot of each
+        self._times = [0.0] * self.capacity
+        self._kinds = [0] * self.capacity
+        self._fields = [()] * self.capacity
+        self._mask = self.capacity - 1
+        self._file = None
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='telemetry', daemon=True)
+        self._thread.start()
+
+    def emit(self, kind: int, *fields) -> None:
+        """Records an event of a kind, with the fields EVENTS lists for it"""
+        index = self.emitted
+        slot = index & self._mask
+        self._times[slot] = perf_counter()
+        self._kinds[slot] = kind
+        self._fields[slot] = fields
+        self.emitted = index + 1
+
+    def close(self) -> None:
+        """Writes the events left and closes the file"""
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        self._open()
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self._flush()
+            self._flush()
+        finally:
+            self._file.close()
+
+    def _flush(self) -> None:
+        end = self.emitted
+        start = max(self.flushed, end - self.capacity)
+        self.dropped += start - self.flushed
+        mask = self._mask
+        events = [
+            (
+                self._times[index & mask],
+                self._kinds[index & mask],
+                self._fields[index & mask],
+            )
+            for index in range(start, end)
+        ]
+        # The game may have lapped the ring while the slots were read, and
+        # be halfway through writing the slot after the last one it counted
+        overwritten = min(
+            max(self.emitted + 1 - self.capacity - start, 0), len(events)
+        )
+        if overwritten:
+            self.dropped += overwritten
+            events = events[overwritten:]
+        self.flushed = end
+        if not events:
+            return
+        if self.format == 'jsonl':
+            data = ''.join(map(self._json_line, events)).encode()
+        else:
+            data = b''.join(map(self._record, events))
+        if self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def _json_line(self, event: tuple) -> str:
+        now, kind, fields = event
+        name, field_names, _ = EVENTS[kind]
+        line = {'t': round(now - self._origin, 6), 'event': name}
+        line.update(zip(field_names, fields))
+        return json.dumps(line) + '\n'
+
+    def _record(self, event: tuple) -> bytes:
+        now, kind, fields = event
+        fields = [
+            field.encode() if isinstance(field, str) else field
+            for field in fields
+        ]
+        return pack(_RECORD, now - self._origin, kind) + pack(
+            EVENTS[kind][2], *fields
+        )
+
+    def _open(self) -> None:
+        self._file = open(self.path, 'ab')
+        if self.format == 'jsonl':
+            header = {'format': 'pypong-telemetry', 'started': self.started}
+            self._file.write(json.dumps(header).encode() + b'\n')
+            return
+        if self._file.tell() == 0:
+            self._file.write(pack(_HEADER, _MAGIC, _VERSION))
+        self._file.write(
+            pack(_RECORD, 0.0, _SESSION) + pack(_SESSION_FIELDS, self.started)
+        )
+
+    def _rotate(self) -> None:
+        """path.1 becomes path.2 and so on, path becomes path.1"""
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f'{self.path.name}.{index}')
+            if older.exists():
+                replace(older, f'{self.path}.{index + 1}')
+        if self.backups:
+            replace(self.path, f'{self.path}.1')
+        else:
+            self.path.unlink()
+        self._open()
+
+
+def read_events(path: str) -> Iterator[dict]:
+    """
+    The events of a telemetry file of either format, as dicts. Their
+    'session' is the wall clock time their session started.
+    """
+    data = Path(path).read_bytes()
+    if data.startswith(_MAGIC):
+        _, version = unpack_from(_HEADER, data)
+        session = None
+        offset = calcsize(_HEADER)
+        if version == 1:
+            _, _, session = unpack_from(_HEADER_V1, data)
+            offset = calcsize(_HEADER_V1)
+        while offset < len(data):
+            now, kind = unpack_from(_RECORD, data, offset)
+            offset += calcsize(_RECORD)
+            if kind == _SESSION:
+                (session,) = unpack_from(_SESSION_FIELDS, data, offset)
+                offset += calcsize(_SESSION_FIELDS)
+                continue
+            name, field_names, fields_format = EVENTS[kind]
+            fields = unpack_from(fields_format, data, offset)
+            offset += calcsize(fields_format)
+            event = {'session': session, 't': round(now, 6), 'event': name}
+            for field_name, value in zip(field_names, fields):
+                if isinstance(value, bytes):
+                    value = value.decode()
+                elif isinstance(value, float):
+                    value = round(value, 3)
+                event[field_name] = value
+            yield event
+        return
+    session = None
+    for line in data.decode().splitlines():
+        event = json.loads(line)
+        if 'format' in event:
+            session = event['started']
+            continue
+        yield {'session': session, **event}
+
+
+def summarize(events: list[dict]) -> str:
+    counts = {}
+    for event in events:
+        counts[event['event']] = counts.get(event['event'], 0) + 1
+    lines = [f'{name:<12} {count:8d}' for name, count in counts.items()]
+    rallies = [event for event in events if event['event'] == 'rally_end']
+    if rallies:
+        hits = sorted(rally['hits'] for rally in rallies)
+        duration = sum(rally['duration'] for rally in rallies) / len(rallies)
+        lines.append(
+            f'rallies: {hits[len(hits) // 2]} hits median, {hits[-1]} max, '
+            f'{duration:.1f} s on average'
+        )
+    hits = [
+        event['speed'] for event in events if event['event'] == 'paddle_hit'
+    ]
+    if hits:
+        lines.append(
+            f'ball speed at paddle hits: {min(hits):.0f}-{max(hits):.0f}'
+        )
+    return '\n'.join(lines)
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m game_modules.telemetry')
+    parser.add_argument('paths', nargs='+', metavar='FILE')
+    parser.add_argument(
+        '--jsonl', action='store_true', help='Print the events as JSON lines'
+    )
+    args = parser.parse_args()
+
+    events = [event for path in args.paths for event in read_events(path)]
+    if args.jsonl:
+        for event in events:
+            stdout.write(json.dumps(event) + '\n')
+    else:
+        print(summarize(events))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
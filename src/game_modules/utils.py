@@ -2,3 +2,17 @@ def center_image(image) -> None:
     """Sets an image's anchor point to its center"""
     image.anchor_x = image.width / 2
     image.anchor_y = image.height / 2
+
+
+def lerp(start: float, end: float, alpha: float) -> float:
+    """Linear interpolation between start and end, alpha in [0, 1]"""
+    return start + (end - start) * alpha
+
+
+def count_draw_calls(batch) -> int:
+    """Returns how many GL draw calls a batch issues on each draw"""
+    return sum(
+        len(domains)
+        for group, domains in batch.group_map.items()
+        if group.visible
+    )
@@ -0,0 +1,14 @@
+"""
+Pixel-diff regression checks of the game rendering.
+
+Run from the src directory with `python -m render_checks`. Each scene is
+drawn headless (offscreen EGL) from a fixed seed and compared with its
+reference image, so they run on CI machines without a display or GPU
+(Mesa's software rasterizer draws them). pyglet is switched to headless
+mode with the silent audio driver here, before anything imports
+pyglet.window.
+"""
+import pyglet
+
+pyglet.options['headless'] = True
+pyglet.options['audio'] = ('silent',)
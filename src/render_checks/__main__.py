@@ -0,0 +1,59 @@
+"""
+Usage, from the src directory:
+
+    python -m render_checks                   # compare every scene
+    python -m render_checks -k gameplay       # only names containing it
+    python -m render_checks --update          # store new references
+    python -m render_checks --output diffs    # save images of failures
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from sys import exit
+
+from . import scenes  # noqa: F401 (registers the scenes)
+from .runner import SCENES, run_checks
+
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m render_checks')
+    parser.add_argument(
+        '-k', '--filter', default='', help='Only check names containing this'
+    )
+    parser.add_argument(
+        '--update',
+        action='store_true',
+        help='Store the rendered scenes as the new references',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=int,
+        default=16,
+        help='Channel difference ignored, for rasterizer rounding',
+    )
+    parser.add_argument(
+        '--max-differing',
+        type=float,
+        default=0.001,
+        help='Share of differing pixels allowed (0.001 = 0.1%%)',
+    )
+    parser.add_argument(
+        '--output',
+        metavar='DIR',
+        type=Path,
+        help='Save the rendered and diff images of failed scenes to DIR',
+    )
+    args = parser.parse_args()
+
+    names = [name for name in SCENES if args.filter in name]
+    failures = run_checks(
+        names=names,
+        tolerance=args.tolerance,
+        max_differing=args.max_differing,
+        update=args.update,
+        output_dir=args.output,
+    )
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    exit(main())
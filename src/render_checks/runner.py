@@ -0,0 +1,123 @@
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from pyglet.image import load as load_image
+
+from game_modules.capture import encode_png, read_pixels
+
+# Scene name => setup function. A setup function receives the game, with no
+# state on its stack, and pushes and advances what the scene shows.
+SCENES: dict[str, Callable] = {}
+
+REFERENCES_DIR = Path(__file__).resolve().parent / 'references'
+
+# Every scene starts its matches from this seed
+SEED = 1
+
+
+def scene(name: str) -> Callable:
+    def register(setup: Callable) -> Callable:
+        SCENES[name] = setup
+        return setup
+
+    return register
+
+
+def make_game():
+    # Imported here: creating the window needs the headless options set by
+    # the package first
+    from game import Game
+    from game_modules.audio import NullAudioBackend, SoundEffects
+
+    return Game(
+        sound_effects=SoundEffects(backend=NullAudioBackend()), vsync=False
+    )
+
+
+def render_scene(game, setup: Callable) -> np.ndarray:
+    """Draws a scene, returns it as (height, width, 4) RGBA rows from top"""
+    while game.states:
+        game.pop_state()
+    game.seed = SEED
+    game.cpu_difficulty = None
+    game.ball_count = 1
+    game.accumulator = 0.0
+    game.interpolation_alpha = 1.0
+    setup(game)
+    game.switch_to()
+    game.on_draw()
+    return read_pixels(*game.get_framebuffer_size())
+
+
+def load_png(path: Path) -> np.ndarray:
+    image = load_image(str(path)).get_image_data()
+    # A negative pitch asks for the rows from the top
+    pixels = image.get_data('RGBA', -image.width * 4)
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(
+        image.height, image.width, 4
+    )
+
+
+def compare(
+    actual: np.ndarray, reference: np.ndarray, tolerance: int
+) -> np.ndarray:
+    """Mask of the pixels with a channel off by more than tolerance"""
+    difference = np.abs(actual.astype(np.int16) - reference.astype(np.int16))
+    return difference.max(axis=2) > tolerance
+
+
+def diff_image(actual: np.ndarray, differing: np.ndarray) -> np.ndarray:
+    """The actual frame dimmed, with the differing pixels in red"""
+    image = actual // 4
+    image[..., 3] = 255
+    image[differing] = (255, 0, 0, 255)
+    return image
+
+
+def run_checks(
+    names: list[str],
+    tolerance: int,
+    max_differing: float,
+    update: bool = False,
+    output_dir: Path = None,
+) -> list[str]:
+    """
+    Renders each scene and compares it with its reference, or stores it as
+    the new reference with update. Returns the names of the scenes that
+    differ in more than max_differing of their pixels, as a fraction.
+    """
+    game = make_game()
+    failures = []
+    for name in names:
+        actual = render_scene(game, SCENES[name])
+        reference_path = REFERENCES_DIR / f'{name}.png'
+        if update:
+            reference_path.write_bytes(encode_png(actual, level=9))
+            print(f'{name:<24} updated')
+            continue
+        if not reference_path.exists():
+            print(f'{name:<24} no reference, run with --update')
+            failures.append(name)
+            continue
+        reference = load_png(reference_path)
+        if reference.shape != actual.shape:
+            print(f'{name:<24} size {actual.shape} != {reference.shape}')
+            failures.append(name)
+            continue
+        differing = compare(actual, reference, tolerance)
+        share = np.count_nonzero(differing) / differing.size
+        if share <= max_differing:
+            print(f'{name:<24} {share:8.4%} differing')
+        else:
+            print(f'{name:<24} {share:8.4%} differing  FAIL')
+            failures.append(name)
+            if output_dir is not None:
+                output_dir.mkdir(parents=True, exist_ok=True)
+                (output_dir / f'{name}.actual.png').write_bytes(
+                    encode_png(actual)
+                )
+                (output_dir / f'{name}.diff.png').write_bytes(
+                    encode_png(diff_image(actual, differing))
+                )
+    return failures
@@ -0,0 +1,46 @@
+from game_modules.game_states import MainMenuState, OptionMenuState
+from game_modules.gameplay_states import GameplayState, MultiBallGameplayState
+
+from .runner import scene
+
+
+def advance(game, seconds: float) -> None:
+    """Runs the ticks of that much game time"""
+    for _ in range(round(seconds / game.tick_interval)):
+        game.update(dt=game.tick_interval)
+
+
+@scene('main_menu')
+def main_menu(game):
+    game.push_state(game.get_state(MainMenuState))
+
+
+@scene('option_menu')
+def option_menu(game):
+    game.push_state(game.get_state(MainMenuState))
+    game.push_state(game.get_state(OptionMenuState))
+
+
+@scene('gameplay')
+def gameplay(game):
+    game.cpu_difficulty = 'hard'
+    game.push_state(GameplayState(game=game))
+    # Far enough in for the ball to have a trail
+    advance(game, seconds=1.0)
+
+
+@scene('gameplay.match_end')
+def gameplay_match_end(game):
+    game.cpu_difficulty = 'hard'
+    state = GameplayState(game=game)
+    game.push_state(state)
+    while state.winner is None:
+        advance(game, seconds=1.0)
+
+
+@scene('multiball')
+def multiball(game):
+    game.cpu_difficulty = 'hard'
+    game.ball_count = 100
+    game.push_state(MultiBallGameplayState(game=game))
+    advance(game, seconds=1.0)